@@ -0,0 +1,32 @@
+from typing import Iterable, Optional, Type
+
+from django.conf import settings
+from django.db import models
+
+
+def bulk_history_create(model: Type[models.Model],
+                        objs: Iterable[models.Model],
+                        batch_size: Optional[int] = None,
+                        update: bool = True):
+    """
+    History rows of objects written without `.save()`, by the current
+    request user. Skipped for models without history and if
+    `SOFT_DELETE_BATCH_HISTORY` setting is off.
+    """
+    # shortcuts import this module while their package is loading
+    from .shortcuts.request import get_current_request
+
+    manager_name = getattr(
+        model._meta, 'simple_history_manager_attribute', None)  # noqa: pylint=protected-access
+    objs = list(objs)
+    if not manager_name or not objs:
+        return
+    if not getattr(settings, 'SOFT_DELETE_BATCH_HISTORY', True):
+        return
+
+    user = getattr(get_current_request(), 'user', None)
+    if user is not None and not user.is_authenticated:
+        user = None
+    getattr(model, manager_name).bulk_history_create(
+        objs, batch_size=batch_size, update=update, default_user=user,
+        default_change_reason=None)
@@ -0,0 +1,114 @@
+import threading
+from typing import Dict, FrozenSet, NamedTuple, Tuple, Type
+
+from django.db import models
+from django.db.models.signals import class_prepared
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+
+
+class ModelMeta(NamedTuple):
+    """
+    Model field metadata computed once per model.
+    """
+    # fields and reverse relations by name, concrete fields by attname
+    # too, the primary key by `pk` alias too
+    fields: Dict[str, models.Field]
+    # concrete fields by name and attname, the primary key by `pk` too
+    concrete_fields: Dict[str, models.Field]
+    editable_names: FrozenSet[str]
+    # many to many fields and reverse relations
+    m2m_names: FrozenSet[str]
+    # foreign key attnames by field name
+    fk_attnames: Dict[str, str]
+    # field names of unique fields, unique_together, unique constraints
+    # without condition and unique_for_date/month/year pairs
+    unique_groups: Tuple[Tuple[str, ...], ...]
+    # fields `.save()` changes by itself: `auto_now` dates and version
+    auto_update_names: Tuple[str, ...]
+
+
+_META: Dict[Type[models.Model], ModelMeta] = {}
+_LOCK = threading.Lock()
+
+
+def _get_unique_groups(model):
+    opts = model._meta
+    groups = [tuple(fields) for fields in opts.unique_together]
+    for constraint in getattr(opts, 'total_unique_constraints', ()):
+        groups.append(tuple(constraint.fields))
+    for field in opts.concrete_fields:
+        if field.unique:
+            groups.append((field.name, ))
+        for option in ('unique_for_date', 'unique_for_month',
+                       'unique_for_year'):
+            date_field = getattr(field, option, None)
+            if date_field:
+                groups.append((field.name, date_field))
+    return tuple(dict.fromkeys(groups))
+
+
+def _get_auto_update_names(model):
+    from .models.versioned import Versioned
+
+    names = [
+        field.name for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False)]
+    if issubclass(model, Versioned):
+        names.append('version')
+    return tuple(names)
+
+
+def _build_model_meta(model) -> ModelMeta:
+    opts = model._meta
+    concrete_fields = {}
+    for field in opts.concrete_fields:
+        concrete_fields[field.attname] = field
+        concrete_fields[field.name] = field
+    concrete_fields['pk'] = opts.pk
+    return ModelMeta(
+        fields={
+            **{field.name: field for field in opts.get_fields()},
+            **concrete_fields},
+        concrete_fields=concrete_fields,
+        editable_names=frozenset(
+            field.name for field in opts.concrete_fields if field.editable),
+        m2m_names=frozenset(
+            field.name for field in opts.get_fields()
+            if field.get_internal_type() == 'ManyToManyField'),
+        fk_attnames={
+            field.name: field.attname for field in opts.concrete_fields
+            if field.is_relation},
+        unique_groups=_get_unique_groups(model),
+        auto_update_names=_get_auto_update_names(model))
+
+
+def get_model_meta(model) -> ModelMeta:
+    """
+    Cached `ModelMeta` of the model, safe to call from several threads.
+    """
+    meta = _META.get(model)
+    if meta is None:
+        with _LOCK:
+            meta = _META.get(model)
+            if meta is None:
+                meta = _build_model_meta(model)
+                _META[model] = meta
+    return meta
+
+
+def clear_model_meta():
+    with _LOCK:
+        _META.clear()
+
+
+@receiver(class_prepared)
+def _clear_meta_on_class_prepared(sender, **kwargs):
+    # a new or reloaded model may add reverse relations to cached ones
+    clear_model_meta()
+
+
+@receiver(setting_changed)
+def _clear_meta_on_setting_changed(setting, **kwargs):
+    if setting == 'INSTALLED_APPS':
+        clear_model_meta()
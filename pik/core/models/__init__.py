@@ -1,5 +1,6 @@
 from .dated import Dated
-from .soft_deleted import SoftDeleted
+from .soft_deleted import SoftDeleted, soft_index, soft_unique_constraint
+from .soft_deleted_archive import SoftDeletedArchive
 from .owned import NullOwned, Owned
 from .uided import Uided, PUided
 from .versioned import Versioned
@@ -7,5 +8,6 @@ from .historized import Historized
 from .base import BasePHistorical, BaseHistorical
 
 __all__ = [
-    'Dated', 'SoftDeleted', 'NullOwned', 'Owned', 'Uided', 'PUided',
+    'Dated', 'SoftDeleted', 'SoftDeletedArchive', 'soft_index',
+    'soft_unique_constraint', 'NullOwned', 'Owned', 'Uided', 'PUided',
     'Versioned', 'Historized', 'BasePHistorical', 'BaseHistorical']
@@ -3,14 +3,22 @@ from operator import attrgetter
 
 import six
 from django.conf import settings
-from django.db import transaction
-from django.db.models import signals, sql
+from django.db import models, transaction
+from django.db.models import F, signals, sql
 from django.db.models.deletion import Collector
 from django.db.models.fields.related import ForeignObject
 from django.utils.timezone import now
-from django.utils.translation import gettext_lazy as _
+from simple_history.models import HistoricalRecords
+
+from ..history import bulk_history_create
+from ..shortcuts.identity_map import (
+    _invalidate_identity_map, invalidate_identity_map)
+from .signals import (
+    has_soft_delete_batch_receivers, post_soft_delete_batch,
+    pre_soft_delete_batch)
 
 FIELD = 'deleted'
+VERSION_FIELD = 'version'
 
 
 class DeleteNotSoftDeletedModel(Exception):
@@ -25,11 +33,190 @@ def _is_soft_excluded(model):
     return False
 
 
+def _has_save_receivers(model):
+    """
+    Check `pre_save`/`post_save` receivers except simple history ones:
+    history rows are written in bulk by set-based updates, and the
+    identity map one: set-based updates invalidate the map themselves.
+    """
+    for signal in (signals.pre_save, signals.post_save):
+        for receiver in signal._live_receivers(model):  # noqa: protected-access
+            if receiver is _invalidate_identity_map:
+                continue
+            if not isinstance(
+                    getattr(receiver, '__self__', None), HistoricalRecords):
+                return True
+    return False
+
+
+def _has_save_override(model):
+    """
+    Check `save()` overrides except `Versioned` one: its version increment
+    is mirrored by `_save_values()`.
+    """
+    from .versioned import Versioned
+
+    return any(
+        'save' in vars(klass) for klass in model.__mro__
+        if klass not in (models.Model, Versioned))
+
+
+def _save_values(model, time):
+    """
+    Column values `.save()` changes by itself: `auto_now` dates and version.
+    Used by set-based updates which bypass `.save()`.
+    """
+    from .versioned import Versioned
+
+    values = {}
+    for field in model._meta.concrete_fields:
+        if not getattr(field, 'auto_now', False):
+            continue
+        if isinstance(field, models.DateTimeField):
+            values[field.attname] = time
+        elif isinstance(field, models.DateField):
+            values[field.attname] = time.date()
+    if issubclass(model, Versioned) and model.autoincrement_version:
+        values[VERSION_FIELD] = F(VERSION_FIELD) + 1
+    return values
+
+
+def _soft_delete_values(model, time):
+    """
+    Column values written by set-based soft deletion. Mirrors what
+    `.save()` would change: `deleted` mark, `auto_now` dates and version.
+    """
+    return {FIELD: time, **_save_values(model, time)}
+
+
+def _set_soft_deleted_values(instance, values):
+    for attname, value in values.items():
+        if attname == VERSION_FIELD:
+            value = getattr(instance, VERSION_FIELD) + 1
+        setattr(instance, attname, value)
+
+
+def _batch_soft_delete(model, instances, time, using):
+    """
+    Mark instances deleted with one `UPDATE ... WHERE pk IN (...)` per
+    chunk and write their history rows with a bulk insert.
+    """
+    batch_size = getattr(settings, 'SOFT_DELETE_BATCH_SIZE', 1000)
+    values = _soft_delete_values(model, time)
+    pk_list = [obj.pk for obj in instances]
+
+    count = 0
+    queryset = model._base_manager.using(using)
+    for offset in range(0, len(pk_list), batch_size):
+        count += queryset.filter(
+            pk__in=pk_list[offset:offset + batch_size]).update(**values)
+
+    for instance in instances:
+        _set_soft_deleted_values(instance, values)
+    bulk_history_create(model, instances, batch_size)
+    return count
+
+
+def _historized_update(queryset, values):
+    """
+    `queryset.update(**values)` with bulk history rows. History rows need
+    instances, so with history the pks are fetched first and the rows are
+    updated and historized by chunks.
+    """
+    model = queryset.model
+    if not (getattr(model._meta, 'simple_history_manager_attribute', None)
+            and getattr(settings, 'SOFT_DELETE_BATCH_HISTORY', True)):
+        return queryset.update(**values)
+
+    batch_size = getattr(settings, 'SOFT_DELETE_BATCH_SIZE', 1000)
+    pk_list = list(queryset.values_list('pk', flat=True))
+    count = 0
+    for offset in range(0, len(pk_list), batch_size):
+        chunk = model._base_manager.using(queryset.db).filter(
+            pk__in=pk_list[offset:offset + batch_size])
+        count += chunk.update(**values)
+        bulk_history_create(model, list(chunk), batch_size)
+    return count
+
+
+def _fast_soft_delete(queryset, time):
+    """
+    Soft delete a fast delete queryset with one `UPDATE`, already deleted
+    rows are skipped.
+    """
+    return _historized_update(
+        queryset.filter(**{f'{FIELD}__isnull': True}),
+        _soft_delete_values(queryset.model, time))
+
+
+def _batch_field_updates(model, instances_for_fieldvalues, time, using):
+    """
+    SET_NULL/SET_DEFAULT/SET() updates with one `UPDATE ... WHERE pk IN (...)`
+    per set of (field, value) changes and pk chunk instead of a `.save()`
+    per instance. A row touched by several fields is updated once and gets
+    one history row with all of them.
+
+    :return: Counter of updated rows by `<model label>.<field name>`
+    """
+    batch_size = getattr(settings, 'SOFT_DELETE_BATCH_SIZE', 1000)
+    save_values = _save_values(model, time)
+    queryset = model._base_manager.using(using)
+
+    changed = {}
+    for (field, value), instances in six.iteritems(instances_for_fieldvalues):
+        for obj in instances:
+            instance, fields = changed.setdefault(obj.pk, (obj, {}))
+            fields[field] = value
+
+    # rows with the same changes are updated together, so `save_values`
+    # (version increment) are applied once per row
+    pk_lists = {}
+    for pk, (_, fields) in changed.items():
+        pk_lists.setdefault(tuple(fields.items()), []).append(pk)
+
+    counter = Counter()
+    for changes, pk_list in pk_lists.items():
+        pk_list.sort()
+        values = {field.name: value for field, value in changes}
+        values.update(save_values)
+        for offset in range(0, len(pk_list), batch_size):
+            count = queryset.filter(
+                pk__in=pk_list[offset:offset + batch_size]).update(**values)
+            for field, _ in changes:
+                counter[f'{model._meta.label}.{field.name}'] += count
+
+    instances = []
+    for instance, fields in changed.values():
+        for field, value in fields.items():
+            setattr(instance, field.name, value)
+        _set_soft_deleted_values(instance, save_values)
+        instances.append(instance)
+    bulk_history_create(model, instances, batch_size)
+    return counter
+
+
+def _get_soft_delete_pk_lists(collector, plans):
+    """
+    Pks of soft deleted rows by model for batch signals, only for models
+    with receivers.
+    """
+    pk_lists = {}
+    for qs in collector.fast_deletes:
+        if plans[qs.model].is_soft and has_soft_delete_batch_receivers(qs.model):
+            pk_lists.setdefault(qs.model, []).extend(qs.filter(**{
+                f'{FIELD}__isnull': True}).values_list('pk', flat=True))
+    for model, instances in collector.data.items():
+        if plans[model].is_soft and has_soft_delete_batch_receivers(model):
+            pk_lists.setdefault(model, []).extend(obj.pk for obj in instances)
+    return pk_lists
+
+
 def _delete(self):
-    from .soft_deleted import SoftDeleted
-    safe_mode = getattr(settings, 'SOFT_DELETE_SAFE_MODE', True)
+    from ._soft_delete_plan import get_soft_delete_plan, not_soft_deleted_error
+    batch_mode = getattr(settings, 'SOFT_DELETE_BATCH_MODE', False)
 
-    time = now()
+    # set by delayed cascades to mark rows with the time of the root
+    time = getattr(self, 'soft_delete_time', None) or now()
 
     # sort instance collections
     for model, instances in self.data.items():
@@ -41,44 +228,68 @@ def _delete(self):
     self.sort()
     # number of objects deleted for each model label
     deleted_counter = Counter()
+    # number of rows updated for each `<model label>.<field name>`
+    self.field_update_counter = Counter()
+
+    plans = {model: get_soft_delete_plan(model) for model in self.data}
+    for model, plan in plans.items():
+        if plan.violates_safe_mode and self.data[model]:
+            raise not_soft_deleted_error(model)
+    for qs in self.fast_deletes:
+        plans.setdefault(qs.model, get_soft_delete_plan(qs.model))
 
     with transaction.atomic(using=self.using, savepoint=False):
+        soft_pk_lists = _get_soft_delete_pk_lists(self, plans)
+        # batch signals of these models are sent by the subquery cascade
+        self.soft_delete_pk_lists = {
+            model: soft_pk_lists.pop(model)
+            for model in getattr(self, 'soft_delete_signal_models', ())
+            if model in soft_pk_lists}
+        for model, pk_list in soft_pk_lists.items():
+            pre_soft_delete_batch.send(
+                sender=model, pk_list=pk_list, deleted_at=time,
+                using=self.using)
+
         # send pre_delete signals
-        for model, obj in self.instances_with_model():
-            if not model._meta.auto_created and not issubclass(  # noqa: pylint=protected-access
-                    model, SoftDeleted):
-
-                if safe_mode and not _is_soft_excluded(model):
-                    raise DeleteNotSoftDeletedModel(
-                        _(f'You are trying to delete {model._meta.object_name} instance,'
-                          f' but {model._meta.object_name} is not subclass of '
-                          f'{SoftDeleted._meta.object_name}. You need to inherit your '
-                          f'model from {SoftDeleted._meta.object_name}'
-                          f' or set settings.SOFT_DELETE_SAFE_MODE to False'))
+        for model, instances in self.data.items():
+            # Do not send pre_delete signals for SoftDeleted models because
+            # we are using `.save()` for soft deletion.
+            if not plans[model].sends_delete_signals:
+                continue
+            for obj in instances:
                 signals.pre_delete.send(
                     sender=model, instance=obj, using=self.using
                 )
 
-                # Do not send pre_delete signals because
-                # we are using `.save()` for soft deletion.
-
         # fast deletes
         for qs in self.fast_deletes:
-            if issubclass(qs.model, SoftDeleted):
-                for obj in qs:
+            if plans[qs.model].is_soft and (
+                    batch_mode or not (_has_save_receivers(qs.model)
+                                       or _has_save_override(qs.model))):
+                count = _fast_soft_delete(qs, time)
+            elif plans[qs.model].is_soft:
+                # Django fast deletes ignore save signals and overrides
+                count = 0
+                for obj in qs.filter(**{f'{FIELD}__isnull': True}):
                     setattr(obj, FIELD, time)
                     obj.save()
-                count = qs.count()
+                    count += 1
             else:
                 count = qs._raw_delete(using=self.using)
             deleted_counter[qs.model._meta.label] += count
 
         # update fields
         for model, instances_for_fieldvalues in six.iteritems(self.field_updates):
+            if batch_mode:
+                self.field_update_counter.update(_batch_field_updates(
+                    model, instances_for_fieldvalues, time, self.using))
+                continue
             for (field, value), instances in six.iteritems(instances_for_fieldvalues):
                 for obj in instances:
                     setattr(obj, field.name, value)
                     obj.save()
+                self.field_update_counter[
+                    f'{model._meta.label}.{field.name}'] += len(instances)
 
         # reverse instance collections
         for instances in six.itervalues(self.data):
@@ -86,7 +297,9 @@ def _delete(self):
 
         # delete instances
         for model, instances in six.iteritems(self.data):
-            if issubclass(model, SoftDeleted):
+            if plans[model].is_soft and batch_mode:
+                count = _batch_soft_delete(model, instances, time, self.using)
+            elif plans[model].is_soft:
                 count = len(instances)
 
                 for instance in instances:
@@ -101,7 +314,7 @@ def _delete(self):
                 pk_list = [obj.pk for obj in instances]
                 count = query.delete_batch(pk_list, self.using)
 
-                if not model._meta.auto_created:
+                if plans[model].sends_delete_signals:
                     for obj in instances:
                         signals.post_delete.send(
                             sender=model, instance=obj, using=self.using
@@ -114,27 +327,58 @@ def _delete(self):
                     setattr(obj, model._meta.pk.attname, None)
 
             deleted_counter[model._meta.label] += count
+
+        for model, pk_list in soft_pk_lists.items():
+            post_soft_delete_batch.send(
+                sender=model, pk_list=pk_list, deleted_at=time,
+                using=self.using)
+    invalidate_identity_map(
+        *self.data, *self.field_updates,
+        *(qs.model for qs in self.fast_deletes))
     return sum(deleted_counter.values()), dict(deleted_counter)
 
 
+def _get_restricted_field(field, where_class):
+    """
+    `deleted` field to restrict joins through `field` by, or None if the
+    model is not SoftDeleted, is a multi-table child or all objects are
+    requested.
+    """
+    from .soft_deleted import SoftDeleted, _AllWhereNode
+
+    model = field.model
+    if not issubclass(model, SoftDeleted) or issubclass(where_class, _AllWhereNode):
+        return None
+    for model_field in model._meta.fields:
+        is_multitable_child = (
+                model_field.remote_field and model_field.primary_key and
+                issubclass(model, model_field.remote_field.model))
+
+        if is_multitable_child:
+            return None
+    return model._meta.get_field(FIELD)
+
+
+# (model, field name, where_class) -> `deleted` field or None, fields are
+# not keys: before Django 3.2 fields inherited from one abstract model
+# are equal
+_RESTRICTED_FIELDS: dict = {}
+
+
 def get_extra_restriction_patch(func):
     def wrapper(self, where_class, alias, related_alias):
         cond = func(self, where_class, alias, related_alias)
 
-        from .soft_deleted import SoftDeleted, _AllWhereNode
-
-        if not issubclass(self.model, SoftDeleted) or issubclass(where_class, _AllWhereNode):
+        key = (self.model, self.name, where_class)
+        try:
+            field = _RESTRICTED_FIELDS[key]
+        except KeyError:
+            field = _RESTRICTED_FIELDS[key] = _get_restricted_field(
+                self, where_class)
+        if field is None:
             return cond
-        for field in self.model._meta.fields:
-            is_multitable_child = (
-                    field.remote_field and field.primary_key and
-                    issubclass(self.model, field.remote_field.model))
-
-            if is_multitable_child:
-                return cond
 
         cond = cond or where_class()
-        field = self.model._meta.get_field(FIELD)
         lookup = field.get_lookup('isnull')(field.get_col(related_alias), True)
         cond.add(lookup, 'AND')
 
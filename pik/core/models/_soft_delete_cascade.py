@@ -0,0 +1,401 @@
+from collections import Counter, deque
+from itertools import islice
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.deletion import (
+    Collector, get_candidate_relations_to_delete)
+from django.utils.timezone import now
+
+from ..history import bulk_history_create
+from ..shortcuts.identity_map import invalidate_identity_map
+from ._collector_delete import (
+    FIELD, _has_save_receivers, _historized_update, _save_values,
+    _soft_delete_values)
+from ._soft_delete_plan import check_safe_mode, get_soft_delete_plan
+from .signals import (
+    has_soft_delete_batch_receivers, post_soft_delete_batch,
+    pre_soft_delete_batch)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def _is_set_based(model):
+    """
+    Can rows of the model be soft deleted by an UPDATE without loading them.
+    """
+    from .soft_deleted import SoftDeleted
+
+    if not issubclass(model, SoftDeleted):
+        return False
+    if any(hasattr(field, 'bulk_related_objects')
+           for field in model._meta.private_fields):
+        return False
+    if any(not issubclass(parent, SoftDeleted)
+           for parent in model._meta.get_parent_list()):
+        return False
+    return not _has_save_receivers(model)
+
+
+def _is_history_free(model):
+    return not (
+        getattr(model._meta, 'simple_history_manager_attribute', None)
+        or _has_save_receivers(model))
+
+
+def can_subquery_cascade(model):
+    return (getattr(settings, 'SOFT_DELETE_SUBQUERY_CASCADE', False)
+            and _is_set_based(model))
+
+
+class _FallbackCollector(Collector):
+    """
+    Collector for relations the subquery cascade can't handle set-based.
+    Like `NestedObjects` it skips rows which are already soft deleted.
+    """
+    def can_fast_delete(self, objs, from_field=None):
+        # fast deletes bypass `SOFT_DELETE_SAFE_MODE` check of `.delete()`
+        model = objs._meta.model if hasattr(objs, '_meta') \
+            else getattr(objs, 'model', None)
+        if model and get_soft_delete_plan(model).violates_safe_mode:
+            return False
+        return super().can_fast_delete(objs, from_field)
+
+    def related_objects(self, *args):  # noqa: arguments-differ
+        from .soft_deleted import SoftDeleted
+
+        queryset = super().related_objects(*args)
+        if issubclass(queryset.model, SoftDeleted):
+            queryset = queryset.filter(**{f'{FIELD}__isnull': True})
+        return queryset
+
+
+# nesting of chained level subqueries before a level is re-rooted by pks,
+# SQLite parser stack overflows at about ten levels
+SUBQUERY_MAX_DEPTH = 4
+
+
+class SubqueryCascade:
+    """
+    Soft delete cascade which walks the relation graph at the model level.
+
+    Every CASCADE edge to a SoftDeleted model becomes one
+    `UPDATE child SET deleted=%s WHERE fk IN (<marked parent rows>)` per
+    level, the rows are never loaded into python. Marked rows of a level
+    are the level rows with the delete time, so every level is chained
+    into the next one like in `estimate_delete()` and tables are never
+    scanned by the time. SET_NULL/SET_DEFAULT edges to models without
+    history and save receivers are updated the same way. Other relations
+    (not SoftDeleted models, PROTECT, models with save receivers, ...)
+    are handed over to a regular collector which loads only those rows.
+    """
+    def __init__(self, using, keep_parents=False, time=None):
+        self.using = using
+        self.keep_parents = keep_parents
+        self.time = time or now()
+        self.batch_size = getattr(settings, 'SOFT_DELETE_BATCH_SIZE', 1000)
+        self.collector = _FallbackCollector(using=using)
+        self.counter = Counter()
+        self.field_update_counter = Counter()
+        # (model, marked rows queryset) of every level
+        self._levels = []
+        self._pk_lists = {}
+        self._queue = deque()
+
+    def delete(self, queryset):
+        model = queryset.model
+        queryset = queryset.filter(**{f'{FIELD}__isnull': True})
+        check_safe_mode(model, queryset, self.using)
+        with transaction.atomic(using=self.using, savepoint=False):
+            pk_list = list(queryset.values_list('pk', flat=True))
+            signal_models = self._get_signal_models(model)
+            if signal_models:
+                # rows are not loaded, pks are fetched for receivers only
+                self._pk_lists = {
+                    signal_model: list(pk_set)
+                    for signal_model, pk_set in self._walk_pks(
+                        model, pk_list).items()
+                    if signal_model in signal_models and pk_set}
+                for signal_model, signal_pk_list in self._pk_lists.items():
+                    pre_soft_delete_batch.send(
+                        sender=signal_model, pk_list=signal_pk_list,
+                        deleted_at=self.time, using=self.using)
+                self.collector.soft_delete_signal_models = signal_models
+
+            # marked root rows don't match a default manager queryset
+            # anymore, so the root level is chained by pks
+            for chunk in _chunks(pk_list, self.batch_size):
+                self._mark(model, self._manager(model).filter(pk__in=chunk), 0)
+                while self._queue:
+                    self._cascade(*self._queue.popleft())
+            for level_model, marked in self._levels:
+                self._collect_related(level_model, marked)
+            historized = {}
+            for level_model, marked in self._levels:
+                self._historize(
+                    level_model, marked,
+                    historized.setdefault(level_model, set()))
+
+            if (self.collector.data or self.collector.fast_deletes
+                    or self.collector.field_updates):
+                self.collector.soft_delete_time = self.time
+                _, counter = self.collector.delete()
+                self.counter.update(counter)
+                self.field_update_counter.update(
+                    self.collector.field_update_counter)
+                for signal_model, signal_pk_list in (
+                        self.collector.soft_delete_pk_lists.items()):
+                    self._pk_lists.setdefault(signal_model, []).extend(
+                        signal_pk_list)
+
+            for signal_model, pk_list in self._pk_lists.items():
+                post_soft_delete_batch.send(
+                    sender=signal_model, pk_list=pk_list,
+                    deleted_at=self.time, using=self.using)
+        invalidate_identity_map(*{
+            level_model for level_model, _ in self._levels})
+        return sum(self.counter.values()), dict(self.counter)
+
+    def _manager(self, model):
+        return model._base_manager.using(self.using)
+
+    def _related_objects(self, related, marked):
+        from .soft_deleted import SoftDeleted
+
+        related_model = related.related_model
+        queryset = self._manager(related_model).filter(
+            **{f'{related.field.name}__in': marked})
+        if issubclass(related_model, SoftDeleted):
+            queryset = queryset.filter(**{f'{FIELD}__isnull': True})
+        return queryset
+
+    def _mark(self, model, rows, depth):
+        """
+        Mark live rows of the `rows` queryset deleted, the marked level
+        is `rows` with the delete time.
+        """
+        count = rows.filter(**{f'{FIELD}__isnull': True}).update(
+            **_soft_delete_values(model, self.time))
+        if not count:
+            return
+        self.counter[model._meta.label] += count
+        marked = rows.filter(**{FIELD: self.time})
+        self._enqueue(model, marked, depth)
+        if not self.keep_parents:
+            # MTI parents share the `deleted` column with the child,
+            # but their own relations have to be cascaded too
+            for parent in model._meta.get_parent_list():
+                self.counter[parent._meta.label] += count
+                self._enqueue(
+                    parent,
+                    self._manager(parent).filter(pk__in=marked.values('pk')),
+                    depth + 1, from_child=True)
+
+    def _get_signal_models(self, model):
+        """
+        Models with batch signal receivers the cascade from `model`
+        can reach.
+        """
+        reachable = {model}
+        queue = deque([model])
+        while queue:
+            current = queue.popleft()
+            related_models = [
+                related.related_model
+                for related in get_candidate_relations_to_delete(current._meta)
+                if related.field.remote_field.on_delete == models.CASCADE
+                and _is_set_based(related.related_model)]
+            if not self.keep_parents:
+                related_models.extend(current._meta.get_parent_list())
+            for related_model in related_models:
+                if related_model not in reachable:
+                    reachable.add(related_model)
+                    queue.append(related_model)
+        return {
+            reachable_model for reachable_model in reachable
+            if has_soft_delete_batch_receivers(reachable_model)}
+
+    def _walk_pks(self, model, pk_list):
+        """
+        Pks of live rows the cascade will mark by model, walked before
+        marking like `_cascade`, so every model gets one pre signal.
+        """
+        walked = {}
+        queue = deque([(model, pk_list)])
+        while queue:
+            model, pk_list = queue.popleft()
+            seen = walked.setdefault(model, set())
+            pk_list = [pk for pk in pk_list if pk not in seen]
+            if not pk_list:
+                continue
+            seen.update(pk_list)
+            if not self.keep_parents:
+                # MTI parent rows have the pks of the child rows
+                for parent in model._meta.get_parent_list():
+                    queue.append((parent, pk_list))
+            for related in get_candidate_relations_to_delete(model._meta):
+                related_model = related.related_model
+                if not (related.field.remote_field.on_delete == models.CASCADE
+                        and _is_set_based(related_model)):
+                    continue
+                for chunk in _chunks(pk_list, self.batch_size):
+                    queue.append((related_model, list(
+                        self._manager(related_model).filter(**{
+                            f'{related.field.name}__in':
+                                self._manager(model).filter(pk__in=chunk),
+                            f'{FIELD}__isnull': True,
+                        }).values_list('pk', flat=True))))
+        return walked
+
+    def _enqueue(self, model, marked, depth, from_child=False):
+        if depth >= SUBQUERY_MAX_DEPTH:
+            # deep (tree) cascades: bound the nesting of level subqueries
+            for chunk in _chunks(
+                    list(marked.values_list('pk', flat=True)),
+                    self.batch_size):
+                self._enqueue(
+                    model, self._manager(model).filter(pk__in=chunk), 0,
+                    from_child)
+            return
+        self._levels.append((model, marked))
+        self._queue.append((model, marked, depth, from_child))
+
+    def _cascade(self, model, marked, depth, from_child):
+        for related in get_candidate_relations_to_delete(model._meta):
+            related_model = related.related_model
+            if not (related.field.remote_field.on_delete == models.CASCADE
+                    and _is_set_based(related_model)):
+                continue
+            rows = self._manager(related_model).filter(
+                **{f'{related.field.name}__in': marked})
+            if not related.field.remote_field.parent_link:
+                self._mark(related_model, rows, depth + 1)
+            elif not from_child:
+                # MTI children are marked with the parent rows already
+                count = rows.count()
+                if count:
+                    self.counter[related_model._meta.label] += count
+                    self._enqueue(related_model, rows, depth + 1)
+
+    def _collect_related(self, model, marked):
+        for related in get_candidate_relations_to_delete(model._meta):
+            field = related.field
+            on_delete = field.remote_field.on_delete
+            if on_delete == models.DO_NOTHING or field.remote_field.parent_link:
+                continue
+            if (on_delete == models.CASCADE
+                    and _is_set_based(related.related_model)):
+                continue
+
+            sub_objs = self._related_objects(related, marked)
+            if (on_delete in (models.SET_NULL, models.SET_DEFAULT)
+                    and _is_history_free(related.related_model)):
+                value = None if on_delete == models.SET_NULL \
+                    else field.get_default()
+                self.field_update_counter[
+                    f'{related.related_model._meta.label}.{field.name}'
+                ] += sub_objs.update(**{
+                    field.attname: value,
+                    **_save_values(related.related_model, self.time)})
+                invalidate_identity_map(related.related_model)
+                continue
+            if not sub_objs.exists():
+                continue
+            if on_delete == getattr(models, 'RESTRICT', None):
+                raise models.RestrictedError(
+                    'Delete restricted', sub_objs)  # type: ignore
+            on_delete(self.collector, field, sub_objs, self.using)
+
+    def _historize(self, model, marked, historized):
+        """
+        Bulk history rows of the marked level, rows marked by several
+        paths (`historized` pks) get one history row.
+        """
+        if not (getattr(model._meta, 'simple_history_manager_attribute', None)
+                and getattr(settings, 'SOFT_DELETE_BATCH_HISTORY', True)):
+            return
+
+        for chunk in _chunks(
+                marked.order_by().iterator(chunk_size=self.batch_size),
+                self.batch_size):
+            chunk = [obj for obj in chunk if obj.pk not in historized]
+            historized.update(obj.pk for obj in chunk)
+            bulk_history_create(model, chunk, self.batch_size)
+
+
+class SubqueryRestore:
+    """
+    Restore rows deleted by one soft delete operation and everything it
+    cascaded to.
+
+    Every soft delete operation stamps all of its rows with the same
+    `deleted` time, so the time identifies the operation. Restored rows
+    are walked by CASCADE relations: restored rows lose the time, so the
+    pks of a level are fetched before the
+    `UPDATE child SET deleted=NULL WHERE deleted=%s AND fk IN (restored pks)`
+    and chained into the next level. Rows deleted at the same time under
+    parents this restore doesn't bring back stay deleted. The rows are
+    loaded only to write history. SET_NULL/SET_DEFAULT values are not
+    restored.
+    """
+    def __init__(self, using, time):
+        self.using = using
+        self.time = time
+        self.batch_size = getattr(settings, 'SOFT_DELETE_BATCH_SIZE', 1000)
+        self.counter = Counter()
+        self._queue = deque()
+
+    def restore(self, queryset):
+        with transaction.atomic(using=self.using, savepoint=False):
+            self._restore(queryset)
+            while self._queue:
+                self._cascade(*self._queue.popleft())
+        return sum(self.counter.values()), dict(self.counter)
+
+    def _manager(self, model):
+        return model._base_manager.using(self.using)
+
+    def _restore(self, queryset):
+        model = queryset.model
+        pk_list = list(queryset.filter(
+            **{FIELD: self.time}).values_list('pk', flat=True))
+        if not pk_list:
+            return
+        values = {FIELD: None, **_save_values(model, now())}
+        for chunk in _chunks(pk_list, self.batch_size):
+            self.counter[model._meta.label] += _historized_update(
+                self._manager(model).filter(pk__in=chunk), values)
+        invalidate_identity_map(model)
+        self._queue.append((model, pk_list, False))
+        # MTI parent rows have the pks of the child rows
+        for parent in model._meta.get_parent_list():
+            self._queue.append((parent, pk_list, True))
+
+    def _cascade(self, model, pk_list, from_child):
+        from .soft_deleted import SoftDeleted
+
+        for relation in get_soft_delete_plan(model).relations:
+            related_model = relation.related_model
+            if not (relation.on_delete == models.CASCADE
+                    and issubclass(related_model, SoftDeleted)):
+                continue
+            parent_link = relation.field.remote_field.parent_link
+            if parent_link and from_child:
+                continue
+            for chunk in _chunks(pk_list, self.batch_size):
+                rows = self._manager(related_model).filter(
+                    **{f'{relation.field.name}__in': chunk})
+                if not parent_link:
+                    self._restore(rows)
+                    continue
+                # MTI children share the `deleted` column with the parent,
+                # they are restored already, only their relations cascade
+                child_pk_list = list(rows.values_list('pk', flat=True))
+                if child_pk_list:
+                    self._queue.append((related_model, child_pk_list, False))
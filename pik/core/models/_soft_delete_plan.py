@@ -0,0 +1,286 @@
+from collections import Counter, deque
+from typing import Callable, Dict, NamedTuple, Tuple, Type
+
+from django.conf import settings
+from django.db import models
+from django.db.models.deletion import get_candidate_relations_to_delete
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from django.utils.translation import gettext_lazy as _
+
+from ._collector_delete import (
+    FIELD, DeleteNotSoftDeletedModel, _is_soft_excluded)
+
+
+class SoftDeleteRelation(NamedTuple):
+    field: models.Field
+    related_model: Type[models.Model]
+    on_delete: Callable
+
+
+class SoftDeleteViolation(NamedTuple):
+    model: Type[models.Model]
+    # relation fields from the deleted model to the violating one
+    path: Tuple[models.Field, ...]
+
+
+class SoftDeletePlan(NamedTuple):
+    """
+    Cascade plan of a model computed once: relations to cascade and
+    models which would be hard deleted in spite of `SOFT_DELETE_SAFE_MODE`.
+    """
+    model: Type[models.Model]
+    is_soft: bool
+    is_excluded: bool
+    violates_safe_mode: bool
+    relations: Tuple[SoftDeleteRelation, ...]
+    violations: Tuple[SoftDeleteViolation, ...]
+
+    @property
+    def sends_delete_signals(self):
+        return not self.is_soft and not self.model._meta.auto_created
+
+
+_PLANS: Dict[Type[models.Model], SoftDeletePlan] = {}
+
+
+def _violates_safe_mode(model):
+    from .soft_deleted import SoftDeleted
+
+    return (
+        getattr(settings, 'SOFT_DELETE_SAFE_MODE', True)
+        and not model._meta.auto_created
+        and not issubclass(model, SoftDeleted)
+        and not _is_soft_excluded(model))
+
+
+def _get_relations(model):
+    return tuple(
+        SoftDeleteRelation(
+            related.field, related.related_model,
+            related.field.remote_field.on_delete)
+        for related in get_candidate_relations_to_delete(model._meta))
+
+
+def _get_violations(model):
+    """
+    Breadth-first walk by CASCADE relations, the shortest path
+    is kept for every violating model.
+    """
+    violations = []
+    visited = {model}
+    queue = deque([(model, ())])
+    while queue:
+        current, path = queue.popleft()
+        for relation in _get_relations(current):
+            related_model = relation.related_model
+            if (relation.on_delete != models.CASCADE
+                    or related_model in visited):
+                continue
+            visited.add(related_model)
+            related_path = path + (relation.field, )
+            if _violates_safe_mode(related_model):
+                violations.append(
+                    SoftDeleteViolation(related_model, related_path))
+            else:
+                queue.append((related_model, related_path))
+    return tuple(violations)
+
+
+def get_soft_delete_plan(model) -> SoftDeletePlan:
+    from .soft_deleted import SoftDeleted
+
+    plan = _PLANS.get(model)
+    if plan is None:
+        plan = SoftDeletePlan(
+            model=model,
+            is_soft=issubclass(model, SoftDeleted),
+            is_excluded=_is_soft_excluded(model),
+            violates_safe_mode=_violates_safe_mode(model),
+            relations=_get_relations(model),
+            violations=_get_violations(model))
+        _PLANS[model] = plan
+    return plan
+
+
+def clear_soft_delete_plans():
+    _PLANS.clear()
+
+
+@receiver(setting_changed)
+def _clear_plans_on_setting_changed(setting, **kwargs):
+    if setting in ('SOFT_DELETE_SAFE_MODE', 'SOFT_DELETE_EXCLUDE'):
+        clear_soft_delete_plans()
+
+
+def not_soft_deleted_error(model):
+    from .soft_deleted import SoftDeleted
+
+    return DeleteNotSoftDeletedModel(
+        _(f'You are trying to delete {model._meta.object_name} instance,'
+          f' but {model._meta.object_name} is not subclass of '
+          f'{SoftDeleted._meta.object_name}. You need to inherit your '
+          f'model from {SoftDeleted._meta.object_name}'
+          f' or set settings.SOFT_DELETE_SAFE_MODE to False'))
+
+
+def _violation_lookups(violation, objs):
+    from .soft_deleted import SoftDeleted
+
+    names = [field.name for field in reversed(violation.path)]
+    lookups = {'__'.join(names) + '__in': objs}
+    # already deleted intermediate rows do not cascade
+    for index, field in enumerate(violation.path[:-1]):
+        if issubclass(field.model, SoftDeleted):
+            prefix = '__'.join(names[:len(names) - index - 1])
+            lookups[f'{prefix}__{FIELD}__isnull'] = True
+    return lookups
+
+
+def check_safe_mode(model, objs, using=None):
+    """
+    Fail fast: raise `DeleteNotSoftDeletedModel` before any rows are
+    collected if deletion of `objs` would hard delete a model which is
+    not allowed by `SOFT_DELETE_SAFE_MODE`.
+    """
+    plan = get_soft_delete_plan(model)
+    if plan.violates_safe_mode:
+        raise not_soft_deleted_error(model)
+
+    for violation in plan.violations:
+        queryset = violation.model._base_manager.using(using).filter(
+            **_violation_lookups(violation, objs))
+        if queryset.exists():
+            raise not_soft_deleted_error(violation.model)
+
+
+class SoftDeleteEstimate(NamedTuple):
+    """
+    Rows a soft delete would touch, counted without loading them.
+    """
+    # rows soft (or hard) deleted by model label
+    counts: Dict[str, int]
+    # rows updated by SET_NULL/SET_DEFAULT/SET() by `<model label>.<field>`
+    field_updates: Dict[str, int]
+    # rows which block the delete by PROTECT/RESTRICT by model label
+    protected: Dict[str, int]
+    # labels of models which would be deleted for real
+    hard_deleted: Tuple[str, ...]
+    # labels of models which trip `SOFT_DELETE_SAFE_MODE`
+    violations: Tuple[str, ...]
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+
+# cascade path length to count, bounds self referencing (tree) cascades
+ESTIMATE_MAX_DEPTH = 32
+
+
+def estimate_delete(queryset, keep_parents=False) -> SoftDeleteEstimate:
+    """
+    Walk the cascade graph from `queryset` with one COUNT per relation and
+    level. Rows reachable by several paths may be counted more than once.
+    """
+    from .soft_deleted import SoftDeleted
+
+    def live(related_queryset):
+        if issubclass(related_queryset.model, SoftDeleted):
+            return related_queryset.filter(**{f'{FIELD}__isnull': True})
+        return related_queryset
+
+    counts = Counter()
+    field_updates = Counter()
+    protected = Counter()
+    hard_deleted = []
+    violations = []
+    queue = deque([(live(queryset), 0)])
+    while queue:
+        current, depth = queue.popleft()
+        model = current.model
+        count = current.count()
+        if not count:
+            continue
+        counts[model._meta.label] += count
+        plan = get_soft_delete_plan(model)
+        if plan.violates_safe_mode:
+            violations.append(model._meta.label)
+        elif not plan.is_soft and model._meta.label not in hard_deleted:
+            hard_deleted.append(model._meta.label)
+        if not keep_parents:
+            for parent in model._meta.get_parent_list():
+                queue.append((parent._base_manager.using(current.db).filter(
+                    pk__in=current.values('pk')), depth))
+
+        for relation in plan.relations:
+            field, on_delete = relation.field, relation.on_delete
+            if (on_delete == models.DO_NOTHING
+                    or field.remote_field.parent_link):
+                continue
+            related = live(relation.related_model._base_manager.using(
+                current.db).filter(**{f'{field.name}__in': current}))
+            if on_delete == models.CASCADE:
+                if depth < ESTIMATE_MAX_DEPTH:
+                    queue.append((related, depth + 1))
+            elif on_delete in (models.PROTECT, getattr(models, 'RESTRICT', None)):
+                protected[relation.related_model._meta.label] += related.count()
+            else:
+                field_updates[
+                    f'{relation.related_model._meta.label}.{field.name}'
+                ] += related.count()
+
+    return SoftDeleteEstimate(
+        counts=dict(counts),
+        field_updates={key: value for key, value in field_updates.items() if value},
+        protected={key: value for key, value in protected.items() if value},
+        hard_deleted=tuple(hard_deleted),
+        violations=tuple(dict.fromkeys(violations)))
+
+
+def check_protected(queryset, keep_parents=False):
+    """
+    Fail fast: raise `ProtectedError` if live rows reachable from
+    `queryset` by CASCADE relations are referenced by PROTECT relations.
+    Walks the cascade graph like `estimate_delete()` with one EXISTS per
+    relation and level.
+    """
+    from ._soft_delete_cascade import SUBQUERY_MAX_DEPTH
+    from .soft_deleted import SoftDeleted
+
+    def live(related_queryset):
+        if issubclass(related_queryset.model, SoftDeleted):
+            return related_queryset.filter(**{f'{FIELD}__isnull': True})
+        return related_queryset
+
+    queue = deque([(live(queryset), 0)])
+    while queue:
+        current, depth = queue.popleft()
+        model = current.model
+        if depth and not depth % SUBQUERY_MAX_DEPTH:
+            # bound the nesting of level subqueries
+            current = model._base_manager.using(current.db).filter(
+                pk__in=list(current.values_list('pk', flat=True)))
+        if not current.exists():
+            continue
+        if not keep_parents:
+            for parent in model._meta.get_parent_list():
+                queue.append((parent._base_manager.using(current.db).filter(
+                    pk__in=current.values('pk')), depth + 1))
+
+        for relation in get_soft_delete_plan(model).relations:
+            field, on_delete = relation.field, relation.on_delete
+            if field.remote_field.parent_link:
+                continue
+            related = live(relation.related_model._base_manager.using(
+                current.db).filter(**{f'{field.name}__in': current}))
+            if on_delete == models.CASCADE:
+                if depth < ESTIMATE_MAX_DEPTH:
+                    queue.append((related, depth + 1))
+            elif on_delete == models.PROTECT and related.exists():
+                raise models.ProtectedError(
+                    f'Cannot delete some instances of model '
+                    f'{model.__name__!r} because they are referenced '
+                    f'through a protected foreign key: '
+                    f'{relation.related_model.__name__}.{field.name}',
+                    related)
@@ -0,0 +1,14 @@
+from django.dispatch import Signal
+
+# Sent once per model and soft delete operation instead of per instance
+# `pre_delete`/`post_delete`: `sender` is the model,
+# `pk_list`, `deleted_at` and `using` are keyword arguments.
+# Pks of rows which are not loaded (fast deletes, subquery cascade)
+# are fetched only if the model has receivers.
+pre_soft_delete_batch = Signal()
+post_soft_delete_batch = Signal()
+
+
+def has_soft_delete_batch_receivers(model):
+    return (pre_soft_delete_batch.has_listeners(model)
+            or post_soft_delete_batch.has_listeners(model))
@@ -1,12 +1,19 @@
+import time
+from collections import Counter
+
 from django.contrib.admin.utils import NestedObjects
-from django.core.exceptions import FieldDoesNotExist
 from django.db import models, router, transaction
 from django.db.models import Q
 from django.db.models.sql import DeleteQuery
 from django.db.models.sql.where import WhereNode
 from django.utils.translation import gettext_lazy as _
 
-from ._collector_delete import Collector
+from ..meta import get_model_meta
+from ._collector_delete import (
+    Collector, _set_soft_deleted_values, _soft_delete_values)
+from ._soft_delete_cascade import (
+    SubqueryCascade, SubqueryRestore, can_subquery_cascade)
+from ._soft_delete_plan import check_safe_mode, estimate_delete
 
 assert Collector.delete
 
@@ -15,16 +22,29 @@ def _get_field_by_name(model, field):
     """
     Retrieve a field instance from a model by its name.
     """
-    field_dict = {x.name: x for x in model._meta.get_fields()}  # noqa
-    return field_dict[field]
+    return get_model_meta(model).fields[field]
 
 
 def _has_field(model, field):
-    try:
-        model._meta.get_field(field)  # noqa
-        return True
-    except FieldDoesNotExist:
-        return False
+    return field in get_model_meta(model).fields
+
+
+def soft_unique_constraint(*fields, name):
+    """
+    `UniqueConstraint` among live rows only, deleted rows don't block
+    creating the same values again.
+    """
+    return models.UniqueConstraint(
+        fields=list(fields), condition=Q(deleted=None), name=name)
+
+
+def soft_index(*fields, name, **kwargs):
+    """
+    Partial index of live rows, matches `deleted IS NULL` restriction of
+    the default manager and joins.
+    """
+    return models.Index(
+        fields=list(fields), condition=Q(deleted=None), name=name, **kwargs)
 
 
 def _cascade_soft_delete(inst_or_qs, using, keep_parents=False):
@@ -41,9 +61,12 @@ def _cascade_soft_delete(inst_or_qs, using, keep_parents=False):
             the ArchiveMixin instances are in the fields for update list.
     """
     if not isinstance(inst_or_qs, models.QuerySet):
-        instances = [inst_or_qs]
+        model, instances = type(inst_or_qs), [inst_or_qs]
     else:
-        instances = inst_or_qs
+        model, instances = inst_or_qs.model, inst_or_qs
+
+    # fail before the whole graph is loaded by the collector
+    check_safe_mode(model, instances, using)
 
     # The collector will iteratively crawl the relationships and
     # create a list of models and instances that are connected to
@@ -62,6 +85,38 @@ def _delete_collected(collector):
         return collector.delete()
 
 
+def _soft_delete(instance, using, keep_parents=False, time=None):
+    """
+    Soft delete the instance and cascade, all rows are marked with `time`
+    (current time by default).
+    """
+    model = type(instance)
+    if can_subquery_cascade(model):
+        cascade = SubqueryCascade(using, keep_parents, time)
+        result = cascade.delete(
+            model._base_manager.using(using).filter(pk=instance.pk))
+        _set_soft_deleted_values(
+            instance, _soft_delete_values(model, cascade.time))
+        return result
+
+    collector = _cascade_soft_delete(instance, using, keep_parents)
+    collector.soft_delete_time = time
+    return _delete_collected(collector)
+
+
+def _soft_delete_queryset(queryset, using, time=None):
+    """
+    Soft delete the queryset and cascade, all rows are marked with `time`
+    (current time by default).
+    """
+    if can_subquery_cascade(queryset.model):
+        return SubqueryCascade(using, time=time).delete(queryset)
+
+    collector = _cascade_soft_delete(queryset, using)
+    collector.soft_delete_time = time
+    return _delete_collected(collector)
+
+
 class _BaseSoftDeletedQuerySet(models.QuerySet):
     def delete(self):
         # doing an update is the most efficient, but does not promise
@@ -76,13 +131,64 @@ class _BaseSoftDeletedQuerySet(models.QuerySet):
 
         # iterating and deleting ensures that the cascade delete will
         # occur for each instance.
-        collector = _cascade_soft_delete(self.all(), self.db)
+        result = _soft_delete_queryset(self.all(), self.db)
         self._result_cache = None
-        return _delete_collected(collector)
+        return result
 
     delete.alters_data = True  # type: ignore
     delete.queryset_only = True  # type: ignore
 
+    def delete_in_batches(self, batch_size=1000, sleep=0, callback=None):
+        """
+        Soft delete the queryset in pk ordered (keyset) batches, one
+        transaction per batch.
+
+        Deleted rows don't match the queryset anymore, so running it again
+        after an interruption continues where it stopped.
+
+        :param batch_size: rows of the queryset model per batch
+        :param sleep: seconds to sleep between batches
+        :param callback: `callback(count, counter, last_pk)` is called after
+            every batch with the cumulative result
+        :return: cumulative `(count, {model_label: count})`
+        """
+        assert self.query.can_filter(), \
+            "Cannot use 'limit' or 'offset' with delete."
+
+        queryset = self.filter(deleted__isnull=True).order_by('pk')
+        counter = Counter()
+        last_pk = None
+        while True:
+            batch = queryset if last_pk is None \
+                else queryset.filter(pk__gt=last_pk)
+            pk_list = list(batch.values_list('pk', flat=True)[:batch_size])
+            if not pk_list:
+                break
+            if last_pk is not None and sleep:
+                time.sleep(sleep)
+
+            with transaction.atomic(using=self.db):
+                _, batch_counter = self.filter(pk__in=pk_list).delete()
+            counter.update(batch_counter)
+            last_pk = pk_list[-1]
+            if callback:
+                callback(sum(counter.values()), dict(counter), last_pk)
+
+        self._result_cache = None
+        return sum(counter.values()), dict(counter)
+
+    delete_in_batches.alters_data = True  # type: ignore
+    delete_in_batches.queryset_only = True  # type: ignore
+
+    def delete_plan(self):
+        """
+        Estimate `delete()`: rows counts by model along the cascade graph,
+        hard deleted and `SOFT_DELETE_SAFE_MODE` violating models.
+        """
+        return estimate_delete(self.all())
+
+    delete_plan.queryset_only = True  # type: ignore
+
     def hard_delete(self):
         return models.QuerySet.delete(self)
 
@@ -95,6 +201,24 @@ class _BaseSoftDeletedQuerySet(models.QuerySet):
     restore.alters_data = True  # type: ignore
     restore.queryset_only = True  # type: ignore
 
+    def restore_cascade(self):
+        """
+        Restore deleted rows of the queryset and everything their soft
+        delete operations cascaded to.
+        """
+        counter = Counter()
+        deleted_times = self.filter(deleted__isnull=False).order_by(
+            'deleted').values_list('deleted', flat=True).distinct()
+        for deleted_time in list(deleted_times):
+            _, time_counter = SubqueryRestore(self.db, deleted_time).restore(
+                self.filter(deleted=deleted_time))
+            counter.update(time_counter)
+        self._result_cache = None
+        return sum(counter.values()), dict(counter)
+
+    restore_cascade.alters_data = True  # type: ignore
+    restore_cascade.queryset_only = True  # type: ignore
+
     def get_restore_or_create(self, **kwargs):
         obj, created = self.model.all_objects.get_or_create(**kwargs)
         if not created and obj.deleted:
@@ -120,24 +244,46 @@ class _SoftObjectsWhereNode(WhereNode):
     pass
 
 
+class _WithArchiveMixin:
+    def with_archive(self, *args, **kwargs):
+        """
+        Filter rows and `UNION ALL` them with the archive table rows filtered
+        the same way, if the model has `SoftDeletedArchive`. Like any
+        `union()` the result can only be ordered, sliced and evaluated.
+        """
+        queryset = self.filter(*args, **kwargs)
+        archive_model = getattr(
+            self.model._meta, 'soft_deleted_archive_model', None)
+        if archive_model is None:
+            return queryset
+        return queryset.union(
+            archive_model._default_manager.using(self.db).filter(
+                *args, **kwargs),
+            all=True)
+
+
 class SoftObjectsQuerySet(_BaseSoftDeletedQuerySet):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.query.where_class = _SoftObjectsWhereNode
-        self.query.add_q(Q(deleted=None))
+    def __init__(self, model=None, query=None, using=None, hints=None):
+        super().__init__(model, query, using, hints)
+        # `_clone()` passes the chained query, which is restricted already
+        if query is None:
+            self.query.where_class = _SoftObjectsWhereNode
+            self.query.add_q(Q(deleted=None))
 
 
-class SoftDeletedObjectsQuerySet(_BaseSoftDeletedQuerySet):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.query.where_class = _SoftDeletedObjectsWhereNode
-        self.query.add_q(~Q(deleted=None))
+class SoftDeletedObjectsQuerySet(_WithArchiveMixin, _BaseSoftDeletedQuerySet):
+    def __init__(self, model=None, query=None, using=None, hints=None):
+        super().__init__(model, query, using, hints)
+        if query is None:
+            self.query.where_class = _SoftDeletedObjectsWhereNode
+            self.query.add_q(~Q(deleted=None))
 
 
-class AllObjectsQuerySet(_BaseSoftDeletedQuerySet):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.query.where_class = _AllWhereNode
+class AllObjectsQuerySet(_WithArchiveMixin, _BaseSoftDeletedQuerySet):
+    def __init__(self, model=None, query=None, using=None, hints=None):
+        super().__init__(model, query, using, hints)
+        if query is None:
+            self.query.where_class = _AllWhereNode
 
     def is_deleted(self):
         return self.filter(deleted__isnull=False)
@@ -155,6 +301,8 @@ class SoftDeleted(models.Model):
     a problem because NULL != NULL.
     You can use workaround with `UniqueConstraint in django>=2.2
     https://docs.djangoproject.com/en/2.2/ref/models/constraints/#django.db.models.UniqueConstraint
+    `soft_unique_constraint()` and `soft_index()` build conditional
+    constraints and partial indexes of live rows for `Meta`.
     """
     deleted = models.DateTimeField(
         editable=False, null=True, blank=True, verbose_name=_('Deleted')
@@ -164,7 +312,14 @@ class SoftDeleted(models.Model):
     deleted_objects = SoftDeletedObjectsQuerySet.as_manager()
     all_objects = AllObjectsQuerySet.as_manager()
 
-    def delete(self, using=None, keep_parents=False):
+    def delete(self, using=None, keep_parents=False, async_cascade=False):
+        """
+        Soft delete the instance with cascade.
+
+        With `async_cascade` only the instance row is marked deleted, the
+        cascade is done by `pik.core.soft_deleted.tasks.soft_delete_cascade`
+        celery task after commit.
+        """
         using = using or router.db_for_write(self.__class__, instance=self)
 
         assert self._get_pk_val() is not None, (
@@ -174,11 +329,24 @@ class SoftDeleted(models.Model):
         if self.deleted:
             return 0, {}  # short-circuit here to prevent lots of nesting
 
-        collector = _cascade_soft_delete(self, using, keep_parents)
-        return _delete_collected(collector)
+        if async_cascade:
+            from pik.core.soft_deleted.tasks import delete_async
+            return delete_async(self, using, keep_parents)
+
+        return _soft_delete(self, using, keep_parents)
 
     delete.alters_data = True  # type: ignore
 
+    def delete_plan(self, using=None, keep_parents=False):
+        """
+        Estimate `delete()` without loading objects, see
+        `_BaseSoftDeletedQuerySet.delete_plan()`.
+        """
+        using = using or router.db_for_write(self.__class__, instance=self)
+        return estimate_delete(
+            type(self)._base_manager.using(using).filter(pk=self.pk),
+            keep_parents)
+
     def hard_delete(self):
         using = router.db_for_write(self.__class__, instance=self)
         delete_query = DeleteQuery(self._meta.model)
@@ -188,7 +356,32 @@ class SoftDeleted(models.Model):
 
     def restore(self):
         self.deleted = None
-        self.save()
+        archive_model = getattr(
+            self._meta, 'soft_deleted_archive_model', None)
+        if archive_model is None:
+            self.save()
+            return
+        using = router.db_for_write(archive_model)
+        with transaction.atomic(using=using):
+            # instances loaded `with_archive()` are saved back to live table
+            self.save()
+            archive_model._base_manager.filter(pk=self.pk)._raw_delete(using)
+
+    def restore_cascade(self, using=None):
+        """
+        Restore the instance and everything its soft delete cascaded to.
+        """
+        using = using or router.db_for_write(self.__class__, instance=self)
+        if not self.deleted:
+            return 0, {}
+
+        model = type(self)
+        result = SubqueryRestore(using, self.deleted).restore(
+            model._base_manager.using(using).filter(pk=self.pk))
+        self.refresh_from_db(using=using)
+        return result
+
+    restore_cascade.alters_data = True  # type: ignore
 
     class Meta:
         abstract = True
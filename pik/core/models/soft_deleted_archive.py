@@ -0,0 +1,163 @@
+import importlib
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, models, transaction
+from django.utils.text import format_lazy
+from django.utils.timezone import now
+
+from ._collector_delete import FIELD, _save_values
+
+
+def _archive_field(field):
+    """
+    Copy of a concrete field for the archive table: keys are kept,
+    but without database constraints, reverse relations and unique indexes.
+    """
+    # swappable lookup needs the app registry, which is not ready yet
+    swappable = getattr(field, 'swappable', None)
+    if swappable is not None:
+        field.swappable = False
+    try:
+        _, _, args, kwargs = field.deconstruct()
+    finally:
+        if swappable is not None:
+            field.swappable = swappable
+    field_class = type(field)
+    for option in ('unique', 'unique_for_date', 'unique_for_month',
+                   'unique_for_year'):
+        kwargs.pop(option, None)
+
+    if isinstance(field, models.BigAutoField):
+        field_class = models.BigIntegerField
+    elif isinstance(field, getattr(models, 'SmallAutoField', ())):
+        field_class = models.SmallIntegerField
+    elif isinstance(field, models.AutoField):
+        field_class = models.IntegerField
+    elif isinstance(field, models.ForeignKey):
+        field_class = models.ForeignKey
+        kwargs.pop('related_query_name', None)
+        kwargs.update(
+            on_delete=models.DO_NOTHING, db_constraint=False,
+            related_name='+')
+
+    archive_field = field_class(*args, **kwargs)
+    archive_field.name = field.name
+    return archive_field
+
+
+def _insert_select(model, queryset):
+    """
+    `INSERT INTO <model table> SELECT ...` of queryset rows, the rows are
+    not loaded. Both models must have the same concrete fields.
+    """
+    connection = connections[queryset.db]
+    quote_name = connection.ops.quote_name
+    fields = model._meta.concrete_fields
+    select_sql, params = queryset.order_by().values_list(*[
+        field.attname for field in fields
+    ]).query.get_compiler(using=queryset.db).as_sql()
+    columns = ', '.join(quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote_name(model._meta.db_table)} ({columns}) '
+            f'{select_sql}', params)
+        return cursor.rowcount
+
+
+def archive_rows(model, pk_list, using):
+    """
+    Copy soft deleted rows of the model to its archive table. Callers
+    delete them from the live table in the same transaction.
+    """
+    archive_model = model._meta.soft_deleted_archive_model
+    return _insert_select(archive_model, model._base_manager.using(using).filter(
+        pk__in=pk_list, **{f'{FIELD}__isnull': False}))
+
+
+class ArchiveQuerySet(models.QuerySet):
+    def restore(self):
+        """
+        Move rows back to the live table and restore them there.
+        """
+        model = self.model._meta.soft_deleted_live_model
+        with transaction.atomic(using=self.db, savepoint=False):
+            pk_list = list(self.values_list('pk', flat=True))
+            archived = self.model._base_manager.using(self.db).filter(
+                pk__in=pk_list)
+            _insert_select(model, archived)
+            count = model._base_manager.using(self.db).filter(
+                pk__in=pk_list).update(**{
+                    FIELD: None, **_save_values(model, now())})
+            archived._raw_delete(self.db)
+        self._result_cache = None
+        return count
+
+    restore.alters_data = True  # type: ignore
+    restore.queryset_only = True  # type: ignore
+
+
+class _ArchiveDescriptor:
+    def __init__(self, archive_model):
+        self.archive_model = archive_model
+
+    def __get__(self, instance, owner):
+        return self.archive_model._default_manager
+
+
+class SoftDeletedArchive:
+    """
+    Archive table for soft deleted rows of a SoftDeleted model.
+
+    Creates `Archived<ModelName>` model with `<db_table>_archive` table and
+    the same concrete fields, without database constraints. Soft deleted
+    rows are moved there by `purge_soft_deleted`, so the live table and its
+    indexes keep only live (and recently deleted) rows.
+
+        class Organization(SoftDeleted):
+            archive = SoftDeletedArchive()
+
+        Organization.archive.filter(name='АПИКА').restore()
+        Organization.deleted_objects.with_archive(name='АПИКА')
+    """
+    def contribute_to_class(self, cls, name):
+        self.name = name
+        self.cls = cls
+        models.signals.class_prepared.connect(self.finalize, weak=False)
+
+    def finalize(self, sender, **kwargs):
+        from .soft_deleted import SoftDeleted
+
+        if sender is not self.cls:
+            return
+        if not issubclass(sender, SoftDeleted) or sender._meta.abstract:
+            raise ImproperlyConfigured(
+                f'{sender.__name__}: SoftDeletedArchive needs concrete '
+                f'SoftDeleted model')
+        if sender._meta.parents:
+            raise ImproperlyConfigured(
+                f'{sender.__name__}: SoftDeletedArchive does not support '
+                f'multi-table inheritance')
+
+        archive_model = self.create_archive_model(sender)
+        module = importlib.import_module(sender.__module__)
+        setattr(module, archive_model.__name__, archive_model)
+        setattr(sender, self.name, _ArchiveDescriptor(archive_model))
+        sender._meta.soft_deleted_archive_model = archive_model
+
+    @staticmethod
+    def create_archive_model(model):
+        attrs = {
+            '__module__': model.__module__,
+            'objects': ArchiveQuerySet.as_manager(),
+            'Meta': type('Meta', (), {
+                'app_label': model._meta.app_label,
+                'db_table': f'{model._meta.db_table}_archive',
+                'verbose_name': format_lazy(
+                    'archived {}', model._meta.verbose_name),
+            }),
+        }
+        for field in model._meta.concrete_fields:
+            attrs[field.name] = _archive_field(field)
+        archive_model = type(f'Archived{model.__name__}', (models.Model, ), attrs)
+        archive_model._meta.soft_deleted_live_model = model
+        return archive_model
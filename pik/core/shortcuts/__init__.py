@@ -1,12 +1,40 @@
 from .model_objects import (
-    get_object_or_none, validate_and_create_object,
-    validate_and_update_object, update_or_create_object)
+    get_object_or_none, get_objects_or_none, validate_and_create_object,
+    validate_and_update_object, update_or_create_object, upsert_object,
+    bulk_update_or_create_objects)
+from .async_model_objects import (
+    aget_object_or_none, avalidate_and_create_object,
+    avalidate_and_update_object, aupdate_or_create_object, aupsert_object,
+    abulk_update_or_create_objects)
 from .request import get_current_request
+from .identity_map import (
+    IdentityMap, enable_identity_map, get_identity_map,
+    invalidate_identity_map)
+from .importing import (
+    ImportStats, ReconcileStats, import_objects, read_rows, reconcile)
 
 __all__ = [
     'get_object_or_none',
+    'get_objects_or_none',
     'validate_and_create_object',
     'validate_and_update_object',
     'update_or_create_object',
+    'upsert_object',
+    'bulk_update_or_create_objects',
+    'aget_object_or_none',
+    'avalidate_and_create_object',
+    'avalidate_and_update_object',
+    'aupdate_or_create_object',
+    'aupsert_object',
+    'abulk_update_or_create_objects',
     'get_current_request',
+    'IdentityMap',
+    'enable_identity_map',
+    'get_identity_map',
+    'invalidate_identity_map',
+    'ImportStats',
+    'import_objects',
+    'read_rows',
+    'ReconcileStats',
+    'reconcile',
 ]
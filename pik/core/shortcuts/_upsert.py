@@ -0,0 +1,160 @@
+from typing import List, Tuple
+
+from django.db import NotSupportedError, connections, models, transaction
+
+from ..meta import get_model_meta
+
+VENDORS = ('postgresql', 'sqlite')
+
+
+def _get_conflict_fields(model, search_keys):
+    """
+    `ON CONFLICT` target: search keys have to be the fields
+    of a unique field, `unique_together` or unique constraint.
+    """
+    opts = model._meta
+    fields = [get_model_meta(model).concrete_fields.get(key)
+              for key in search_keys]
+    groups = [{field.name} for field in opts.concrete_fields if field.unique]
+    groups.extend(set(names) for names in opts.unique_together)
+    groups.extend(
+        set(constraint.fields)
+        for constraint in getattr(opts, 'total_unique_constraints', ()))
+    if None in fields or {field.name for field in fields} not in groups:
+        raise ValueError(
+            f'Upsert {model.__name__}: search keys {sorted(search_keys)!r} '
+            f'are not fields of a unique constraint')
+    return fields
+
+
+def _from_db_value(model, field, value, connection):
+    expression = field.get_col(model._meta.db_table)
+    for converter in (connection.ops.get_db_converters(expression)
+                      + field.get_db_converters(connection)):
+        value = converter(value, expression, connection)
+    return value
+
+
+def upsert_row(queryset, search_keys, kwargs) \
+        -> Tuple[models.Model, List[str], bool]:
+    """
+    Validate the object built from `search_keys` and `kwargs` and write it
+    with one `INSERT ... ON CONFLICT (search keys) DO UPDATE ... RETURNING`.
+    Conflicting rows are updated only if some value differs.
+
+    Old values of updated rows come from the statement snapshot on
+    PostgreSQL and from a select in the same transaction on SQLite.
+
+    :raises ValidationError, IntegrityError
+    :return obj, updated_keys, is_created
+    """
+    model = queryset.model
+    using = queryset.db
+    connection = connections[using]
+    opts = model._meta
+    if connection.vendor not in VENDORS or (
+            connection.vendor == 'sqlite'
+            and connection.Database.sqlite_version_info < (3, 35)):
+        # RETURNING is available since SQLite 3.35
+        raise NotSupportedError(
+            f'Upsert is not supported on {connection.vendor}')
+    if opts.parents:
+        raise NotSupportedError(
+            f'Upsert {model.__name__}: multi-table inheritance '
+            f'is not supported')
+
+    meta = get_model_meta(model)
+    conflict_fields = _get_conflict_fields(model, search_keys)
+    updates = []
+    for key in kwargs:
+        field = meta.concrete_fields.get(key)
+        if field is None:
+            raise ValueError(
+                f'Upsert {model.__name__}: {key} is not a concrete field')
+        if field not in conflict_fields:
+            updates.append((key, field))
+
+    # kwargs may repeat search keys
+    obj = model(**{**search_keys, **kwargs})
+    obj.full_clean(validate_unique=False)
+    if 'version' in meta.auto_update_names:
+        obj.version = 1
+
+    fields = opts.concrete_fields
+    insert_fields = [
+        field for field in fields
+        if not (field.primary_key and obj.pk is None)]
+    params = [
+        field.get_db_prep_save(field.pre_save(obj, True), connection)
+        for field in insert_fields]
+
+    quote_name = connection.ops.quote_name
+    table = quote_name(opts.db_table)
+    sets = [
+        f'{quote_name(field.column)} = excluded.{quote_name(field.column)}'
+        for _, field in updates]
+    is_distinct = 'IS DISTINCT FROM' if connection.vendor == 'postgresql' \
+        else 'IS NOT'
+    distinct = ' OR '.join(
+        f'{table}.{quote_name(field.column)} {is_distinct} '
+        f'excluded.{quote_name(field.column)}'
+        for _, field in updates)
+    for name in meta.auto_update_names:
+        column = quote_name(meta.concrete_fields[name].column)
+        if name == 'version' and model.autoincrement_version:
+            sets.append(f'{column} = {table}.{column} + 1')
+        elif name != 'version':
+            sets.append(f'{column} = excluded.{column}')
+    on_conflict = f'DO UPDATE SET {", ".join(sets)} WHERE {distinct}' \
+        if updates else 'DO NOTHING'
+
+    returning = [f'{table}.{quote_name(field.column)}' for field in fields]
+    if connection.vendor == 'postgresql':
+        old = quote_name('old')
+        pk_column = quote_name(opts.pk.column)
+        returning.append(f'({table}.xmax = 0)')
+        returning.extend(
+            f'(SELECT {old}.{quote_name(field.column)} FROM {table} AS {old} '
+            f'WHERE {old}.{pk_column} = {table}.{pk_column})'
+            for _, field in updates)
+
+    sql = (
+        f'INSERT INTO {table} '
+        f'({", ".join(quote_name(field.column) for field in insert_fields)}) '
+        f'VALUES ({", ".join(["%s"] * len(insert_fields))}) '
+        f'ON CONFLICT '
+        f'({", ".join(quote_name(field.column) for field in conflict_fields)}) '
+        f'{on_conflict} RETURNING {", ".join(returning)}')
+
+    with transaction.atomic(using=using, savepoint=False):
+        old_row = None
+        if connection.vendor == 'sqlite':
+            old_row = model._base_manager.using(using).filter(
+                **search_keys).values_list(
+                    'pk', *[field.attname for _, field in updates]).first()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if row is None:
+            # nothing to update
+            return model._base_manager.using(using).get(**search_keys), \
+                [], False
+
+    obj = model.from_db(using, [field.attname for field in fields], [
+        _from_db_value(model, field, value, connection)
+        for field, value in zip(fields, row)])
+    if connection.vendor == 'postgresql':
+        is_created = row[len(fields)]
+        old_values = [
+            _from_db_value(model, field, value, connection)
+            for (_, field), value in zip(updates, row[len(fields) + 1:])]
+    else:
+        is_created = old_row is None
+        old_values = old_row[1:] if old_row else ()
+    if is_created:
+        return obj, [], True
+
+    updated_keys = [
+        key for (key, field), old_value in zip(updates, old_values)
+        if old_value != getattr(obj, field.attname)]
+    return obj, updated_keys, False
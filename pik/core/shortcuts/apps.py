@@ -0,0 +1,5 @@
+from django.apps import AppConfig
+
+
+class ShortcutsConfig(AppConfig):
+    name = 'pik.core.shortcuts'
@@ -0,0 +1,148 @@
+from typing import Iterable, List, Optional, Tuple, Type, Union
+
+from asgiref.sync import sync_to_async
+from django.db import models
+
+from ..meta import get_model_meta
+from .identity_map import get_identity_key, get_identity_map
+from .model_objects import (
+    BulkResult, _get_m2m_kwargs, _restore_values, _set_changed_values,
+    bulk_update_or_create_objects, update_or_create_object, upsert_object,
+    validate_and_create_object, validate_and_update_object)
+
+
+def _get_or_none(source, args, kwargs):
+    try:
+        return source.get(*args, **kwargs)
+    except source.model.DoesNotExist:
+        return None
+
+
+async def aget_object_or_none(
+        source: Union[Type[models.Model], models.QuerySet, models.Manager],
+        *args, **kwargs) -> Optional[models.Model]:
+    """
+    Async `get_object_or_none`: identity map hits are returned without
+    leaving the event loop, the lookup uses `QuerySet.aget()` if Django
+    has it (4.1+) and one `sync_to_async` call otherwise, so without the
+    identity map it is the same as `sync_to_async(get_object_or_none)`
+    on older Django.
+    """
+    assert (isinstance(source, (models.QuerySet, models.Manager))
+            or issubclass(source, models.Model))
+
+    if not isinstance(source, (models.QuerySet, models.Manager)):
+        source = source.objects
+
+    identity_map = get_identity_map()
+    key = None
+    if identity_map is not None:
+        key = get_identity_key(source, args, kwargs)
+        if key is not None:
+            found, obj = identity_map.get(key)
+            if found:
+                return obj
+
+    if hasattr(source, 'aget'):
+        try:
+            obj = await source.aget(*args, **kwargs)
+        except source.model.DoesNotExist:
+            obj = None
+    else:
+        obj = await sync_to_async(_get_or_none)(source, args, kwargs)
+    if key is not None:
+        identity_map.set(key, obj)
+    return obj
+
+
+async def avalidate_and_create_object(
+        model: Type[models.Model], **kwargs) -> models.Model:
+    """
+    Async `validate_and_create_object`: validation, save and many to many
+    updates run in one `sync_to_async` call, it is exactly
+    `sync_to_async(validate_and_create_object)`.
+
+    :raises ValueError
+    :return obj
+    """
+    return await sync_to_async(validate_and_create_object)(model, **kwargs)
+
+
+def _has_changed_values(obj, kwargs) -> Optional[bool]:
+    """
+    Compare concrete field values without queries,
+    None if some key is not a concrete field.
+    """
+    concrete_fields = get_model_meta(type(obj)).concrete_fields
+    if any(key not in concrete_fields for key in kwargs):
+        return None
+    old_values = _set_changed_values(obj, **kwargs)
+    _restore_values(obj, old_values)
+    return bool(old_values)
+
+
+async def avalidate_and_update_object(
+        obj: models.Model, m2m_replace: bool = False, **kwargs) \
+        -> Tuple[models.Model, List[str]]:
+    """
+    Async `validate_and_update_object`: unchanged objects are returned
+    without leaving the event loop, otherwise validation, save and many
+    to many updates run in one `sync_to_async` call.
+
+    :raises ValueError
+    :return obj, updated_keys
+    """
+    assert isinstance(obj, models.Model)
+
+    m2m_kwargs, values = _get_m2m_kwargs(type(obj), **kwargs)
+    if not m2m_kwargs and _has_changed_values(obj, values) is False:
+        return obj, []
+    return await sync_to_async(validate_and_update_object)(
+        obj, m2m_replace, **kwargs)
+
+
+async def aupdate_or_create_object(
+        source: Union[Type[models.Model], models.QuerySet, models.Manager],
+        search_keys: Optional[dict] = None,
+        m2m_replace: bool = False,
+        **kwargs) \
+        -> Tuple[models.Model, List[str], bool]:
+    """
+    Async `update_or_create_object`: the lookup and the write run
+    in one `sync_to_async` call, it is exactly
+    `sync_to_async(update_or_create_object)`.
+
+    :raises ValueError
+    :return obj, updated_keys, is_created
+    """
+    return await sync_to_async(update_or_create_object)(
+        source, search_keys, m2m_replace, **kwargs)
+
+
+async def aupsert_object(
+        source: Union[Type[models.Model], models.QuerySet, models.Manager],
+        search_keys: dict,
+        m2m_replace: bool = False,
+        **kwargs) \
+        -> Tuple[models.Model, List[str], bool]:
+    """
+    Async `upsert_object` in one `sync_to_async` call.
+
+    :raises ValueError
+    :return obj, updated_keys, is_created
+    """
+    return await sync_to_async(upsert_object)(
+        source, search_keys, m2m_replace, **kwargs)
+
+
+async def abulk_update_or_create_objects(
+        source: Union[Type[models.Model], models.QuerySet, models.Manager],
+        records: Iterable[Tuple[Optional[dict], dict]],
+        batch_size: int = 1000,
+        m2m_replace: bool = False) -> List[BulkResult]:
+    """
+    Async `bulk_update_or_create_objects` in one `sync_to_async` call,
+    `records` are consumed in the worker thread.
+    """
+    return await sync_to_async(bulk_update_or_create_objects)(
+        source, records, batch_size, m2m_replace)
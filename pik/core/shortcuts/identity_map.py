@@ -0,0 +1,127 @@
+from typing import Any, Dict, Hashable, Optional, Tuple, Type
+
+from django.conf import settings
+from django.db import models
+from django.db.models.signals import post_save
+from django.http import HttpRequest
+
+from .request import get_current_request
+
+REQUEST_ATTRIBUTE = '_pik_identity_map'
+
+
+class IdentityMap:
+    """
+    Objects found by `get_object_or_none` in one request,
+    keyed by `(concrete model, model, manager name, lookup)`.
+    """
+    def __init__(self):
+        self._objects: Dict[Tuple, Optional[models.Model]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._objects)
+
+    def get(self, key: Tuple) -> Tuple[bool, Optional[models.Model]]:
+        if key in self._objects:
+            self.hits += 1
+            return True, self._objects[key]
+        self.misses += 1
+        return False, None
+
+    def set(self, key: Tuple, obj: Optional[models.Model]):
+        self._objects[key] = obj
+
+    def invalidate(self, model: Type[models.Model]):
+        """
+        Drop objects of the model, its parents and children.
+        """
+        concrete_model = model._meta.concrete_model  # noqa: protected-access
+        related = {concrete_model}
+        related.update(
+            concrete_model._meta.get_parent_list())  # noqa: protected-access
+        self._objects = {
+            key: obj for key, obj in self._objects.items()
+            if key[0] not in related
+            and concrete_model not in key[0]._meta.get_parent_list()}  # noqa: protected-access
+
+    def clear(self):
+        self._objects.clear()
+
+
+def enable_identity_map(request: Optional[HttpRequest] = None) \
+        -> Optional[IdentityMap]:
+    """
+    Use an identity map for the request (the current one by default)
+    even if `SHORTCUTS_IDENTITY_MAP` setting is off.
+    """
+    request = request or get_current_request()
+    if request is None:
+        return None
+    identity_map = getattr(request, REQUEST_ATTRIBUTE, None)
+    if identity_map is None:
+        _connect_receivers()
+        identity_map = IdentityMap()
+        setattr(request, REQUEST_ATTRIBUTE, identity_map)
+    return identity_map
+
+
+def get_identity_map(request: Optional[HttpRequest] = None) \
+        -> Optional[IdentityMap]:
+    """
+    Identity map of the request (the current one by default): None
+    outside of a request or if it is not enabled for the request and
+    `SHORTCUTS_IDENTITY_MAP` setting is off.
+    """
+    request = request or get_current_request()
+    if request is None:
+        return None
+    identity_map = getattr(request, REQUEST_ATTRIBUTE, None)
+    if identity_map is None and getattr(
+            settings, 'SHORTCUTS_IDENTITY_MAP', False):
+        identity_map = enable_identity_map(request)
+    return identity_map
+
+
+def get_identity_key(source: models.Manager, args: tuple,
+                     kwargs: Dict[str, Any]) -> Optional[Hashable]:
+    """
+    Key of a manager lookup by keyword arguments, None if the lookup can't
+    be cached: with `Q` arguments, by unhashable values or on querysets
+    (their filters are not part of the key).
+    """
+    if args or not isinstance(source, models.Manager) or source.name is None:
+        return None
+    model = source.model
+    key = (model._meta.concrete_model, model, source.name,  # noqa: protected-access
+           tuple(sorted(kwargs.items())))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def invalidate_identity_map(*invalidated_models: Type[models.Model]):
+    """
+    Drop objects of the models from the identity map of the current
+    request. Called by writes which don't send `post_save`: deletes,
+    set-based soft deletes and restores, bulk writes.
+    """
+    identity_map = getattr(get_current_request(), REQUEST_ATTRIBUTE, None)
+    if identity_map is not None:
+        for model in invalidated_models:
+            identity_map.invalidate(model)
+
+
+def _invalidate_identity_map(sender, **kwargs):
+    invalidate_identity_map(sender)
+
+
+def _connect_receivers():
+    # only `post_save`: delete and batch signal receivers would turn off
+    # fast and set-based deletes, deletes invalidate the map themselves
+    post_save.connect(
+        _invalidate_identity_map,
+        dispatch_uid='pik.core.shortcuts.identity_map')
@@ -0,0 +1,379 @@
+import csv
+import json
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import (
+    Callable, Iterable, Iterator, Optional, Sequence, TextIO, Tuple, Type,
+    Union)
+
+from django.core.exceptions import ValidationError
+from django.db import connections, models
+from django.db.models.expressions import Col
+from django.db.models.lookups import Exact
+from django.db.models.sql.where import AND
+
+from ..meta import get_model_meta
+from .model_objects import (
+    _get_key_value, _get_source_queryset, bulk_update_or_create_objects)
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None  # type: ignore
+
+LOGGER = logging.getLogger(__name__)
+
+Record = Tuple[Optional[dict], dict]
+
+
+class ImportStats:
+    """
+    Import counters, `max_rss` is the process memory high-water mark in
+    kilobytes (None if unknown).
+    """
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.rejected = 0
+        self.seconds = 0.0
+        self.max_rss = None
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (
+            f'{self.rows} rows in {self.seconds:.1f}s '
+            f'({self.rows_per_second:.0f} rows/s): '
+            f'{self.created} created, {self.updated} updated, '
+            f'{self.unchanged} unchanged, {self.rejected} rejected, '
+            f'max rss {self.max_rss} KB')
+
+
+class ReconcileStats(ImportStats):
+    """
+    `ImportStats` with soft deleted missing rows and restored rows,
+    restored rows are not counted as updated.
+    """
+    def __init__(self):
+        super().__init__()
+        self.deleted = 0
+        self.restored = 0
+
+    def __str__(self):
+        return (
+            f'{super().__str__()}, {self.restored} restored, '
+            f'{self.deleted} deleted')
+
+
+def _write_reject(reject_file, line, row, error):
+    if reject_file is not None:
+        reject_file.write(json.dumps(
+            {'line': line, 'row': row, 'error': str(error)},
+            ensure_ascii=False, default=str) + '\n')
+
+
+def read_rows(file: TextIO, file_format: Optional[str] = None) \
+        -> Iterator[dict]:
+    """
+    Stream dicts from a CSV file with a header or from a JSON lines file,
+    the format is guessed by the file name if not given.
+    """
+    if file_format is None:
+        name = getattr(file, 'name', '')
+        file_format = 'jsonl' if str(name).endswith(
+            ('.jsonl', '.ndjson')) else 'csv'
+    if file_format == 'csv':
+        yield from csv.DictReader(file)
+    elif file_format == 'jsonl':
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        raise ValueError(f'Unknown file format: {file_format}')
+
+
+def get_mapper(model: Type[models.Model], key_fields: Sequence[str]) \
+        -> Callable[[dict], Record]:
+    """
+    Map a row to `(search_keys, values)`: concrete field columns (by name
+    or attname) are converted with `to_python()` and keyed by attname,
+    so relations get ids, other columns are ignored. Rows with empty key
+    values have no search keys and are created, rows without key columns
+    are rejected.
+    """
+    fields = get_model_meta(model).concrete_fields
+
+    def mapper(row):
+        values = {}
+        for name, value in row.items():
+            field = fields.get(name)
+            if field is None:
+                continue
+            target_field = field.target_field if field.is_relation \
+                else field
+            values[field.attname] = target_field.to_python(value)
+        search_keys = {
+            fields[name].attname: values[fields[name].attname]
+            for name in key_fields}
+        if any(value in (None, '') for value in search_keys.values()):
+            search_keys = None
+        return search_keys, values
+    return mapper
+
+
+def _import_chunk(source, records, m2m_replace, close_connections):
+    try:
+        return bulk_update_or_create_objects(
+            source, records, batch_size=len(records),
+            m2m_replace=m2m_replace)
+    finally:
+        if close_connections:
+            # worker threads have their own connections
+            connections.close_all()
+
+
+def _get_max_rss():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def import_objects(
+        source: Union[Type[models.Model], models.QuerySet, models.Manager],
+        rows: Iterable[dict],
+        key_fields: Sequence[str] = (),
+        mapper: Optional[Callable[[dict], Record]] = None,
+        chunk_size: int = 1000,
+        workers: int = 1,
+        reject_file: Optional[TextIO] = None,
+        m2m_replace: bool = False) -> ImportStats:
+    """
+    Stream `rows` through `bulk_update_or_create_objects` by chunks of
+    `chunk_size`, each chunk is written in its own transaction. With
+    `workers > 1` chunks are written by a thread pool, every thread has
+    its own database connection, at most `2 * workers` chunks are in
+    memory.
+
+    `mapper` maps a row to `(search_keys, values)`, `get_mapper()` of
+    `key_fields` by default. Rejected rows are written to `reject_file`
+    as JSON lines: `{"line": 1, "row": {...}, "error": "..."}`.
+    """
+    queryset = _get_source_queryset(source)
+    if mapper is None:
+        mapper = get_mapper(queryset.model, key_fields)
+    stats = ImportStats()
+    started = time.monotonic()
+
+    def reject(line, row, error):
+        stats.rejected += 1
+        _write_reject(reject_file, line, row, error)
+
+    def chunks():
+        numbered = enumerate(rows, start=1)
+        chunk = list(islice(numbered, chunk_size))
+        while chunk:
+            mapped = []
+            for line, row in chunk:
+                stats.rows += 1
+                try:
+                    mapped.append((line, row, mapper(row)))
+                except (ValidationError, ValueError, KeyError) as exc:
+                    reject(line, row, exc)
+            if mapped:
+                yield mapped
+            chunk = list(islice(numbered, chunk_size))
+
+    def collect(mapped, results):
+        for (line, row, _), result in zip(mapped, results):
+            if isinstance(result, ValueError):
+                reject(line, row, result)
+            elif result[2]:
+                stats.created += 1
+            elif result[1]:
+                stats.updated += 1
+            else:
+                stats.unchanged += 1
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+            for mapped in chunks():
+                if len(pending) >= 2 * workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(pending.pop(future), future.result())
+                future = executor.submit(
+                    _import_chunk, queryset,
+                    [record for _, _, record in mapped], m2m_replace, True)
+                pending[future] = mapped
+            for future, mapped in pending.items():
+                collect(mapped, future.result())
+    else:
+        for mapped in chunks():
+            collect(mapped, _import_chunk(
+                queryset, [record for _, _, record in mapped], m2m_replace,
+                False))
+
+    stats.seconds = time.monotonic() - started
+    stats.max_rss = _get_max_rss()
+    LOGGER.info('Import %s: %s', queryset.model.__name__, stats)
+    return stats
+
+
+def _with_deleted(queryset):
+    """
+    `queryset` of a SoftDeleted model with its filters, but without the
+    `deleted` restriction of `objects`/`deleted_objects` managers.
+    """
+    from pik.core.models.soft_deleted import (  # noqa: protected-access
+        _SoftDeletedObjectsWhereNode, _SoftObjectsWhereNode)
+
+    queryset = queryset.all()
+    query = queryset.query
+    if issubclass(query.where_class, (
+            _SoftObjectsWhereNode, _SoftDeletedObjectsWhereNode)):
+        # the restriction is the first condition added by the manager
+        first = query.where.children[0] if query.where.children else None
+        if (getattr(first, 'lookup_name', None) == 'isnull'
+                and first.lhs.target.name == 'deleted'):
+            query.where.children.pop(0)
+    return queryset
+
+
+def _get_scope_values(queryset):
+    """
+    Field values by attname of the `field=value` filters of `queryset`,
+    applied to the rows it creates.
+    """
+    query = queryset.query
+    values = {}
+    if query.where.connector != AND or query.where.negated:
+        return values
+    for child in query.where.children:
+        if (isinstance(child, Exact) and isinstance(child.lhs, Col)
+                and child.lhs.alias == queryset.model._meta.db_table  # noqa: protected-access
+                and child.lhs.target.model is queryset.model
+                and not hasattr(child.rhs, 'resolve_expression')):
+            values[child.lhs.target.attname] = child.rhs
+    return values
+
+
+def _apply_scope_values(model, record, scope_values):
+    """
+    Record values with the scope values, ValueError if the record
+    has other values of the scope fields.
+    """
+    fields = get_model_meta(model).concrete_fields
+    values = dict(record)
+    for attname, scope_value in scope_values.items():
+        field = fields[attname]
+        names = [name for name in (field.name, attname) if name in record]
+        if not names:
+            values[attname] = scope_value
+            continue
+        for name in names:
+            if (_get_key_value(model, name, record[name])
+                    != _get_key_value(model, name, scope_value)):
+                raise ValueError(
+                    f'{name}={record[name]!r} is out of the reconciled '
+                    f'queryset ({field.name}={scope_value!r})')
+    return values
+
+
+def reconcile(
+        queryset: Union[models.QuerySet, models.Manager],
+        records: Iterable[dict],
+        key_fields: Sequence[str],
+        chunk_size: int = 1000,
+        reject_file: Optional[TextIO] = None) -> ReconcileStats:
+    """
+    Make live rows of the SoftDeleted model `queryset` equal to the
+    `records` snapshot.
+
+    Records are streamed through `bulk_update_or_create_objects` matched
+    by `key_fields` among live and deleted rows of `queryset`, soft
+    deleted rows which reappear are restored. Rows outside of `queryset`
+    are never written: created rows get the values of its `field=value`
+    filters and records with other values are rejected. Only the keys of
+    records are kept in memory. Live rows of `queryset` whose keys were
+    not seen are soft deleted afterwards by chunks of `chunk_size`, with
+    the usual cascade.
+    """
+    from pik.core.models import SoftDeleted
+
+    queryset = _get_source_queryset(queryset)
+    model = queryset.model
+    if not issubclass(model, SoftDeleted):
+        raise ValueError(f'{model.__name__} is not SoftDeleted model')
+
+    fields = get_model_meta(model).fields
+    scope = _with_deleted(queryset)
+    scope_values = _get_scope_values(queryset)
+    stats = ReconcileStats()
+    started = time.monotonic()
+    seen = set()
+
+    def reject(line, row, error):
+        stats.rejected += 1
+        _write_reject(reject_file, line, row, error)
+
+    numbered = enumerate(records, start=1)
+    chunk = list(islice(numbered, chunk_size))
+    while chunk:
+        mapped = []
+        for line, record in chunk:
+            stats.rows += 1
+            try:
+                key = tuple(
+                    _get_key_value(model, name, record[name])
+                    for name in key_fields)
+                values = _apply_scope_values(model, record, scope_values)
+            except (ValidationError, KeyError, ValueError) as exc:
+                reject(line, record, exc)
+                continue
+            seen.add(key)
+            mapped.append((line, record, (
+                {name: record[name] for name in key_fields},
+                {**values, 'deleted': None})))
+
+        results = bulk_update_or_create_objects(
+            scope, [item for _, _, item in mapped], batch_size=chunk_size)
+        for (line, record, _), result in zip(mapped, results):
+            if isinstance(result, ValueError):
+                reject(line, record, result)
+            elif result[2]:
+                stats.created += 1
+            elif 'deleted' in result[1]:
+                stats.restored += 1
+            elif result[1]:
+                stats.updated += 1
+            else:
+                stats.unchanged += 1
+        chunk = list(islice(numbered, chunk_size))
+
+    attnames = [fields[name].attname for name in key_fields]
+    missing = []
+    for pk, *values in queryset.filter(deleted__isnull=True).values_list(
+            'pk', *attnames).iterator(chunk_size=chunk_size):
+        key = tuple(
+            _get_key_value(model, name, value)
+            for name, value in zip(key_fields, values))
+        if key not in seen:
+            missing.append(pk)
+    del seen
+
+    for offset in range(0, len(missing), chunk_size):
+        _, counter = model.all_objects.using(queryset.db).filter(
+            pk__in=missing[offset:offset + chunk_size]).delete()
+        stats.deleted += counter.get(model._meta.label, 0)  # noqa: protected-access
+
+    stats.seconds = time.monotonic() - started
+    stats.max_rss = _get_max_rss()
+    LOGGER.info('Reconcile %s: %s', model.__name__, stats)
+    return stats
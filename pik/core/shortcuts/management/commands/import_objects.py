@@ -0,0 +1,51 @@
+from contextlib import ExitStack
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from ...importing import import_objects, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Update or create model objects from a CSV or JSON lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', metavar='app_label.ModelName')
+        parser.add_argument('path', help='CSV or JSON lines file')
+        parser.add_argument(
+            '--key', action='append', default=[], dest='key_fields',
+            help='Search key column, may be repeated')
+        parser.add_argument(
+            '--format', choices=('csv', 'jsonl'), default=None,
+            help='File format, guessed by the file extension by default')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Threads writing chunks, each with its own connection')
+        parser.add_argument(
+            '--reject-file', default=None,
+            help='JSON lines file for rejected rows')
+        parser.add_argument(
+            '--m2m-replace', action='store_true',
+            help='Remove related objects missing in many to many values')
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as exc:
+            raise CommandError(str(exc)) from exc
+
+        with ExitStack() as stack:
+            file = stack.enter_context(
+                open(options['path'], newline='', encoding='utf-8'))
+            reject_file = None
+            if options['reject_file']:
+                reject_file = stack.enter_context(
+                    open(options['reject_file'], 'w', encoding='utf-8'))
+            stats = import_objects(
+                model, read_rows(file, options['format']),
+                key_fields=options['key_fields'],
+                chunk_size=options['chunk_size'],
+                workers=options['workers'], reject_file=reject_file,
+                m2m_replace=options['m2m_replace'])
+        self.stdout.write(f'{model._meta.label}: {stats}')  # noqa: protected-access
@@ -1,29 +1,171 @@
 import logging
-from typing import Optional, Type, Tuple, Union, List
+from functools import reduce
+from itertools import islice
+from operator import or_
+from typing import (
+    Iterable, Optional, Sequence, Type, Tuple, Union, List, Dict, Any)
 
 from django.core.exceptions import ValidationError
-from django.db import models, IntegrityError
+from django.db import models, IntegrityError, connections, transaction
+from django.utils.timezone import now
+
+from ..history import bulk_history_create
+from ..meta import get_model_meta
+from ._upsert import upsert_row
+from .identity_map import (
+    get_identity_key, get_identity_map, invalidate_identity_map)
 
 LOGGER = logging.getLogger(__name__)
 
+# composite keys are looked up by an OR of key conditions, SQLite limits
+# the expression tree depth to 1000
+COMPOSITE_KEYS_CHUNK_SIZE = 500
+
 
-def _update_m2m_fields(_obj, **kwargs):
+def _update_m2m_fields(_obj, _replace=False, **kwargs) -> List[str]:
+    """
+    Add missing related objects with one query for current ids and one
+    bulk `add()` per field, with `_replace` remove the extra ones too.
+    :return updated field names
+    """
+    updated_keys = []
     for key, values in kwargs.items():
+        m2m_set = getattr(_obj, key)
+        pk_field = m2m_set.model._meta.pk  # noqa: pylint=protected-access
+        current = {
+            pk_field.to_python(pk)
+            for pk in m2m_set.values_list('pk', flat=True)}
+        new = {}
         for value in values:
-            m2m_set = getattr(_obj, key)
-            if value not in m2m_set.all():
-                m2m_set.add(value)
+            pk = value.pk if isinstance(value, models.Model) else value
+            new.setdefault(pk_field.to_python(pk), value)
+
+        to_add = [value for pk, value in new.items() if pk not in current]
+        to_remove = current.difference(new) if _replace else set()
+        if to_add:
+            m2m_set.add(*to_add)
+        if to_remove:
+            m2m_set.remove(*to_remove)
+        if to_add or to_remove:
+            updated_keys.append(key)
+    return updated_keys
 
 
 def _get_m2m_kwargs(_model, **kwargs):
-    m2m_kwargs = {}
-    for field in _model._meta.get_fields():  # noqa: pylint=protected-access
-        if (field.get_internal_type() == 'ManyToManyField'
-                and field.name in kwargs):
-            m2m_kwargs[field.name] = kwargs.pop(field.name)
+    m2m_names = get_model_meta(_model).m2m_names
+    m2m_kwargs = {
+        name: kwargs.pop(name) for name in list(kwargs)
+        if name in m2m_names}
     return m2m_kwargs, kwargs
 
 
+def _get_concrete_field(model, key) -> Optional[models.Field]:
+    return get_model_meta(model).concrete_fields.get(key)
+
+
+def _set_changed_values(_obj, **kwargs) -> Dict[str, Any]:
+    """
+    Set values which differ from the current ones. Relations are compared
+    by `attname`, related objects are not fetched.
+    :return old values by key
+    """
+    model = type(_obj)
+    old_values = {}
+    try:
+        for key, value in kwargs.items():
+            field = _get_concrete_field(model, key)
+            if field is None:
+                old_value = getattr(_obj, key)
+                is_changed = old_value != value
+            elif field.is_relation:
+                old_value = getattr(_obj, field.attname)
+                if isinstance(value, models.Model):
+                    value = getattr(value, field.target_field.attname)
+                try:
+                    is_changed = \
+                        old_value != field.target_field.to_python(value)
+                except ValidationError:
+                    is_changed = True
+            else:
+                old_value = getattr(_obj, field.attname)
+                is_changed = old_value != value
+            if is_changed:
+                setattr(_obj, key, kwargs[key])
+                old_values[key] = old_value
+    except (AttributeError, TypeError, ValueError):
+        # unknown key or a value the field descriptor rejects
+        _restore_values(_obj, old_values)
+        raise
+    return old_values
+
+
+def _restore_values(obj, old_values):
+    model = type(obj)
+    for key, old_value in old_values.items():
+        field = _get_concrete_field(model, key)
+        setattr(obj, field.attname if field else key, old_value)
+
+
+def _validate_fields(obj, keys, validate_unique=True):
+    """
+    `full_clean()` limited to the fields of `keys` and unique checks
+    which include them.
+    """
+    model = type(obj)
+    fields = [_get_concrete_field(model, key) for key in keys]
+    if None in fields:
+        obj.full_clean(validate_unique=validate_unique)
+        return
+
+    names = {field.name for field in fields}
+    all_names = [field.name for field in model._meta.fields]  # noqa: pylint=protected-access
+    errors: Dict[str, Any] = {}
+    try:
+        obj.clean_fields(
+            exclude=[name for name in all_names if name not in names])
+    except ValidationError as exc:
+        errors = exc.update_error_dict(errors)
+    try:
+        obj.clean()
+    except ValidationError as exc:
+        errors = exc.update_error_dict(errors)
+
+    checked = set()
+    for group in get_model_meta(model).unique_groups:
+        if names.intersection(group):
+            checked.update(group)
+    if validate_unique and checked and not errors:
+        try:
+            obj.validate_unique(
+                exclude=[name for name in all_names if name not in checked])
+        except ValidationError as exc:
+            errors = exc.update_error_dict(errors)
+
+    if errors:
+        raise ValidationError(errors)
+
+
+def _get_update_fields(model, keys) -> Optional[List[str]]:
+    """
+    `update_fields` for `.save()` of changed `keys` with the fields
+    `.save()` changes by itself: `auto_now` dates and version.
+    """
+    fields = [_get_concrete_field(model, key) for key in keys]
+    if None in fields or any(field.primary_key for field in fields):
+        return None
+    names = [field.name for field in fields]
+    names.extend(get_model_meta(model).auto_update_names)
+    return list(dict.fromkeys(names))
+
+
+def _get_source_queryset(source):
+    if isinstance(source, models.QuerySet):
+        return source
+    if isinstance(source, models.Manager):
+        return source.all()
+    return source.objects.all()
+
+
 def get_object_or_none(
         source: Union[Type[models.Model], models.QuerySet, models.Manager],
         *args, **kwargs) -> Optional[models.Model]:
@@ -33,10 +175,88 @@ def get_object_or_none(
     if not isinstance(source, (models.QuerySet, models.Manager)):
         source = source.objects
 
+    identity_map = get_identity_map()
+    key = None
+    if identity_map is not None:
+        key = get_identity_key(source, args, kwargs)
+        if key is not None:
+            found, obj = identity_map.get(key)
+            if found:
+                return obj
+
     try:
-        return source.get(*args, **kwargs)
+        obj = source.get(*args, **kwargs)
     except source.model.DoesNotExist:
-        return None
+        obj = None
+    if key is not None:
+        identity_map.set(key, obj)
+    return obj
+
+
+def get_objects_or_none(
+        source: Union[Type[models.Model], models.QuerySet, models.Manager],
+        keys: Iterable[Any],
+        field: Union[str, Sequence[str]] = 'uid',
+        batch_size: int = 1000) -> Dict[Any, Optional[models.Model]]:
+    """
+    Batch `get_object_or_none`: one `field__in` query per `batch_size`
+    keys. With a tuple of fields keys are tuples of values and every
+    chunk (of at most `COMPOSITE_KEYS_CHUNK_SIZE` keys) is one query with
+    OR of the key conditions. Keys which are not valid field values map
+    to None.
+
+    :raises MultipleObjectsReturned
+    :return {key: obj or None} for every key
+    """
+    assert (isinstance(source, (models.QuerySet, models.Manager))
+            or issubclass(source, models.Model))
+
+    queryset = _get_source_queryset(source)
+    model = queryset.model
+    names = (field, ) if isinstance(field, str) else tuple(field)
+    fields = get_model_meta(model).fields
+    attnames = [fields[name].attname for name in names]
+
+    def normalize(values):
+        return tuple(
+            _get_key_value(model, name, value)
+            for name, value in zip(names, values))
+
+    result: Dict[Any, Optional[models.Model]] = {}
+    by_key = {}
+    for key in keys:
+        result[key] = None
+        try:
+            key_value = normalize((key, ) if isinstance(field, str) else key)
+        except ValidationError:
+            # not a valid field value, there is no such row
+            continue
+        # equivalent keys in other forms ('5' and 5) get the same object
+        by_key.setdefault(key_value, []).append(key)
+
+    items = list(by_key.items())
+    if not isinstance(field, str):
+        batch_size = min(batch_size, COMPOSITE_KEYS_CHUNK_SIZE)
+    for offset in range(0, len(items), batch_size):
+        chunk = items[offset:offset + batch_size]
+        if isinstance(field, str):
+            condition = models.Q(**{
+                f'{field}__in': [value for (value, ), _ in chunk]})
+        else:
+            condition = reduce(or_, (
+                models.Q(**dict(zip(names, values))) for values, _ in chunk))
+        found = set()
+        for obj in queryset.filter(condition):
+            key_value = normalize(
+                [getattr(obj, attname) for attname in attnames])
+            if key_value in found:
+                raise model.MultipleObjectsReturned(
+                    f'get() returned more than one {model.__name__} '
+                    f'({dict(zip(names, key_value))!r})')
+            found.add(key_value)
+            for key in by_key[key_value]:
+                result[key] = obj
+    return result
 
 
 def validate_and_create_object(model: Type[models.Model], **kwargs) \
@@ -63,49 +283,51 @@ def validate_and_create_object(model: Type[models.Model], **kwargs) \
     return obj
 
 
-def validate_and_update_object(obj: models.Model, **kwargs) \
+def validate_and_update_object(
+        obj: models.Model, m2m_replace: bool = False, **kwargs) \
         -> Tuple[models.Model, List[str]]:
     """
+    Only changed fields are validated and saved, relations are compared
+    by ids. Many to many values are added to the current ones,
+    with `m2m_replace` the other related objects are removed.
+
     :raises ValueError
-    :return obj, is_updated
+    :return obj, updated_keys
     """
     assert isinstance(obj, models.Model)
     model = type(obj)
 
     m2m_kwargs, kwargs = _get_m2m_kwargs(model, **kwargs)
 
-    updated_keys = {}
-    for key, value in kwargs.items():
-        old_value = getattr(obj, key)
-        if old_value == value:
-            continue
-        setattr(obj, key, value)
-        updated_keys[key] = old_value
+    updated_keys = _set_changed_values(obj, **kwargs)
 
-    if updated_keys:
+    updated_m2m_keys = []
+    if updated_keys or m2m_kwargs:
         try:
-            obj.full_clean()
-            obj.save()
+            if updated_keys:
+                _validate_fields(obj, updated_keys)
+                obj.save(update_fields=_get_update_fields(model, updated_keys))
             if m2m_kwargs:
-                _update_m2m_fields(obj, **m2m_kwargs)
+                updated_m2m_keys = _update_m2m_fields(
+                    obj, m2m_replace, **m2m_kwargs)
 
         except (ValidationError, IntegrityError) as exc:
-            for key, old_value in updated_keys.items():
-                setattr(obj, key, old_value)
+            _restore_values(obj, updated_keys)
             LOGGER.warning(
                 'Update %s error: %r (kwargs=%r)', model.__name__, exc, kwargs)
             raise ValueError(str(exc)) from exc
-    return obj, list(updated_keys.keys())
+    return obj, list(updated_keys.keys()) + updated_m2m_keys
 
 
 def update_or_create_object(
         source: Union[Type[models.Model], models.QuerySet, models.Manager],
         search_keys: Optional[dict] = None,
+        m2m_replace: bool = False,
         **kwargs) \
         -> Tuple[models.Model, List[str], bool]:
     """
     :raises ValueError
-    :return obj, is_updated, is_created
+    :return obj, updated_keys, is_created
     """
     assert (isinstance(source, (models.QuerySet, models.Manager))
             or issubclass(source, models.Model))
@@ -117,9 +339,325 @@ def update_or_create_object(
     obj = get_object_or_none(source, **search_keys) if search_keys else None
     if obj:
         is_created = False
-        obj, updates = validate_and_update_object(obj, **kwargs)
+        obj, updates = validate_and_update_object(obj, m2m_replace, **kwargs)
     else:
         updates = []
         is_created = True
         obj = validate_and_create_object(model, **kwargs)
     return obj, updates, is_created
+
+
+def upsert_object(
+        source: Union[Type[models.Model], models.QuerySet, models.Manager],
+        search_keys: dict,
+        m2m_replace: bool = False,
+        **kwargs) \
+        -> Tuple[models.Model, List[str], bool]:
+    """
+    `update_or_create_object` validated and written by one
+    `INSERT ... ON CONFLICT (search_keys) DO UPDATE` statement
+    (PostgreSQL and SQLite), so concurrent calls don't race.
+    `search_keys` have to be fields of a unique constraint, the object is
+    built from `search_keys` and `kwargs` (which may repeat them), source
+    queryset filters are not applied to the conflicting row.
+
+    :raises ValueError
+    :return obj, updated_keys, is_created
+    """
+    assert (isinstance(source, (models.QuerySet, models.Manager))
+            or issubclass(source, models.Model))
+    if not search_keys:
+        raise ValueError('Upsert requires search keys')
+
+    queryset = _get_source_queryset(source)
+    model = queryset.model
+    m2m_kwargs, kwargs = _get_m2m_kwargs(model, **kwargs)
+    try:
+        with transaction.atomic(using=queryset.db):
+            obj, updates, is_created = upsert_row(
+                queryset, search_keys, kwargs)
+            if is_created or updates:
+                bulk_history_create(model, [obj], None, not is_created)
+                invalidate_identity_map(model)
+            if m2m_kwargs:
+                updated_m2m_keys = _update_m2m_fields(
+                    obj, m2m_replace, **m2m_kwargs)
+                if not is_created:
+                    updates += updated_m2m_keys
+
+    except (ValidationError, IntegrityError, TypeError) as exc:
+        LOGGER.warning(
+            'Upsert %s error: %r (kwargs=%r)', model.__name__, exc, kwargs)
+        raise ValueError(str(exc)) from exc
+    return obj, updates, is_created
+
+
+BulkResult = Union[Tuple[models.Model, List[str], bool], ValueError]
+
+
+def _get_key_value(model, name, value):
+    """Search key value comparable with the `attname` value of a row."""
+    field = get_model_meta(model).fields[name]
+    if field.is_relation:
+        if isinstance(value, models.Model):
+            value = value.pk
+        field = field.target_field
+    return field.to_python(value)
+
+
+def _get_row_key(model, obj, names):
+    fields = get_model_meta(model).fields
+    return tuple(
+        _get_key_value(model, name, getattr(obj, fields[name].attname))
+        for name in names)
+
+
+def _can_bulk_create(model, using):
+    """
+    `bulk_create` sets auto increment pks only on backends which return
+    rows from bulk inserts, objects with unknown pks are saved one by one.
+    """
+    return (
+        not isinstance(model._meta.pk, models.AutoField)  # noqa: pylint=protected-access
+        or connections[using].features.can_return_rows_from_bulk_insert)
+
+
+def _prepare_bulk_save(obj, is_created, time):
+    """
+    Values `.save()` would set by itself: version and `auto_now` dates.
+    :return updated field names
+    """
+    meta = get_model_meta(type(obj))
+    fields = []
+    for name in meta.auto_update_names:
+        field = meta.concrete_fields[name]
+        if name == 'version':
+            if is_created or not obj.version:
+                obj.version = 1
+            elif obj.autoincrement_version:
+                obj.version += 1
+        elif is_created:
+            continue
+        elif isinstance(field, models.DateTimeField):
+            setattr(obj, field.attname, time)
+        else:
+            setattr(obj, field.attname, time.date())
+        fields.append(name)
+    return fields
+
+
+class _BulkRow:
+    def __init__(self, index, search_keys, kwargs, m2m_kwargs):
+        self.index = index
+        self.search_keys = search_keys
+        self.kwargs = kwargs
+        self.m2m_kwargs = m2m_kwargs
+        self.obj = None
+        self.updated_keys = []
+        self.is_created = False
+
+
+def _find_existing(queryset, rows):
+    """
+    Existing objects by search key names and values, one query for all
+    rows, or per `COMPOSITE_KEYS_CHUNK_SIZE` rows with composite or mixed
+    search keys. Keys which match several rows map to None.
+    """
+    model = queryset.model
+    names_set = {tuple(sorted(row.search_keys)) for row in rows}
+    if len(names_set) == 1 and len(next(iter(names_set))) == 1:
+        name = next(iter(names_set))[0]
+        conditions = [models.Q(**{
+            f'{name}__in': [row.search_keys[name] for row in rows]})]
+    else:
+        conditions = [
+            reduce(or_, (
+                models.Q(**row.search_keys)
+                for row in rows[offset:offset + COMPOSITE_KEYS_CHUNK_SIZE]))
+            for offset in range(0, len(rows), COMPOSITE_KEYS_CHUNK_SIZE)]
+
+    existing: Dict[Tuple[Tuple[str, ...], tuple], Any] = {}
+    found = set()
+    for condition in conditions:
+        for obj in queryset.filter(condition):
+            if obj.pk in found:
+                # matched by rows of several chunks
+                continue
+            found.add(obj.pk)
+            for names in names_set:
+                key = (names, _get_row_key(model, obj, names))
+                existing[key] = None if key in existing else obj
+    return existing
+
+
+def _prepare_rows(queryset, rows, results):
+    """
+    Match rows with existing or pending objects, apply and validate
+    values in memory. Invalid rows get `ValueError` results, the other
+    rows of the batch are written.
+    """
+    model = queryset.model
+    search_rows = [row for row in rows if row.search_keys]
+    existing = _find_existing(queryset, search_rows) if search_rows else {}
+    pending = {}
+
+    for row in rows:
+        key = None
+        obj = None
+        try:
+            if row.search_keys:
+                names = tuple(sorted(row.search_keys))
+                key = (names, tuple(
+                    _get_key_value(model, name, row.search_keys[name])
+                    for name in names))
+                if key in existing and existing[key] is None:
+                    raise model.MultipleObjectsReturned(
+                        f'get() returned more than one {model.__name__} '
+                        f'(search_keys={row.search_keys!r})')
+                obj = pending.get(key) or existing.get(key)
+
+            if obj is None:
+                row.obj = model(**row.kwargs)
+                row.is_created = True
+                row.obj.full_clean(validate_unique=False)
+            else:
+                row.obj = obj
+                _apply_values(row)
+        except (ValidationError, model.MultipleObjectsReturned,
+                AttributeError, TypeError, ValueError) as exc:
+            # TypeError: unknown key, ValueError: not an object for
+            # a relation name, AttributeError: unknown key of an update
+            LOGGER.warning(
+                'Bulk %s %s error: %r (kwargs=%r)',
+                'create' if row.is_created else 'update',
+                model.__name__, exc, row.kwargs)
+            results[row.index] = ValueError(str(exc))
+            continue
+
+        if key is not None:
+            pending[key] = row.obj
+        results[row.index] = row
+
+
+def _apply_values(row):
+    obj = row.obj
+    updated_keys = _set_changed_values(obj, **row.kwargs)
+    if not updated_keys:
+        return
+    try:
+        _validate_fields(obj, updated_keys, validate_unique=False)
+    except ValidationError:
+        _restore_values(obj, updated_keys)
+        raise
+    row.updated_keys = list(updated_keys)
+
+
+def _bulk_write(queryset, rows, batch_size, m2m_replace):
+    """
+    Insert new objects with `bulk_create` and update changed ones with
+    one `bulk_update` of all changed fields, history rows are bulk
+    inserted too.
+    """
+    model = queryset.model
+    using = queryset.db
+    time = now()
+    to_create = list({
+        id(row.obj): row.obj for row in rows if row.is_created}.values())
+    # later records of created objects are in the insert already
+    update_rows = [
+        row for row in rows
+        if row.updated_keys and not row.obj._state.adding]  # noqa: pylint=protected-access
+    to_update = list({id(row.obj): row.obj for row in update_rows}.values())
+    fields = get_model_meta(model).fields
+    update_fields = {
+        fields[key].name for row in update_rows for key in row.updated_keys}
+
+    for obj in to_create:
+        _prepare_bulk_save(obj, True, time)
+    for obj in to_update:
+        update_fields.update(_prepare_bulk_save(obj, False, time))
+
+    if _can_bulk_create(model, using):
+        queryset.bulk_create(to_create, batch_size=batch_size)
+        bulk_history_create(model, to_create, batch_size, False)
+    else:
+        for obj in to_create:
+            obj.save(using=using)
+    if to_update:
+        queryset.bulk_update(
+            to_update, sorted(update_fields), batch_size=batch_size)
+    bulk_history_create(model, to_update, batch_size, True)
+    if to_create or to_update:
+        # bulk writes don't send `post_save`
+        invalidate_identity_map(model)
+
+    for row in rows:
+        if row.m2m_kwargs:
+            updated_m2m_keys = _update_m2m_fields(
+                row.obj, m2m_replace, **row.m2m_kwargs)
+            if not row.is_created:
+                row.updated_keys = row.updated_keys + updated_m2m_keys
+
+
+def _write_one_by_one(queryset, rows, results, m2m_replace):
+    for row in rows:
+        try:
+            with transaction.atomic(using=queryset.db):
+                results[row.index] = update_or_create_object(
+                    queryset, row.search_keys, m2m_replace, **row.kwargs,
+                    **row.m2m_kwargs)
+        except (ValueError, queryset.model.MultipleObjectsReturned) as exc:
+            results[row.index] = ValueError(str(exc))
+
+
+def bulk_update_or_create_objects(
+        source: Union[Type[models.Model], models.QuerySet, models.Manager],
+        records: Iterable[Tuple[Optional[dict], dict]],
+        batch_size: int = 1000,
+        m2m_replace: bool = False) -> List[BulkResult]:
+    """
+    Batch `update_or_create_object` for `(search_keys, kwargs)` records.
+
+    Each chunk of `batch_size` records costs one query to find existing
+    rows (one per `COMPOSITE_KEYS_CHUNK_SIZE` records with composite
+    search keys), values are compared and validated (without `validate_unique`)
+    in memory and written with `bulk_create`/`bulk_update`. Records which
+    match the same row are applied to one object in order. If a chunk hits
+    an `IntegrityError`, its records are written one by one, so a bad
+    record doesn't abort the whole batch. Many to many values are synced
+    like in `validate_and_update_object`.
+
+    :return per record `(obj, updated_keys, is_created)` or `ValueError`
+    """
+    assert (isinstance(source, (models.QuerySet, models.Manager))
+            or issubclass(source, models.Model))
+
+    queryset = _get_source_queryset(source)
+    model = queryset.model
+    results: List[Any] = []
+    iterator = iter(records)
+    chunk = list(islice(iterator, batch_size))
+    while chunk:
+        rows = []
+        for search_keys, kwargs in chunk:
+            m2m_kwargs, kwargs = _get_m2m_kwargs(model, **kwargs)
+            rows.append(_BulkRow(
+                len(results), search_keys, kwargs, m2m_kwargs))
+            results.append(None)
+
+        _prepare_rows(queryset, rows, results)
+        valid_rows = [row for row in rows if results[row.index] is row]
+        try:
+            with transaction.atomic(using=queryset.db):
+                _bulk_write(queryset, valid_rows, batch_size, m2m_replace)
+        except IntegrityError as exc:
+            LOGGER.warning(
+                'Bulk write %s error: %r, writing one by one',
+                model.__name__, exc)
+            _write_one_by_one(queryset, valid_rows, results, m2m_replace)
+        else:
+            for row in valid_rows:
+                results[row.index] = (
+                    row.obj, row.updated_keys, row.is_created)
+        chunk = list(islice(iterator, batch_size))
+    return results
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class SoftDeletedConfig(AppConfig):
+    name = 'pik.core.soft_deleted'
+
+    def ready(self):
+        from . import checks  # noqa: unused-import
@@ -0,0 +1,76 @@
+from django.apps import apps
+from django.core import checks
+from django.db import models
+
+from pik.core.models import SoftDeleted
+
+
+def _is_live_condition(condition):
+    """Is the condition restricted by `deleted` field."""
+    if condition is None:
+        return False
+    for child in condition.children:
+        if isinstance(child, models.Q):
+            if _is_live_condition(child):
+                return True
+        elif child[0].split('__')[0] == 'deleted':
+            return True
+    return False
+
+
+def _live_leading_fields(model):
+    """First fields of partial indexes and conditional unique constraints."""
+    return {
+        index.fields[0].lstrip('-')
+        for index in [*model._meta.indexes, *model._meta.constraints]  # noqa: protected-access
+        if getattr(index, 'fields', None)
+        and _is_live_condition(getattr(index, 'condition', None))}
+
+
+def _check_model(model):
+    errors = []
+    opts = model._meta  # noqa: protected-access
+    leading_fields = _live_leading_fields(model)
+    not_indexed = []
+    for field in opts.local_concrete_fields:
+        if field.primary_key or field.one_to_one:
+            # one to one relations are unique by design and indexed
+            continue
+        if field.unique:
+            errors.append(checks.Warning(
+                f'{opts.label}.{field.name} is unique among deleted rows too.',
+                hint=f"Use soft_unique_constraint('{field.name}', name=...) "
+                     f"in Meta.constraints instead of unique=True.",
+                obj=model, id='soft_deleted.W001'))
+        elif field.is_relation and field.name not in leading_fields:
+            not_indexed.append(field.name)
+    if not_indexed:
+        errors.append(checks.Warning(
+            f'{opts.label} foreign keys {", ".join(not_indexed)} '
+            f'have no index of live rows.',
+            hint="Add soft_index('<field>', name=...) to Meta.indexes.",
+            obj=model, id='soft_deleted.W002'))
+    for fields in opts.unique_together:
+        errors.append(checks.Warning(
+            f'{opts.label} unique_together {tuple(fields)} is unique '
+            f'among deleted rows too.',
+            hint='Use soft_unique_constraint(...) in Meta.constraints.',
+            obj=model, id='soft_deleted.W001'))
+    return errors
+
+
+@checks.register(checks.Tags.models)
+def check_soft_deleted_indexes(app_configs=None, **kwargs):
+    """
+    SoftDeleted models should index and constrain live rows: every default
+    query and join is restricted by `deleted IS NULL`.
+    """
+    if app_configs is None:
+        app_configs = apps.get_app_configs()
+    errors = []
+    for app_config in app_configs:
+        for model in app_config.get_models():
+            if (issubclass(model, SoftDeleted) and model._meta.managed  # noqa: protected-access
+                    and not model._meta.proxy):  # noqa: protected-access
+                errors.extend(_check_model(model))
+    return errors
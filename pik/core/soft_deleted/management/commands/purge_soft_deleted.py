@@ -0,0 +1,36 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from pik.core.models import SoftDeleted
+
+from ...tasks import purge_soft_deleted
+
+
+class Command(BaseCommand):
+    help = 'Hard delete rows soft deleted longer than retention ago'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*', metavar='app_label.ModelName',
+            help='Models to purge, all SoftDeleted models by default')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only count rows which would be purged')
+        parser.add_argument(
+            '--chunk-size', type=int, default=None,
+            help='Rows per DELETE, SOFT_DELETE_PURGE_CHUNK_SIZE by default')
+        parser.add_argument(
+            '--sleep', type=float, default=None,
+            help='Seconds between chunks, SOFT_DELETE_PURGE_SLEEP by default')
+
+    def handle(self, *args, **options):
+        for label in options['models']:
+            if not issubclass(apps.get_model(label), SoftDeleted):
+                raise CommandError(f'{label} is not SoftDeleted model')
+
+        counter = purge_soft_deleted(
+            options['models'], dry_run=options['dry_run'],
+            chunk_size=options['chunk_size'], sleep=options['sleep'])
+        action = 'would be purged' if options['dry_run'] else 'purged'
+        for label, count in counter.items():
+            self.stdout.write(f'{label}: {count} {action}')
@@ -0,0 +1,34 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from pik.core.models._soft_delete_plan import get_soft_delete_plan  # noqa: protected-access
+
+
+class Command(BaseCommand):
+    help = 'Show precomputed soft delete cascade plans'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*', metavar='app_label.ModelName',
+            help='Models to show, all models by default')
+
+    def handle(self, *args, **options):
+        models = [apps.get_model(label) for label in options['models']] \
+            or apps.get_models()
+        for model in models:
+            plan = get_soft_delete_plan(model)
+            self.stdout.write(
+                f'{model._meta.label}: soft={plan.is_soft} '  # noqa: protected-access
+                f'excluded={plan.is_excluded} '
+                f'violates_safe_mode={plan.violates_safe_mode}')
+            for relation in plan.relations:
+                self.stdout.write(
+                    f'  {relation.field.model._meta.label}.'  # noqa: protected-access
+                    f'{relation.field.name}: '
+                    f'{getattr(relation.on_delete, "__name__", relation.on_delete)}')
+            for violation in plan.violations:
+                path = ' <- '.join(
+                    f'{field.model._meta.label}.{field.name}'  # noqa: protected-access
+                    for field in violation.path)
+                self.stdout.write(
+                    self.style.WARNING(f'  violation: {path}'))
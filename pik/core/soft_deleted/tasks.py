@@ -0,0 +1,289 @@
+import time
+from datetime import timedelta
+from typing import Dict, List, Optional, Type
+
+from celery import app
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import (
+    DatabaseError, IntegrityError, models, router, transaction)
+from django.db.models.sql import DeleteQuery
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+from tqdm import tqdm
+
+from pik.core.models import SoftDeleted
+from pik.core.models._soft_delete_plan import (  # noqa: protected-access
+    check_protected, check_safe_mode, get_soft_delete_plan)
+from pik.core.models.soft_deleted import (  # noqa: protected-access
+    _soft_delete, _soft_delete_queryset)
+from pik.core.models.soft_deleted_archive import archive_rows
+
+
+def _get_keep_days(model) -> Optional[int]:
+    """Retention of soft deleted rows, None keeps them forever."""
+    models_keep_days = getattr(
+        settings, 'SOFT_DELETE_PURGE_MODELS_KEEP_DAYS', {})
+    if model._meta.label in models_keep_days:  # noqa: protected-access
+        return models_keep_days[model._meta.label]  # noqa: protected-access
+    return getattr(settings, 'SOFT_DELETE_PURGE_KEEP_DAYS', 365)
+
+
+def _get_purge_models(labels=None) -> List[Type[models.Model]]:
+    """
+    SoftDeleted models ordered referencing models first, so rows
+    which reference older rows are purged before them.
+    """
+    if labels:
+        candidates = [apps.get_model(label) for label in labels]
+    else:
+        candidates = [
+            model for model in apps.get_models()
+            if issubclass(model, SoftDeleted)]
+
+    ordered: List[Type[models.Model]] = []
+    pending = list(candidates)
+    while pending:
+        for model in pending:
+            referencing = {
+                relation.related_model
+                for relation in get_soft_delete_plan(model).relations}
+            if not referencing.intersection(pending) - {model}:
+                break
+        else:
+            # reference cycle: purge in any order, referenced rows are kept
+            model = pending[0]
+        pending.remove(model)
+        ordered.append(model)
+    return ordered
+
+
+def _get_purgeable(model, deletion_date):
+    """
+    Rows soft deleted before `deletion_date` which no row references
+    through a database constraint anymore.
+    """
+    queryset = model._base_manager.filter(
+        deleted__lte=deletion_date).order_by('pk')
+    for relation in get_soft_delete_plan(model).relations:
+        field = relation.field
+        if relation.related_model._meta.auto_created or not field.db_constraint:
+            continue
+        queryset = queryset.exclude(**{
+            f'{field.target_field.attname}__in':
+                relation.related_model._base_manager.filter(**{
+                    f'{field.attname}__isnull': False}).values(field.attname)})
+    return queryset
+
+
+def _purge_chunk(model, pk_list, using):
+    """
+    Hard delete rows with their auto created m2m through rows,
+    rows of models with `SoftDeletedArchive` are moved to the archive.
+    """
+    with transaction.atomic(using=using):
+        if hasattr(model._meta, 'soft_deleted_archive_model'):
+            archive_rows(model, pk_list, using)
+        for relation in get_soft_delete_plan(model).relations:
+            if relation.related_model._meta.auto_created:
+                relation.related_model._base_manager.using(using).filter(**{
+                    f'{relation.field.name}__in': pk_list})._raw_delete(using)
+        return DeleteQuery(model).delete_batch(pk_list, using)
+
+
+@app.shared_task()
+def purge_soft_deleted(labels=None, dry_run=False, chunk_size=None,
+                       sleep=None) -> Dict[str, int]:
+    """
+    Hard deletes (or moves to the archive table) rows soft deleted
+    longer than the model retention ago.
+    Returns purged (or, with `dry_run`, purgeable) rows count by model.
+    """
+    if chunk_size is None:
+        chunk_size = getattr(settings, 'SOFT_DELETE_PURGE_CHUNK_SIZE', 10_000)
+    if sleep is None:
+        sleep = getattr(settings, 'SOFT_DELETE_PURGE_SLEEP', 0)
+    purge_models = _get_purge_models(labels)
+    counter = {}
+
+    for model_number, model in enumerate(purge_models):
+        keep_days = _get_keep_days(model)
+        if keep_days is None:
+            continue
+        deletion_date = now() - timedelta(days=keep_days)
+        purgeable = _get_purgeable(model, deletion_date)
+        model_label = (
+            f'[{model_number + 1}/{len(purge_models)}] {model._meta.label}')  # noqa protected-access
+        if dry_run:
+            counter[model._meta.label] = purgeable.count()  # noqa protected-access
+            continue
+
+        using = router.db_for_write(model)
+        purged_count = 0
+        pbar = tqdm(total=purgeable.count(), desc=model_label)
+        last_pk = None
+        while True:
+            chunk = purgeable if last_pk is None \
+                else purgeable.filter(pk__gt=last_pk)
+            pk_list = list(chunk.values_list('pk', flat=True)[:chunk_size])
+            if not pk_list:
+                break
+            if last_pk is not None and sleep:
+                time.sleep(sleep)
+            count = _purge_chunk(model, pk_list, using)
+            purged_count += count
+            pbar.update(count)
+            last_pk = pk_list[-1]
+        pbar.close()
+        counter[model._meta.label] = purged_count  # noqa protected-access
+    return counter
+
+
+PENDING = 'PENDING'
+STARTED = 'STARTED'
+RETRY = 'RETRY'
+SUCCESS = 'SUCCESS'
+FAILURE = 'FAILURE'
+
+
+def _cascade_key(label, pk, deleted: str) -> str:
+    """Idempotency key of a delayed cascade: the root row and its mark."""
+    return f'soft_delete_cascade:{label}:{pk}:{deleted}'
+
+
+def _set_status(key, status, result=None):
+    cache = caches[getattr(settings, 'SOFT_DELETE_ASYNC_CACHE', 'default')]
+    cache.set(
+        key, {'status': status, 'result': result},
+        getattr(settings, 'SOFT_DELETE_ASYNC_STATUS_TTL', 24 * 60 * 60))
+
+
+def get_soft_delete_status(instance) -> Optional[dict]:
+    """
+    Status of the cascade enqueued by `instance.delete(async_cascade=True)`:
+    `{'status': 'PENDING'|'STARTED'|'RETRY'|'SUCCESS'|'FAILURE',
+    'result': (count, {model_label: count}) or None}`, None if unknown.
+    """
+    if not instance.deleted:
+        return None
+    cache = caches[getattr(settings, 'SOFT_DELETE_ASYNC_CACHE', 'default')]
+    return cache.get(_cascade_key(
+        instance._meta.label, instance.pk, instance.deleted.isoformat()))  # noqa: protected-access
+
+
+def delete_async(instance, using, keep_parents=False):
+    """
+    Mark only the instance row deleted, it is hidden by default managers
+    right away, and enqueue the cascade after commit. Safe mode and
+    PROTECT relations are checked before, like `delete()` does.
+    """
+    model = type(instance)
+    label = model._meta.label  # noqa: protected-access
+    time = now()
+    with transaction.atomic(using=using):
+        root = model._base_manager.using(using).filter(pk=instance.pk)
+        check_safe_mode(model, [instance], using)
+        check_protected(root, keep_parents)
+        count = root.filter(deleted__isnull=True).update(deleted=time)
+        if not count:
+            return 0, {}
+        args = (label, str(instance.pk), time.isoformat(), using, keep_parents)
+        key = _cascade_key(*args[:3])
+
+        def enqueue():
+            _set_status(key, PENDING)
+            soft_delete_cascade.apply_async(args=args, task_id=key)
+
+        transaction.on_commit(enqueue, using=using)
+    instance.deleted = time
+    return count, {label: count}
+
+
+def _merge_results(result, other):
+    count, counter = result
+    other_count, other_counter = other
+    counter = dict(counter)
+    for label, label_count in other_counter.items():
+        counter[label] = counter.get(label, 0) + label_count
+    return count + other_count, counter
+
+
+def _cascade_in_batches(model, pk, using, time):
+    """
+    Soft delete live rows referencing the marked root by CASCADE relations
+    in batches of `SOFT_DELETE_BATCH_SIZE`, every batch in its own
+    transaction with the root `deleted` time.
+    Stops if the root is not marked with `time` anymore.
+    """
+    result = (0, {})
+    marked = model._base_manager.using(using).filter(pk=pk, deleted=time)
+    root = marked.first()
+    if root is None:
+        return result
+    batch_size = getattr(settings, 'SOFT_DELETE_BATCH_SIZE', 1000)
+    for relation in get_soft_delete_plan(model).relations:
+        related_model = relation.related_model
+        if (relation.on_delete != models.CASCADE
+                or relation.field.remote_field.parent_link
+                or not issubclass(related_model, SoftDeleted)):
+            continue
+        children = related_model._base_manager.using(using).filter(**{
+            relation.field.name: root, 'deleted__isnull': True}).order_by('pk')
+        while True:
+            with transaction.atomic(using=using):
+                if not marked.select_for_update().exists():
+                    return result
+                pk_list = list(
+                    children.values_list('pk', flat=True)[:batch_size])
+                if not pk_list:
+                    break
+                result = _merge_results(result, _soft_delete_queryset(
+                    related_model._base_manager.using(using).filter(
+                        pk__in=pk_list), using, time))
+    return result
+
+
+@app.shared_task(bind=True, max_retries=5)
+def soft_delete_cascade(self, label, pk, deleted, using, keep_parents=False):
+    """
+    Cascade of `delete(async_cascade=True)`: rows referencing the marked
+    root are soft deleted in batches, each in its own transaction, then
+    the root and the rest of its cascade in one more transaction, all
+    with the root `deleted` time. Committed batches are kept if the task
+    fails, a retry continues with the remaining rows. The task id is the
+    idempotency key, finished cascades are not repeated.
+    """
+    key = _cascade_key(label, pk, deleted)
+    status = caches[getattr(settings, 'SOFT_DELETE_ASYNC_CACHE', 'default')].get(key)
+    if status and status['status'] == SUCCESS:
+        return status['result']
+
+    _set_status(key, STARTED)
+    model = apps.get_model(label)
+    time = parse_datetime(deleted)
+    try:
+        result = _cascade_in_batches(model, pk, using, time)
+        with transaction.atomic(using=using):
+            marked = model._base_manager.using(using).select_for_update(
+                ).filter(pk=pk, deleted=time)
+            instance = marked.first()
+            if instance is not None:
+                marked.update(deleted=None)
+                instance.deleted = None
+                result = _merge_results(result, _soft_delete(
+                    instance, using, keep_parents, time))
+            # otherwise restored or deleted again since enqueued
+    except IntegrityError:
+        # protected or restricted since enqueued, a retry can't succeed
+        _set_status(key, FAILURE)
+        raise
+    except DatabaseError as exc:
+        retries = self.request.retries
+        _set_status(key, RETRY if retries < self.max_retries else FAILURE)
+        raise self.retry(exc=exc, countdown=2 ** retries)
+    except Exception:
+        _set_status(key, FAILURE)
+        raise
+    _set_status(key, SUCCESS, result)
+    return result
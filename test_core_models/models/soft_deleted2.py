@@ -1,6 +1,7 @@
 from django.db import models
 
-from pik.core.models import SoftDeleted
+from pik.core.models import (
+    SoftDeleted, SoftDeletedArchive, soft_index, soft_unique_constraint)
 
 
 class BaseModel(models.Model):
@@ -54,3 +55,35 @@ class RelatedCousinArchiveModel(SoftDeleted):
     set_default_related = models.ForeignKey(
         RelatedArchiveModel,
         blank=True, null=True, on_delete=models.deletion.SET_DEFAULT)
+
+
+class ArchivableModel(SoftDeleted):
+    name = models.CharField(max_length=100, unique=True)
+
+    archive = SoftDeletedArchive()
+
+
+class ArchivableChildModel(SoftDeleted):
+    parent = models.ForeignKey(ArchivableModel, on_delete=models.CASCADE)
+
+    archive = SoftDeletedArchive()
+
+
+class IndexedSoftDeletedModel(SoftDeleted):
+    code = models.CharField(max_length=100)
+    base = models.ForeignKey(BaseArchiveModel, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            soft_unique_constraint('code', name='indexed_soft_deleted_code')]
+        indexes = [soft_index('base', name='indexed_soft_deleted_base')]
+
+
+class TreeSoftDeletedModel(SoftDeleted):
+    name = models.CharField(max_length=100)
+    parent = models.ForeignKey(
+        'self', blank=True, null=True, on_delete=models.CASCADE)
+
+
+class OneToOneSoftDeletedModel(SoftDeleted):
+    base = models.OneToOneField(BaseArchiveModel, on_delete=models.CASCADE)
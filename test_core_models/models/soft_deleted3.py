@@ -46,6 +46,16 @@ class MySoftDeletedModelWithFK(SoftDeleted, _BaseBasePHistoricalTestModel):
         MyNotSoftDeletedModel, on_delete=models.CASCADE)
 
 
+class MyDoubleNullableSoftDeletedModel(SoftDeleted,
+                                      _BaseBasePHistoricalTestModel):
+    first_fk = models.ForeignKey(
+        MySoftDeletedModelWithFK, on_delete=models.SET_NULL,
+        blank=True, null=True, related_name='+')
+    second_fk = models.ForeignKey(
+        MySoftDeletedModelWithFK, on_delete=models.SET_NULL,
+        blank=True, null=True, related_name='+')
+
+
 class TypeModel(models.Model):
     content_type = models.ForeignKey(
         ContentType, blank=True, null=True, on_delete=models.DO_NOTHING)
@@ -89,3 +99,8 @@ class ChildModel(models.Model):
 
 class ChildMySoftDeleteModel(ParentSoftDeleteModel, ChildModel):
     parent_model = InheritPrimaryUidField(ParentSoftDeleteModel)
+
+
+class MyProtectedSoftDeletedModel(SoftDeleted, _BaseBasePHistoricalTestModel):
+    related = models.ForeignKey(
+        MyRelatedSoftDeletedModel, on_delete=models.PROTECT)
@@ -0,0 +1,145 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.db import models as django_models
+from django.db.models.signals import post_init
+
+from pik.core.models._collector_delete import DeleteNotSoftDeletedModel  # noqa: protected access
+from pik.core.models._soft_delete_plan import (  # noqa: protected access
+    check_safe_mode, get_soft_delete_plan)
+from test_core_models import models
+
+
+def test_plan():
+    plan = get_soft_delete_plan(models.MySoftDeleteModel)
+
+    assert plan.is_soft
+    assert not plan.violates_safe_mode
+    assert {
+        (relation.related_model, relation.on_delete)
+        for relation in plan.relations
+        if relation.on_delete != django_models.DO_NOTHING} == {
+        (models.MyRelatedSoftDeletedModel, django_models.CASCADE),
+        (models.MyRelatedNullableSoftDeletedModel, django_models.SET_NULL),
+        (models.MyRelatedNotSoftDeletedModel, django_models.CASCADE)}
+    assert [violation.model for violation in plan.violations] == [
+        models.MyRelatedNotSoftDeletedModel]
+
+
+def test_plan_is_cached():
+    assert get_soft_delete_plan(models.MySoftDeleteModel) is (
+        get_soft_delete_plan(models.MySoftDeleteModel))
+
+
+def test_plan_follows_settings(settings):
+    settings.SOFT_DELETE_SAFE_MODE = True
+    assert get_soft_delete_plan(models.MyNotSoftDeletedModel).violates_safe_mode
+
+    settings.SOFT_DELETE_EXCLUDE = ['test_core_models.MyNotSoftDeletedModel']
+    plan = get_soft_delete_plan(models.MyNotSoftDeletedModel)
+    assert plan.is_excluded
+    assert not plan.violates_safe_mode
+
+
+def test_nested_violation_path():
+    plan = get_soft_delete_plan(models.BaseArchiveModel)
+
+    violations = {
+        violation.model: violation.path for violation in plan.violations}
+    assert violations[models.RelatedModel] == (
+        models.RelatedModel._meta.get_field('base'), )  # noqa: protected-access
+
+
+def test_check_safe_mode():
+    obj = models.MySoftDeleteModel.objects.create(name='test')
+    check_safe_mode(models.MySoftDeleteModel, [obj])
+
+    models.MyRelatedNotSoftDeletedModel.objects.create(
+        name='test', soft_deleted_fk=obj)
+    with pytest.raises(DeleteNotSoftDeletedModel):
+        check_safe_mode(models.MySoftDeleteModel, [obj])
+
+
+def test_delete_fails_before_collecting(settings):
+    settings.SOFT_DELETE_SAFE_MODE = True
+    obj = models.MySoftDeleteModel.objects.create(name='test')
+    models.MyRelatedNotSoftDeletedModel.objects.create(
+        name='test', soft_deleted_fk=obj)
+    loaded = []
+
+    def receiver(sender, **kwargs):
+        loaded.append(sender)
+
+    post_init.connect(receiver, sender=models.MyRelatedNotSoftDeletedModel)
+    try:
+        with pytest.raises(DeleteNotSoftDeletedModel):
+            obj.delete()
+    finally:
+        post_init.disconnect(receiver, sender=models.MyRelatedNotSoftDeletedModel)
+    assert not loaded
+
+
+def test_soft_delete_plan_command():
+    out = StringIO()
+    call_command(
+        'soft_delete_plan', 'test_core_models.MySoftDeleteModel', stdout=out)
+
+    output = out.getvalue()
+    assert 'test_core_models.MySoftDeleteModel: soft=True' in output
+    assert 'test_core_models.MyRelatedSoftDeletedModel.soft_deleted_fk: CASCADE' in output
+    assert 'violation: test_core_models.MyRelatedNotSoftDeletedModel' in output
+
+
+def test_delete_plan_counts_without_loading():
+    obj = models.MySoftDeleteModel.objects.create(name='test')
+    for i in range(3):
+        models.MyRelatedSoftDeletedModel.objects.create(
+            name=f'related {i}', soft_deleted_fk=obj)
+    models.MyRelatedSoftDeletedModel.objects.create(
+        name='deleted', soft_deleted_fk=obj).delete()
+    models.MyRelatedNullableSoftDeletedModel.objects.create(
+        soft_deleted_fk=obj)
+    loaded = []
+
+    def receiver(sender, **kwargs):
+        loaded.append(sender)
+
+    post_init.connect(receiver)
+    try:
+        estimate = obj.delete_plan()
+    finally:
+        post_init.disconnect(receiver)
+    assert not loaded
+    assert estimate.counts == {
+        'test_core_models.MySoftDeleteModel': 1,
+        'test_core_models.MyRelatedSoftDeletedModel': 3}
+    assert estimate.total == 4
+    assert estimate.field_updates == {
+        'test_core_models.MyRelatedNullableSoftDeletedModel'
+        '.soft_deleted_fk': 1}
+    assert estimate.hard_deleted == ()
+    assert estimate.violations == ()
+    assert obj.delete() == (4, estimate.counts)
+
+
+def test_delete_plan_violations(settings):
+    obj = models.MySoftDeleteModel.objects.create(name='test')
+    models.MyRelatedNotSoftDeletedModel.objects.create(
+        name='related', soft_deleted_fk=obj)
+
+    estimate = models.MySoftDeleteModel.objects.filter(
+        pk=obj.pk).delete_plan()
+
+    assert estimate.violations == (
+        'test_core_models.MyRelatedNotSoftDeletedModel', )
+    assert estimate.counts[
+        'test_core_models.MyRelatedNotSoftDeletedModel'] == 1
+
+    settings.SOFT_DELETE_SAFE_MODE = False
+    estimate = models.MySoftDeleteModel.objects.filter(
+        pk=obj.pk).delete_plan()
+
+    assert estimate.violations == ()
+    assert estimate.hard_deleted == (
+        'test_core_models.MyRelatedNotSoftDeletedModel', )
@@ -279,3 +279,31 @@ class TestCustomQSMethods(TestCase):
         self.assertEqual(MyPermanentModel.objects.update_restore_or_create(name="old").id, 1)
         self.assertEqual(MyPermanentModel.objects.count(), 1)
         self.assertEqual(MyPermanentModel.all_objects.count(), 1)
+
+
+class TestDeletedPredicate(TestCase):
+    predicate = '"test_core_models_mypermanentmodel"."deleted" IS NULL'
+
+    def test_objects_chain(self):
+        queryset = MyPermanentModel.objects.filter(name='a').exclude(
+            name='b').filter(id__gt=1).order_by('name')
+        self.assertEqual(str(queryset.query).count(self.predicate), 1)
+
+    def test_deleted_objects_chain(self):
+        queryset = MyPermanentModel.deleted_objects.filter(name='a').exclude(
+            name='b').order_by('name')
+        self.assertEqual(str(queryset.query).count(self.predicate), 1)
+        self.assertIn(f'NOT ({self.predicate})', str(queryset.query))
+
+    def test_all_objects_chain(self):
+        queryset = MyPermanentModel.all_objects.filter(name='a').exclude(
+            name='b')
+        self.assertNotIn(self.predicate, str(queryset.query))
+
+    def test_related_manager_chain(self):
+        permanent = MyPermanentModel.objects.create()
+        queryset = permanent.permanentdepended_set.filter(id__gt=0).exclude(
+            id=0)
+        self.assertEqual(
+            str(queryset.query).count(
+                '"test_core_models_permanentdepended"."deleted" IS NULL'), 1)
@@ -1,3 +1,17 @@
+from collections import Counter
+
+import pytest
+from django.db import connection
+from django.db.models.deletion import Collector
+from django.db.models.signals import post_init, post_save
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+
+from pik.core.models._collector_delete import DeleteNotSoftDeletedModel  # noqa: protected access
+from pik.core.models._soft_delete_cascade import (  # noqa: protected access
+    SUBQUERY_MAX_DEPTH, SubqueryCascade)
+from pik.core.models.signals import (
+    post_soft_delete_batch, pre_soft_delete_batch)
 from test_core_models import models
 
 
@@ -155,3 +169,367 @@ def test_cascade_set_default():
     assert 1 == models.RelatedCousinModel.objects.count()
 
     assert models.RelatedModel.objects.filter(pk=related.pk).exists()
+
+
+@pytest.fixture
+def subquery_cascade(settings):
+    settings.SOFT_DELETE_SUBQUERY_CASCADE = True
+    settings.SOFT_DELETE_SAFE_MODE = False
+
+
+@pytest.fixture
+def loaded_models():
+    loaded = Counter()
+
+    def receiver(sender, **kwargs):
+        loaded[sender] += 1
+
+    post_init.connect(receiver)
+    yield loaded
+    post_init.disconnect(receiver)
+
+
+def test_subquery_cascade_delete(subquery_cascade, loaded_models):
+    base = models.BaseArchiveModel.objects.create(name='test')
+    related = models.RelatedModel.objects.create(base=base)
+    models.RelatedCousinModel.objects.create(related=related)
+    related_archivable = models.RelatedArchiveModel.objects.create(base=base)
+    models.RelatedCousinArchiveModel.objects.create(
+        related=related_archivable)
+    loaded_models.clear()
+
+    count, counter = base.delete()
+
+    assert models.RelatedArchiveModel not in loaded_models
+    assert models.RelatedCousinArchiveModel not in loaded_models
+    assert base.deleted is not None
+    assert not models.RelatedModel.objects.exists()
+    assert not models.RelatedCousinModel.objects.exists()
+    assert not models.RelatedArchiveModel.objects.exists()
+    assert not models.RelatedCousinArchiveModel.objects.exists()
+    assert models.RelatedCousinArchiveModel.all_objects.get().deleted == (
+        base.deleted)
+    assert count == 5
+    assert counter['test_core_models.RelatedCousinArchiveModel'] == 1
+
+
+def test_subquery_cascade_delete_qs(subquery_cascade, loaded_models):
+    bases = [
+        models.BaseArchiveModel.objects.create(name='test')
+        for _ in range(3)]
+    for base in bases:
+        related = models.RelatedArchiveModel.objects.create(base=base)
+        models.RelatedCousinArchiveModel.objects.create(related=related)
+    already_deleted = models.RelatedArchiveModel.objects.create(
+        base=bases[0], deleted=now())
+    loaded_models.clear()
+
+    count, _ = models.BaseArchiveModel.objects.all().delete()
+
+    assert not loaded_models
+    assert count == 9
+    assert not models.BaseArchiveModel.objects.exists()
+    assert not models.RelatedArchiveModel.objects.exists()
+    assert not models.RelatedCousinArchiveModel.objects.exists()
+    assert models.RelatedArchiveModel.all_objects.get(
+        pk=already_deleted.pk).deleted == already_deleted.deleted
+
+
+def test_subquery_cascade_set_null(subquery_cascade):
+    base = models.BaseArchiveModel.objects.create(name='test')
+    related = models.RelatedModel.objects.create(
+        base=models.BaseArchiveModel.objects.create(name='test2'),
+        set_null_base=base, set_default_base=base)
+
+    base.delete()
+
+    related.refresh_from_db()
+    assert related.set_null_base is None
+    assert related.set_default_base is None
+
+
+def test_subquery_cascade_safe_mode(subquery_cascade, settings):
+    settings.SOFT_DELETE_SAFE_MODE = True
+    base = models.BaseArchiveModel.objects.create(name='test')
+    models.RelatedModel.objects.create(base=base)
+
+    with pytest.raises(DeleteNotSoftDeletedModel):
+        base.delete()
+
+
+def _create_tree(depth):
+    nodes = [models.TreeSoftDeletedModel.objects.create(name='root')]
+    for index in range(depth):
+        nodes.append(models.TreeSoftDeletedModel.objects.create(
+            name=str(index), parent=nodes[-1]))
+    return nodes
+
+
+def test_subquery_cascade_tree(subquery_cascade):
+    nodes = _create_tree(SUBQUERY_MAX_DEPTH * 2)
+    other = _create_tree(2)
+
+    count, counter = nodes[0].delete()
+
+    assert count == len(nodes)
+    assert counter == {
+        'test_core_models.TreeSoftDeletedModel': len(nodes)}
+    assert models.TreeSoftDeletedModel.objects.count() == len(other)
+
+
+def test_subquery_cascade_is_scoped_to_levels(subquery_cascade):
+    """
+    Rows deleted at the same time by another operation are not cascaded
+    """
+    time = now()
+    tombstone, live_child = _create_tree(1)
+    models.TreeSoftDeletedModel.all_objects.filter(
+        pk=tombstone.pk).update(deleted=time)
+    nodes = _create_tree(2)
+
+    with CaptureQueriesContext(connection) as context:
+        count, _ = SubqueryCascade('default', time=time).delete(
+            models.TreeSoftDeletedModel.objects.filter(pk=nodes[0].pk))
+
+    assert count == 3
+    assert models.TreeSoftDeletedModel.objects.get() == live_child
+    # levels are selected by the parent level, not by the time alone
+    table = models.TreeSoftDeletedModel._meta.db_table  # noqa: protected-access
+    assert all(
+        ' IN (' in query['sql'] for query in context.captured_queries
+        if query['sql'].startswith(f'UPDATE "{table}"'))
+
+
+def _create_bases(count):
+    bases = []
+    for _ in range(count):
+        base = models.BaseArchiveModel.objects.create(name='test')
+        models.RelatedArchiveModel.objects.create(base=base)
+        bases.append(base)
+    return bases
+
+
+def test_delete_in_batches():
+    bases = _create_bases(5)
+    progress = []
+
+    def callback(count, counter, last_pk):
+        progress.append((count, last_pk))
+
+    count, counter = models.BaseArchiveModel.objects.all().delete_in_batches(
+        batch_size=2, callback=callback)
+
+    assert count == 10
+    assert counter == {
+        'test_core_models.BaseArchiveModel': 5,
+        'test_core_models.RelatedArchiveModel': 5}
+    assert progress == [
+        (4, bases[1].pk), (8, bases[3].pk), (10, bases[4].pk)]
+    assert not models.BaseArchiveModel.objects.exists()
+    assert not models.RelatedArchiveModel.objects.exists()
+
+
+def test_delete_in_batches_resume():
+    _create_bases(5)
+
+    def interrupt(count, counter, last_pk):
+        raise KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        models.BaseArchiveModel.objects.filter(name='test').delete_in_batches(
+            batch_size=2, callback=interrupt)
+    assert models.BaseArchiveModel.objects.count() == 3
+
+    count, counter = models.BaseArchiveModel.objects.filter(
+        name='test').delete_in_batches(batch_size=2)
+
+    assert count == 6
+    assert counter['test_core_models.BaseArchiveModel'] == 3
+    assert not models.BaseArchiveModel.objects.exists()
+
+
+def test_delete_in_batches_sleep(mocker):
+    _create_bases(3)
+    sleep = mocker.patch('pik.core.models.soft_deleted.time.sleep')
+
+    models.BaseArchiveModel.objects.all().delete_in_batches(
+        batch_size=1, sleep=0.5)
+
+    assert sleep.call_count == 2
+    sleep.assert_called_with(0.5)
+
+
+def test_batch_field_updates_of_one_row(settings):
+    settings.SOFT_DELETE_BATCH_MODE = True
+    base = models.BaseArchiveModel.objects.create(name='test')
+    other = models.BaseArchiveModel.objects.create(name='other')
+    related = models.RelatedArchiveModel.objects.create(
+        base=other, set_null_base=base, set_default_base=base)
+
+    collector = Collector(using='default')
+    collector.collect([base])
+    collector.delete()
+
+    related.refresh_from_db()
+    assert related.set_null_base is None
+    assert related.set_default_base is None
+    assert collector.field_update_counter == {
+        'test_core_models.RelatedArchiveModel.set_null_base': 1,
+        'test_core_models.RelatedArchiveModel.set_default_base': 1}
+
+
+def test_fast_delete_is_one_update():
+    base = models.BaseArchiveModel.objects.create(name='test')
+    related = models.RelatedArchiveModel.objects.create(base=base)
+    cousins = [
+        models.RelatedCousinArchiveModel.objects.create(related=related)
+        for _ in range(3)]
+    deleted_cousin = models.RelatedCousinArchiveModel.objects.create(
+        related=related)
+    deleted_cousin.delete()
+
+    collector = Collector(using='default')
+    collector.collect([related])
+    assert collector.fast_deletes
+    with CaptureQueriesContext(connection) as context:
+        count, counter = collector.delete()
+    updates = [
+        query['sql'] for query in context.captured_queries
+        if 'UPDATE "test_core_models_relatedcousinarchivemodel"'
+        in query['sql']]
+
+    assert len(updates) == 1
+    assert count == 4
+    assert counter == {
+        'test_core_models.RelatedArchiveModel': 1,
+        'test_core_models.RelatedCousinArchiveModel': 3}
+    assert models.RelatedCousinArchiveModel.deleted_objects.filter(
+        pk__in=[cousin.pk for cousin in cousins],
+        deleted=related.deleted).count() == 3
+    deleted_at = deleted_cousin.deleted
+    deleted_cousin.refresh_from_db()
+    assert deleted_cousin.deleted == deleted_at
+
+
+@pytest.mark.parametrize('batch_mode, saved', [(False, 3), (True, 0)])
+def test_fast_delete_with_save_receiver(settings, batch_mode, saved):
+    settings.SOFT_DELETE_BATCH_MODE = batch_mode
+    related = models.RelatedArchiveModel.objects.create(
+        base=models.BaseArchiveModel.objects.create(name='test'))
+    for _ in range(3):
+        models.RelatedCousinArchiveModel.objects.create(related=related)
+    saved_pks = []
+
+    def receiver(instance, **kwargs):
+        saved_pks.append(instance.pk)
+
+    post_save.connect(receiver, sender=models.RelatedCousinArchiveModel)
+    try:
+        collector = Collector(using='default')
+        collector.collect([related])
+        assert collector.fast_deletes
+        count, _ = collector.delete()
+    finally:
+        post_save.disconnect(receiver, sender=models.RelatedCousinArchiveModel)
+
+    assert count == 4
+    assert len(saved_pks) == saved
+    assert not models.RelatedCousinArchiveModel.objects.exists()
+
+
+@pytest.mark.parametrize('subquery', [False, True])
+def test_queryset_restore_cascade(settings, subquery):
+    settings.SOFT_DELETE_SUBQUERY_CASCADE = subquery
+    bases = _create_bases(3)
+    for base in bases:
+        related = models.RelatedArchiveModel.objects.get(base=base)
+        models.RelatedCousinArchiveModel.objects.create(related=related)
+    bases[0].delete()
+    models.BaseArchiveModel.objects.filter(pk=bases[1].pk).delete()
+    bases[2].delete()
+
+    with CaptureQueriesContext(connection) as context:
+        count, counter = models.BaseArchiveModel.all_objects.filter(
+            pk__in=[bases[0].pk, bases[1].pk]).restore_cascade()
+
+    assert count == 6
+    assert counter == {
+        'test_core_models.BaseArchiveModel': 2,
+        'test_core_models.RelatedArchiveModel': 2,
+        'test_core_models.RelatedCousinArchiveModel': 2}
+    assert models.RelatedCousinArchiveModel.objects.filter(
+        related__base__in=bases[:2]).count() == 2
+    assert models.RelatedCousinArchiveModel.all_objects.filter(
+        related__base=bases[2], deleted__isnull=False).count() == 1
+    # no rows are loaded: one UPDATE per relation and delete operation
+    for model in (models.BaseArchiveModel, models.RelatedArchiveModel,
+                  models.RelatedCousinArchiveModel):
+        assert len([
+            query for query in context.captured_queries
+            if query['sql'].startswith(
+                f'UPDATE "{model._meta.db_table}"')]) == 2  # noqa: protected-access
+
+
+@pytest.fixture
+def batch_signals():
+    calls = []
+
+    def receiver(signal, sender, pk_list, deleted_at, using, **kwargs):
+        calls.append((signal, sender, sorted(pk_list), deleted_at, using))
+
+    for model in (models.BaseArchiveModel, models.RelatedArchiveModel):
+        pre_soft_delete_batch.connect(receiver, sender=model)
+        post_soft_delete_batch.connect(receiver, sender=model)
+    yield calls
+    for model in (models.BaseArchiveModel, models.RelatedArchiveModel):
+        pre_soft_delete_batch.disconnect(receiver, sender=model)
+        post_soft_delete_batch.disconnect(receiver, sender=model)
+
+
+@pytest.mark.parametrize('subquery', [False, True])
+def test_soft_delete_batch_signals(settings, batch_signals, subquery):
+    settings.SOFT_DELETE_SUBQUERY_CASCADE = subquery
+    bases = _create_bases(2)
+    related_pks = sorted(
+        models.RelatedArchiveModel.objects.values_list('pk', flat=True))
+
+    models.BaseArchiveModel.objects.all().delete()
+
+    deleted_at = models.BaseArchiveModel.deleted_objects.first().deleted
+    base_pks = sorted(base.pk for base in bases)
+    assert sorted(batch_signals, key=lambda call: (
+        call[0] is post_soft_delete_batch, call[1].__name__)) == [
+        (pre_soft_delete_batch, models.BaseArchiveModel, base_pks,
+         deleted_at, 'default'),
+        (pre_soft_delete_batch, models.RelatedArchiveModel, related_pks,
+         deleted_at, 'default'),
+        (post_soft_delete_batch, models.BaseArchiveModel, base_pks,
+         deleted_at, 'default'),
+        (post_soft_delete_batch, models.RelatedArchiveModel, related_pks,
+         deleted_at, 'default'),
+    ]
+
+
+def test_subquery_cascade_signals_once_per_model(subquery_cascade, settings):
+    settings.SOFT_DELETE_BATCH_SIZE = 2
+    calls = []
+
+    def receiver(signal, sender, pk_list, **kwargs):
+        calls.append((signal, sorted(pk_list)))
+
+    nodes = _create_tree(SUBQUERY_MAX_DEPTH * 2) + _create_tree(2)
+    pre_soft_delete_batch.connect(
+        receiver, sender=models.TreeSoftDeletedModel)
+    post_soft_delete_batch.connect(
+        receiver, sender=models.TreeSoftDeletedModel)
+    try:
+        models.TreeSoftDeletedModel.objects.all().delete()
+    finally:
+        pre_soft_delete_batch.disconnect(
+            receiver, sender=models.TreeSoftDeletedModel)
+        post_soft_delete_batch.disconnect(
+            receiver, sender=models.TreeSoftDeletedModel)
+
+    pk_list = sorted(node.pk for node in nodes)
+    assert calls == [
+        (pre_soft_delete_batch, pk_list), (post_soft_delete_batch, pk_list)]
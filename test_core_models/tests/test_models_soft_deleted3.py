@@ -1,9 +1,15 @@
 import pytest
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.models import Field
+from django.db.models.deletion import Collector
+from django.db.models.sql.where import WhereNode
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import now
 
-from pik.core.models._collector_delete import DeleteNotSoftDeletedModel  # noqa: protected access
+from pik.core.models._collector_delete import (  # noqa: protected access
+    DeleteNotSoftDeletedModel, _fast_soft_delete, _has_save_override)
 from test_core_models import models
 
 
@@ -229,3 +235,232 @@ def test_delete_child_soft_deleted():
     assert 0 == models.ParentSoftDeleteModel.objects.count()
     assert 1 == models.ChildMySoftDeleteModel.all_objects.count()
     assert 0 == models.ChildMySoftDeleteModel.objects.count()
+
+
+class TestBatchDelete:
+
+    model = models.MySoftDeleteModel
+    related_model = models.MyRelatedSoftDeletedModel
+
+    @pytest.fixture(autouse=True)
+    def batch_mode(self, settings):
+        settings.SOFT_DELETE_BATCH_MODE = True
+        settings.SOFT_DELETE_BATCH_SIZE = 2
+
+    def test_cascade_delete(self):
+        obj = self.model.objects.create(name='test')
+        related_objs = [
+            self.related_model.objects.create(
+                name=f'related {i}', soft_deleted_fk=obj)
+            for i in range(5)]
+        old_updated = related_objs[0].updated
+
+        with CaptureQueriesContext(connection) as context:
+            obj.delete()
+        updates = [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith('UPDATE')]
+
+        # one UPDATE for the root and one for each related pk chunk
+        assert len(updates) == 1 + 3
+        assert obj.deleted is not None
+        assert obj.version == 2
+        for related_obj in related_objs:
+            related_obj.refresh_from_db()
+            assert related_obj.deleted == obj.deleted
+            assert related_obj.version == 2
+            assert related_obj.updated > old_updated
+        assert self.related_model.objects.count() == 0
+
+    def test_bulk_history(self):
+        obj = self.model.objects.create(name='test')
+        self.related_model.objects.create(name='related', soft_deleted_fk=obj)
+
+        obj.delete()
+
+        assert obj.history.count() == 2
+        assert obj.history.first().history_type == '~'
+        assert obj.history.first().deleted == obj.deleted
+        related_history = self.related_model.history.filter(
+            soft_deleted_fk=obj)
+        assert related_history.count() == 2
+        assert related_history.first().history_type == '~'
+        assert related_history.first().version == 2
+
+    def test_queryset_delete(self):
+        objs = [self.model.objects.create(name=f'test {i}') for i in range(3)]
+
+        count, counter = self.model.objects.filter(
+            pk__in=[obj.pk for obj in objs]).delete()
+
+        assert count == 3
+        assert counter == {self.model._meta.label: 3}  # noqa: protected-access
+        assert self.model.deleted_objects.count() == 3
+
+    def test_field_updates(self):
+        obj = self.model.objects.create(name='test')
+        nullable_objs = [
+            models.MyRelatedNullableSoftDeletedModel.objects.create(
+                name=f'nullable {i}', soft_deleted_fk=obj)
+            for i in range(5)]
+
+        collector = Collector(using='default')
+        collector.collect([obj])
+        with CaptureQueriesContext(connection) as context:
+            collector.delete()
+        updates = [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith('UPDATE')]
+
+        # one UPDATE for each nullable pk chunk and one for the root
+        assert len(updates) == 3 + 1
+        assert collector.field_update_counter == {
+            'test_core_models.MyRelatedNullableSoftDeletedModel'
+            '.soft_deleted_fk': 5}
+        for nullable_obj in nullable_objs:
+            nullable_obj.refresh_from_db()
+            assert nullable_obj.soft_deleted_fk is None
+            assert nullable_obj.deleted is None
+            assert nullable_obj.version == 2
+            assert nullable_obj.history.count() == 2
+            assert nullable_obj.history.first().soft_deleted_fk is None
+
+    def test_field_updates_of_one_row(self):
+        obj = models.MySoftDeletedModelWithFK.objects.create(
+            not_soft_deleted_fk=models.MyNotSoftDeletedModel.objects.create())
+        nullable_obj = models.MyDoubleNullableSoftDeletedModel.objects.create(
+            first_fk=obj, second_fk=obj)
+
+        collector = Collector(using='default')
+        collector.collect([obj])
+        collector.delete()
+
+        version = nullable_obj.version
+        nullable_obj.refresh_from_db()
+        assert (nullable_obj.first_fk, nullable_obj.second_fk) == (None, None)
+        assert nullable_obj.version == version + 1
+        assert nullable_obj.history.first().version == nullable_obj.version
+        assert collector.field_update_counter == {
+            'test_core_models.MyDoubleNullableSoftDeletedModel.first_fk': 1,
+            'test_core_models.MyDoubleNullableSoftDeletedModel.second_fk': 1}
+
+    def test_field_updates_without_history(self, settings):
+        settings.SOFT_DELETE_BATCH_HISTORY = False
+        obj = self.model.objects.create(name='test')
+        nullable_obj = models.MyRelatedNullableSoftDeletedModel.objects.create(
+            name='nullable', soft_deleted_fk=obj)
+
+        obj.delete()
+
+        nullable_obj.refresh_from_db()
+        assert nullable_obj.soft_deleted_fk is None
+        assert nullable_obj.history.count() == 1
+        assert obj.history.count() == 1
+
+
+class TestFastSoftDelete:
+
+    model = models.MySoftDeleteModel
+
+    def test_history(self, settings):
+        settings.SOFT_DELETE_BATCH_SIZE = 2
+        objs = [self.model.objects.create(name=f'test {i}') for i in range(3)]
+        time = now()
+
+        count = _fast_soft_delete(self.model._base_manager.all(), time)
+
+        assert count == 3
+        for obj in objs:
+            assert obj.history.count() == 2
+            assert obj.history.first().deleted == time
+            assert obj.history.first().version == 2
+
+    def test_save_override(self):
+        assert not _has_save_override(self.model)
+        assert _has_save_override(models.ChildMySoftDeleteModel)
+
+    def test_without_history(self, settings):
+        settings.SOFT_DELETE_BATCH_HISTORY = False
+        obj = self.model.objects.create(name='test')
+
+        with CaptureQueriesContext(connection) as context:
+            count = _fast_soft_delete(self.model._base_manager.all(), now())
+
+        assert count == 1
+        assert len(context.captured_queries) == 1
+        assert obj.history.count() == 1
+
+
+class TestRestoreCascade:
+
+    model = models.MySoftDeleteModel
+    related_model = models.MyRelatedSoftDeletedModel
+
+    def test_restore_cascade(self):
+        obj = self.model.objects.create(name='test')
+        related_objs = [
+            self.related_model.objects.create(
+                name=f'related {i}', soft_deleted_fk=obj)
+            for i in range(3)]
+        deleted_before = self.related_model.objects.create(
+            name='deleted before', soft_deleted_fk=obj)
+        deleted_before.delete()
+        obj.delete()
+
+        count, counter = obj.restore_cascade()
+
+        assert count == 4
+        assert counter == {
+            self.model._meta.label: 1,  # noqa: protected-access
+            self.related_model._meta.label: 3}  # noqa: protected-access
+        assert obj.deleted is None
+        assert obj.version == 3
+        assert obj.history.first().deleted is None
+        for related_obj in related_objs:
+            related_obj.refresh_from_db()
+            assert related_obj.deleted is None
+            assert related_obj.history.count() == 3
+        deleted_before.refresh_from_db()
+        assert deleted_before.deleted is not None
+
+    def test_restore_cascade_of_restored_rows_only(self):
+        obj, other = [
+            self.model.objects.create(name=f'test {i}') for i in range(2)]
+        related_obj, other_related = [
+            self.related_model.objects.create(
+                name=f'related {i}', soft_deleted_fk=parent)
+            for i, parent in enumerate((obj, other))]
+        self.model.objects.filter(pk__in=[obj.pk, other.pk]).delete()
+        self.model.all_objects.filter(pk=other.pk).restore()
+        obj.refresh_from_db()
+
+        count, _ = obj.restore_cascade()
+
+        assert count == 2
+        related_obj.refresh_from_db()
+        assert related_obj.deleted is None
+        other_related.refresh_from_db()
+        assert other_related.deleted is not None
+
+    def test_not_deleted(self):
+        obj = self.model.objects.create(name='test')
+
+        assert obj.restore_cascade() == (0, {})
+
+
+def test_join_restriction_of_equal_fields(mocker):
+    """
+    Before Django 3.2 fields inherited from one abstract model are equal,
+    the cached restriction must not be shared by their models
+    """
+    soft_field = models.MyRelatedSoftDeletedModel._meta.get_field(
+        'soft_deleted_fk')
+    regular_field = models.MyRelatedNotSoftDeletedModel._meta.get_field(
+        'soft_deleted_fk')
+    mocker.patch.object(
+        Field, '__eq__', lambda self, other: self.name == other.name)
+    mocker.patch.object(Field, '__hash__', lambda self: hash(self.name))
+    assert soft_field == regular_field
+
+    assert soft_field.get_extra_restriction(WhereNode, 'a', 'b')
+    assert regular_field.get_extra_restriction(WhereNode, 'a', 'b') is None
@@ -0,0 +1,121 @@
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, models as django_models
+
+from pik.core.models import SoftDeletedArchive
+from pik.core.soft_deleted.tasks import purge_soft_deleted
+from test_core_models import models
+
+LABELS = [
+    'test_core_models.ArchivableModel',
+    'test_core_models.ArchivableChildModel',
+]
+
+
+@pytest.fixture
+def archive_now(settings):
+    settings.SOFT_DELETE_PURGE_KEEP_DAYS = 0
+
+
+@pytest.fixture
+def archived(archive_now):
+    parent = models.ArchivableModel.objects.create(name='parent')
+    children = [
+        models.ArchivableChildModel.objects.create(parent=parent)
+        for _ in range(2)]
+    parent.delete()
+    purge_soft_deleted(LABELS)
+    return parent, children
+
+
+def test_archive_model():
+    archive_model = models.ArchivableChildModel.archive.model
+
+    assert archive_model.__name__ == 'ArchivedArchivableChildModel'
+    assert archive_model._meta.db_table == (  # noqa: protected-access
+        'test_core_models_archivablechildmodel_archive')
+    parent_field = archive_model._meta.get_field('parent')  # noqa: protected-access
+    assert not parent_field.db_constraint
+    assert parent_field.remote_field.on_delete == django_models.DO_NOTHING
+    assert not models.ArchivableModel.archive.model._meta.get_field(  # noqa: protected-access
+        'name').unique
+
+
+def test_purge_moves_rows_to_archive(archived):
+    parent, children = archived
+
+    assert not models.ArchivableModel.all_objects.exists()
+    assert not models.ArchivableChildModel.all_objects.exists()
+    assert models.ArchivableModel.archive.get().deleted == parent.deleted
+    assert set(models.ArchivableChildModel.archive.values_list(
+        'pk', flat=True)) == {child.pk for child in children}
+
+
+def test_live_rows_are_not_archived(archive_now):
+    models.ArchivableModel.objects.create(name='live')
+
+    assert purge_soft_deleted(LABELS) == {
+        'test_core_models.ArchivableChildModel': 0,
+        'test_core_models.ArchivableModel': 0}
+    assert not models.ArchivableModel.archive.exists()
+
+
+def test_with_archive(archived):
+    parent, _ = archived
+    models.ArchivableModel.objects.create(name='recent').delete()
+    models.ArchivableModel.objects.create(name='live')
+
+    deleted = list(models.ArchivableModel.deleted_objects.with_archive(
+        ).order_by('name'))
+    all_objects = list(models.ArchivableModel.all_objects.with_archive(
+        name__in=['parent', 'live']).order_by('name'))
+
+    assert [obj.name for obj in deleted] == ['parent', 'recent']
+    assert isinstance(deleted[0], models.ArchivableModel)
+    assert deleted[0].deleted == parent.deleted
+    assert [obj.name for obj in all_objects] == ['live', 'parent']
+
+
+def test_archive_restore(archived):
+    parent, children = archived
+
+    assert models.ArchivableModel.archive.all().restore() == 1
+    assert models.ArchivableChildModel.archive.all().restore() == 2
+
+    assert models.ArchivableModel.objects.get().pk == parent.pk
+    assert models.ArchivableChildModel.objects.count() == 2
+    assert not models.ArchivableModel.archive.exists()
+    assert not models.ArchivableChildModel.archive.exists()
+
+
+def test_instance_restore(archived):
+    parent, _ = archived
+    obj = models.ArchivableModel.deleted_objects.with_archive(
+        name='parent')[0]
+
+    obj.restore()
+
+    assert models.ArchivableModel.objects.get().pk == parent.pk
+    assert not models.ArchivableModel.archive.exists()
+
+
+def test_instance_restore_is_atomic(archived, mocker):
+    obj = models.ArchivableModel.deleted_objects.with_archive(
+        name='parent')[0]
+    mocker.patch.object(
+        django_models.QuerySet, '_raw_delete', side_effect=DatabaseError)
+
+    with pytest.raises(DatabaseError):
+        obj.restore()
+
+    assert not models.ArchivableModel.all_objects.exists()
+    assert models.ArchivableModel.archive.exists()
+
+
+def test_not_soft_deleted_model():
+    with pytest.raises(ImproperlyConfigured):
+        class NotSoftDeletedArchivable(django_models.Model):  # noqa: unused-variable
+            archive = SoftDeletedArchive()
+
+            class Meta:
+                app_label = 'test_core_models'
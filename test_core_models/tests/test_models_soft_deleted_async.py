@@ -0,0 +1,191 @@
+import pytest
+from django.db import OperationalError
+from django.db.models import ProtectedError
+
+from pik.core.models._collector_delete import DeleteNotSoftDeletedModel  # noqa: protected access
+
+from pik.core.soft_deleted import tasks
+from pik.core.soft_deleted.tasks import get_soft_delete_status
+from test_core_models import models
+
+
+@pytest.fixture(autouse=True)
+def locmem_cache(settings):
+    settings.CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@pytest.fixture
+def run_task(mocker):
+    def apply_async(args, task_id):
+        return tasks.soft_delete_cascade.apply(args=args, task_id=task_id)
+    return mocker.patch.object(
+        tasks.soft_delete_cascade, 'apply_async', side_effect=apply_async)
+
+
+@pytest.fixture
+def tree():
+    obj = models.MySoftDeleteModel.objects.create(name='test')
+    related_objs = [
+        models.MyRelatedSoftDeletedModel.objects.create(
+            name=f'related {i}', soft_deleted_fk=obj)
+        for i in range(2)]
+    return obj, related_objs
+
+
+def test_root_is_hidden_before_cascade(tree, mocker,
+                                       django_capture_on_commit_callbacks):
+    obj, _ = tree
+    apply_async = mocker.patch.object(
+        tasks.soft_delete_cascade, 'apply_async')
+
+    with django_capture_on_commit_callbacks() as callbacks:
+        assert obj.delete(async_cascade=True) == (
+            1, {'test_core_models.MySoftDeleteModel': 1})
+
+    assert not models.MySoftDeleteModel.objects.exists()
+    assert models.MyRelatedSoftDeletedModel.objects.count() == 2
+    # nothing is enqueued until commit
+    assert get_soft_delete_status(obj) is None
+    assert len(callbacks) == 1
+    apply_async.assert_not_called()
+
+    callbacks[0]()
+
+    assert get_soft_delete_status(obj) == {
+        'status': tasks.PENDING, 'result': None}
+    apply_async.assert_called_once()
+
+
+def test_protected_root_is_not_hidden(tree, run_task,
+                                      django_capture_on_commit_callbacks):
+    obj, related_objs = tree
+    models.MyProtectedSoftDeletedModel.objects.create(related=related_objs[0])
+
+    with django_capture_on_commit_callbacks() as callbacks:
+        with pytest.raises(ProtectedError):
+            obj.delete(async_cascade=True)
+
+    assert not callbacks
+    assert models.MySoftDeleteModel.objects.filter(pk=obj.pk).exists()
+    assert get_soft_delete_status(obj) is None
+
+
+def test_safe_mode_root_is_not_hidden(tree, run_task,
+                                      django_capture_on_commit_callbacks):
+    obj, _ = tree
+    models.MyRelatedNotSoftDeletedModel.objects.create(soft_deleted_fk=obj)
+
+    with django_capture_on_commit_callbacks() as callbacks:
+        with pytest.raises(DeleteNotSoftDeletedModel):
+            obj.delete(async_cascade=True)
+
+    assert not callbacks
+    assert models.MySoftDeleteModel.objects.filter(pk=obj.pk).exists()
+
+
+def test_protected_since_enqueued_is_not_retried(
+        tree, mocker, django_capture_on_commit_callbacks):
+    obj, related_objs = tree
+    apply_async = mocker.patch.object(
+        tasks.soft_delete_cascade, 'apply_async')
+    with django_capture_on_commit_callbacks(execute=True):
+        obj.delete(async_cascade=True)
+    models.MyProtectedSoftDeletedModel.objects.create(related=related_objs[0])
+    retry = mocker.patch.object(tasks.soft_delete_cascade, 'retry')
+
+    with pytest.raises(ProtectedError):
+        tasks.soft_delete_cascade.run(*apply_async.call_args.kwargs['args'])
+
+    retry.assert_not_called()
+    assert get_soft_delete_status(obj)['status'] == tasks.FAILURE
+
+
+def test_cascade(tree, run_task, django_capture_on_commit_callbacks):
+    obj, related_objs = tree
+
+    with django_capture_on_commit_callbacks(execute=True):
+        obj.delete(async_cascade=True)
+
+    run_task.assert_called_once()
+    assert get_soft_delete_status(obj) == {
+        'status': tasks.SUCCESS,
+        'result': (3, {
+            'test_core_models.MySoftDeleteModel': 1,
+            'test_core_models.MyRelatedSoftDeletedModel': 2})}
+    obj.refresh_from_db()
+    assert obj.version == 2
+    assert obj.history.count() == 2
+    for related_obj in related_objs:
+        related_obj.refresh_from_db()
+        # one operation: the cascade keeps the root mark
+        assert related_obj.deleted == obj.deleted
+    assert obj.restore_cascade()[0] == 3
+
+
+def test_cascade_in_batches(tree, run_task, mocker, settings,
+                           django_capture_on_commit_callbacks):
+    obj, related_objs = tree
+    settings.SOFT_DELETE_BATCH_SIZE = 1
+    soft_delete_queryset = mocker.spy(tasks, '_soft_delete_queryset')
+
+    with django_capture_on_commit_callbacks(execute=True):
+        obj.delete(async_cascade=True)
+
+    assert [list(call.args[0].values_list('pk', flat=True))
+            for call in soft_delete_queryset.call_args_list] == [
+        [pk] for pk in sorted(related_obj.pk for related_obj in related_objs)]
+    assert get_soft_delete_status(obj)['result'] == (3, {
+        'test_core_models.MySoftDeleteModel': 1,
+        'test_core_models.MyRelatedSoftDeletedModel': 2})
+    assert obj.restore_cascade()[0] == 3
+
+
+def test_cascade_is_idempotent(tree, run_task,
+                               django_capture_on_commit_callbacks):
+    obj, _ = tree
+    with django_capture_on_commit_callbacks(execute=True):
+        obj.delete(async_cascade=True)
+    args = run_task.call_args.kwargs['args']
+
+    result = tasks.soft_delete_cascade.apply(args=args).get()
+
+    assert result == get_soft_delete_status(obj)['result']
+    obj.refresh_from_db()
+    assert obj.version == 2
+
+
+def test_restored_before_cascade(tree, run_task,
+                                 django_capture_on_commit_callbacks):
+    obj, _ = tree
+    with django_capture_on_commit_callbacks() as callbacks:
+        obj.delete(async_cascade=True)
+    deleted = obj.deleted
+    obj.restore()
+    obj.deleted = deleted
+
+    callbacks[0]()
+
+    assert get_soft_delete_status(obj)['result'] == (0, {})
+    assert models.MyRelatedSoftDeletedModel.objects.count() == 2
+
+
+def test_retry_status(tree, mocker, django_capture_on_commit_callbacks):
+    obj, _ = tree
+    apply_async = mocker.patch.object(
+        tasks.soft_delete_cascade, 'apply_async')
+    with django_capture_on_commit_callbacks(execute=True):
+        obj.delete(async_cascade=True)
+    mocker.patch.object(
+        tasks, '_soft_delete', side_effect=OperationalError('locked'))
+    retry = mocker.patch.object(
+        tasks.soft_delete_cascade, 'retry', side_effect=RuntimeError)
+
+    with pytest.raises(RuntimeError):
+        tasks.soft_delete_cascade.run(*apply_async.call_args.kwargs['args'])
+
+    retry.assert_called_once()
+    assert get_soft_delete_status(obj)['status'] == tasks.RETRY
+    assert models.MySoftDeleteModel.deleted_objects.filter(pk=obj.pk).exists()
+    # committed batches are kept, the retry continues with the root
+    assert not models.MyRelatedSoftDeletedModel.objects.exists()
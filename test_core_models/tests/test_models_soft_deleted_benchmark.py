@@ -0,0 +1,39 @@
+from test_core_models import models
+
+
+def _compile(queryset):
+    return queryset.query.sql_with_params()
+
+
+def test_join_heavy_queryset_compile(benchmark):
+    queryset = models.RelatedCousinArchiveModel.objects.select_related(
+        'related__base', 'related__set_null_base',
+        'set_null_related__base', 'set_default_related__set_default_base',
+    ).filter(
+        related__base__name='test',
+        related__relatedcousinarchivemodel__set_null_related__isnull=True)
+
+    sql, _ = benchmark(_compile, queryset)
+
+    assert sql.count('JOIN') == 8
+
+
+def test_not_soft_deleted_queryset_compile(benchmark):
+    queryset = models.RelatedCousinModel.objects.select_related(
+        'related__base', 'set_null_related__set_null_base').filter(
+        related__base__name='test')
+
+    sql, _ = benchmark(_compile, queryset)
+
+    assert 'JOIN' in sql
+
+
+def _build_queryset():
+    return models.MyPermanentModel.objects.filter(name='a').exclude(
+        name='b').filter(id__gt=1).order_by('name')
+
+
+def test_soft_deleted_queryset_construction(benchmark):
+    queryset = benchmark(_build_queryset)
+
+    assert str(queryset.query).count('"deleted" IS NULL') == 1
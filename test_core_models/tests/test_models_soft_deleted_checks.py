@@ -0,0 +1,57 @@
+import pytest
+from django.apps import apps
+from django.db import IntegrityError, transaction
+
+from pik.core.soft_deleted.checks import check_soft_deleted_indexes
+from test_core_models import models
+
+
+@pytest.fixture
+def warnings():
+    return check_soft_deleted_indexes(
+        app_configs=[apps.get_app_config('test_core_models')])
+
+
+def _ids(warnings, model):
+    return [warning.id for warning in warnings if warning.obj is model]
+
+
+def test_soft_unique_constraint():
+    base = models.BaseArchiveModel.objects.create()
+    models.IndexedSoftDeletedModel.objects.create(code='1', base=base).delete()
+    models.IndexedSoftDeletedModel.objects.create(code='1', base=base)
+
+    with pytest.raises(IntegrityError), transaction.atomic():
+        models.IndexedSoftDeletedModel.objects.create(code='1', base=base)
+
+
+def test_soft_index():
+    index, = models.IndexedSoftDeletedModel._meta.indexes  # noqa: protected-access
+
+    assert index.fields == ['base']
+    assert index.condition.children == [('deleted', None)]
+
+
+def test_check_indexed_model(warnings):
+    assert _ids(warnings, models.IndexedSoftDeletedModel) == []
+
+
+def test_check_foreign_key_without_index(warnings):
+    warning, = [
+        warning for warning in warnings
+        if warning.obj is models.RelatedArchiveModel]
+
+    assert warning.id == 'soft_deleted.W002'
+    assert 'base, set_null_base, set_default_base' in warning.msg
+
+
+def test_check_one_to_one_field(warnings):
+    assert _ids(warnings, models.OneToOneSoftDeletedModel) == []
+
+
+def test_check_unique_field(warnings):
+    assert _ids(warnings, models.ArchivableModel) == ['soft_deleted.W001']
+
+
+def test_check_not_soft_deleted_models(warnings):
+    assert _ids(warnings, models.RelatedModel) == []
@@ -0,0 +1,91 @@
+from datetime import timedelta
+from io import StringIO
+
+import pytest
+from django.core.management import CommandError, call_command
+from django.utils.timezone import now
+
+from pik.core.soft_deleted.tasks import purge_soft_deleted
+from test_core_models import models
+
+
+def _delete(obj, days_ago):
+    obj.delete()
+    for model in (models.BaseArchiveModel, models.RelatedArchiveModel,
+                  models.RelatedCousinArchiveModel):
+        model.all_objects.filter(deleted=obj.deleted).update(
+            deleted=now() - timedelta(days=days_ago))
+
+
+@pytest.fixture
+def tree():
+    old_base = models.BaseArchiveModel.objects.create(name='old')
+    models.RelatedCousinArchiveModel.objects.create(
+        related=models.RelatedArchiveModel.objects.create(base=old_base))
+    _delete(old_base, days_ago=400)
+    recent_base = models.BaseArchiveModel.objects.create(name='recent')
+    models.RelatedArchiveModel.objects.create(base=recent_base)
+    _delete(recent_base, days_ago=10)
+    live_base = models.BaseArchiveModel.objects.create(name='live')
+    return old_base, recent_base, live_base
+
+
+LABELS = [
+    'test_core_models.BaseArchiveModel',
+    'test_core_models.RelatedArchiveModel',
+    'test_core_models.RelatedCousinArchiveModel',
+]
+
+
+def test_purge(tree):
+    old_base, recent_base, live_base = tree
+
+    counter = purge_soft_deleted(LABELS, chunk_size=1)
+
+    assert counter == {
+        'test_core_models.RelatedCousinArchiveModel': 1,
+        'test_core_models.RelatedArchiveModel': 1,
+        'test_core_models.BaseArchiveModel': 1}
+    assert not models.BaseArchiveModel.all_objects.filter(
+        pk=old_base.pk).exists()
+    assert set(models.BaseArchiveModel.all_objects.values_list(
+        'pk', flat=True)) == {recent_base.pk, live_base.pk}
+    assert models.RelatedArchiveModel.all_objects.get().base == recent_base
+
+
+def test_purge_keeps_referenced_rows(tree, settings):
+    settings.SOFT_DELETE_PURGE_MODELS_KEEP_DAYS = {
+        'test_core_models.RelatedCousinArchiveModel': None}
+
+    counter = purge_soft_deleted(LABELS)
+
+    # the cousin keeps its related row which keeps the base row
+    assert counter == {
+        'test_core_models.RelatedArchiveModel': 0,
+        'test_core_models.BaseArchiveModel': 0}
+    assert models.BaseArchiveModel.all_objects.count() == 3
+
+
+def test_purge_retention(tree, settings):
+    settings.SOFT_DELETE_PURGE_KEEP_DAYS = 5
+
+    counter = purge_soft_deleted(LABELS)
+
+    assert sum(counter.values()) == 5
+    assert models.BaseArchiveModel.all_objects.count() == 1
+
+
+def test_purge_command_dry_run(tree):
+    out = StringIO()
+    call_command('purge_soft_deleted', *LABELS, '--dry-run', stdout=out)
+
+    output = out.getvalue()
+    assert 'test_core_models.RelatedCousinArchiveModel: 1 would be purged' in output
+    # referenced rows are counted as kept
+    assert 'test_core_models.BaseArchiveModel: 0 would be purged' in output
+    assert models.BaseArchiveModel.all_objects.count() == 3
+
+
+def test_purge_command_not_soft_deleted():
+    with pytest.raises(CommandError):
+        call_command('purge_soft_deleted', 'test_core_models.BaseModel')
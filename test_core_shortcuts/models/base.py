@@ -1,6 +1,6 @@
 from django.db import models
 
-from pik.core.models import BasePHistorical
+from pik.core.models import BasePHistorical, SoftDeleted
 
 
 class TestNameModel(BasePHistorical):
@@ -12,6 +12,20 @@ class MySimpleModel(BasePHistorical):
     names = models.ManyToManyField(TestNameModel, blank=True)
 
 
+class MyRelatedModel(BasePHistorical):
+    name = models.ForeignKey(TestNameModel, on_delete=models.CASCADE)
+    code = models.CharField(max_length=255)
+    data = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = ('name', 'code')
+
+
+class MySoftDeletedModel(SoftDeleted, BasePHistorical):
+    code = models.CharField(max_length=255, unique=True)
+    data = models.CharField(max_length=255)
+
+
 class MyModelQuerySet(models.QuerySet):
     pass
 
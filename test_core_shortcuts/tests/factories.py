@@ -2,7 +2,7 @@ import factory
 from django.utils.crypto import get_random_string
 
 from test_core_shortcuts.models import OverriddenQuerysetModel
-from ..models import MySimpleModel, TestNameModel
+from ..models import MySimpleModel, MyRelatedModel, TestNameModel
 
 
 class MySimpleModelFactory(factory.django.DjangoModelFactory):
@@ -34,3 +34,12 @@ class OverriddenQuerysetModelFactory(factory.django.DjangoModelFactory):
 
     class Meta:
         model = OverriddenQuerysetModel
+
+
+class MyRelatedModelFactory(factory.django.DjangoModelFactory):
+    name = factory.SubFactory(TestNameModelFactory)
+    code = factory.LazyFunction(get_random_string)
+    data = factory.LazyFunction(get_random_string)
+
+    class Meta:
+        model = MyRelatedModel
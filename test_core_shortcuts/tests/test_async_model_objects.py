@@ -0,0 +1,81 @@
+import pytest
+from asgiref.sync import async_to_sync
+from django.test import RequestFactory
+from simple_history.models import HistoricalRecords
+
+from pik.core.shortcuts import (
+    abulk_update_or_create_objects, aget_object_or_none,
+    aupdate_or_create_object, avalidate_and_create_object,
+    avalidate_and_update_object, enable_identity_map)
+from .factories import MySimpleModelFactory
+from ..models import MySimpleModel
+
+
+def test_aget_object_or_none():
+    obj = MySimpleModelFactory.create()
+
+    assert async_to_sync(aget_object_or_none)(
+        MySimpleModel, uid=obj.uid) == obj
+    assert async_to_sync(aget_object_or_none)(
+        MySimpleModel.objects.all(), data='missing') is None
+
+
+def test_aget_object_or_none_identity_map(django_assert_num_queries):
+    obj = MySimpleModelFactory.create()
+    HistoricalRecords.thread.request = RequestFactory().get('/')
+    try:
+        identity_map = enable_identity_map()
+
+        async def get_twice():
+            first = await aget_object_or_none(MySimpleModel, uid=obj.uid)
+            return first, await aget_object_or_none(
+                MySimpleModel, uid=obj.uid)
+
+        with django_assert_num_queries(1):
+            first, second = async_to_sync(get_twice)()
+    finally:
+        del HistoricalRecords.thread.request
+
+    assert first is second
+    assert (identity_map.hits, identity_map.misses) == (1, 1)
+
+
+def test_avalidate_and_create_object():
+    obj = async_to_sync(avalidate_and_create_object)(
+        MySimpleModel, data='data')
+
+    assert MySimpleModel.objects.get(pk=obj.pk).data == 'data'
+    with pytest.raises(ValueError):
+        async_to_sync(avalidate_and_create_object)(
+            MySimpleModel, data='x' * 256)
+
+
+def test_avalidate_and_update_object(django_assert_num_queries):
+    obj = MySimpleModelFactory.create()
+
+    with django_assert_num_queries(0):
+        assert async_to_sync(avalidate_and_update_object)(
+            obj, data=obj.data) == (obj, [])
+
+    _, updated_keys = async_to_sync(avalidate_and_update_object)(
+        obj, data='new')
+    assert updated_keys == ['data']
+    assert MySimpleModel.objects.get(pk=obj.pk).data == 'new'
+
+
+def test_aupdate_or_create_object():
+    obj, updated_keys, is_created = async_to_sync(aupdate_or_create_object)(
+        MySimpleModel, search_keys={'data': 'old'}, data='old')
+    assert (updated_keys, is_created) == ([], True)
+
+    same, updated_keys, is_created = async_to_sync(aupdate_or_create_object)(
+        MySimpleModel, search_keys={'data': 'old'}, data='new')
+    assert (same.pk, updated_keys, is_created) == (obj.pk, ['data'], False)
+
+
+def test_abulk_update_or_create_objects():
+    results = async_to_sync(abulk_update_or_create_objects)(
+        MySimpleModel, [({'data': 'a'}, {'data': 'a'}), (None, {'data': 'b'})])
+
+    assert [is_created for _, _, is_created in results] == [True, True]
+    assert MySimpleModel.objects.count() == 2
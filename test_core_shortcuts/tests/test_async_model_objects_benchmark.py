@@ -0,0 +1,82 @@
+import asyncio
+from itertools import count
+
+import pytest
+from asgiref.sync import async_to_sync, sync_to_async
+from django.test import RequestFactory
+from simple_history.models import HistoricalRecords
+
+from pik.core.shortcuts import (
+    aget_object_or_none, avalidate_and_update_object, enable_identity_map,
+    get_object_or_none, validate_and_update_object)
+from .factories import MySimpleModelFactory
+from ..models import MySimpleModel
+
+CONCURRENCY = 100
+
+
+@pytest.fixture(params=[True, False], ids=['identity_map', 'no_map'])
+def objs(request):
+    HistoricalRecords.thread.request = RequestFactory().get('/')
+    if request.param:
+        enable_identity_map()
+    yield MySimpleModelFactory.create_batch(10)
+    del HistoricalRecords.thread.request
+
+
+def _gather(function, *args_list):
+    async def run():
+        return await asyncio.gather(*(
+            function(*args) for args in args_list))
+    return async_to_sync(run)()
+
+
+async def _naive_get(model, uid):
+    return await sync_to_async(get_object_or_none)(model, uid=uid)
+
+
+async def _native_get(model, uid):
+    return await aget_object_or_none(model, uid=uid)
+
+
+@pytest.mark.parametrize('function', [_naive_get, _native_get])
+def test_get_object_or_none_concurrent(benchmark, objs, function):
+    uids = [obj.uid for obj in objs] * (CONCURRENCY // len(objs))
+
+    found = benchmark(_gather, function, *[
+        (MySimpleModel, uid) for uid in uids])
+
+    assert [obj.uid for obj in found] == uids
+
+
+async def _naive_update(obj, data):
+    return await sync_to_async(validate_and_update_object)(obj, data=data)
+
+
+async def _native_update(obj, data):
+    return await avalidate_and_update_object(obj, data=data)
+
+
+@pytest.mark.parametrize('function', [_naive_update, _native_update])
+def test_validate_and_update_unchanged_concurrent(benchmark, objs, function):
+    args = [(obj, obj.data) for obj in objs] * (CONCURRENCY // len(objs))
+
+    results = benchmark(_gather, function, *args)
+
+    assert all(updated_keys == [] for _, updated_keys in results)
+
+
+@pytest.mark.parametrize('function', [_naive_update, _native_update])
+def test_validate_and_update_changed_concurrent(benchmark, objs, function):
+    rounds = count()
+
+    def setup():
+        data = f'round {next(rounds)}'
+        args = [(obj, data) for obj in objs] * (CONCURRENCY // len(objs))
+        return (function, *args), {}
+
+    results = benchmark.pedantic(_gather, setup=setup, rounds=5)
+
+    # the first coroutine of every object updates it, the rest find it equal
+    assert sum(updated_keys == ['data'] for _, updated_keys in results) \
+        == len(objs)
@@ -0,0 +1,122 @@
+import pytest
+from django.test import RequestFactory
+from simple_history.models import HistoricalRecords
+
+from pik.core.models._soft_delete_cascade import can_subquery_cascade  # noqa: protected access
+from pik.core.models.signals import has_soft_delete_batch_receivers
+from pik.core.shortcuts import (
+    bulk_update_or_create_objects, enable_identity_map, get_identity_map,
+    get_object_or_none)
+from .factories import MySimpleModelFactory
+from ..models import MySimpleModel, MySoftDeletedModel
+
+
+@pytest.fixture
+def current_request():
+    request = RequestFactory().get('/')
+    HistoricalRecords.thread.request = request
+    yield request
+    del HistoricalRecords.thread.request
+
+
+def test_identity_map_disabled(current_request, django_assert_num_queries):
+    obj = MySimpleModelFactory.create()
+
+    with django_assert_num_queries(2):
+        get_object_or_none(MySimpleModel, uid=obj.uid)
+        get_object_or_none(MySimpleModel, uid=obj.uid)
+    assert get_identity_map() is None
+
+
+def test_identity_map(current_request, django_assert_num_queries):
+    obj = MySimpleModelFactory.create()
+    identity_map = enable_identity_map()
+
+    with django_assert_num_queries(2):
+        found = get_object_or_none(MySimpleModel, uid=obj.uid)
+        assert get_object_or_none(MySimpleModel, uid=obj.uid) is found
+        assert get_object_or_none(MySimpleModel.objects, uid=obj.uid) \
+            is found
+        assert get_object_or_none(MySimpleModel, data='missing') is None
+        assert get_object_or_none(MySimpleModel, data='missing') is None
+
+    assert (identity_map.hits, identity_map.misses) == (3, 2)
+    assert get_identity_map(current_request) is identity_map
+
+
+def test_identity_map_invalidation(current_request, django_assert_num_queries):
+    obj = MySimpleModelFactory.create()
+    enable_identity_map()
+    get_object_or_none(MySimpleModel, data='new')
+    found = get_object_or_none(MySimpleModel, uid=obj.uid)
+
+    created = MySimpleModelFactory.create(data='new')
+    with django_assert_num_queries(2):
+        assert get_object_or_none(MySimpleModel, data='new') == created
+        assert get_object_or_none(MySimpleModel, uid=obj.uid) is not found
+
+
+def test_identity_map_soft_delete(current_request):
+    obj = MySoftDeletedModel.objects.create(code='code')
+    other = MySoftDeletedModel.objects.create(code='other')
+    enable_identity_map()
+    assert get_object_or_none(MySoftDeletedModel, code='code') == obj
+    assert get_object_or_none(MySoftDeletedModel, code='other') == other
+
+    MySoftDeletedModel.objects.filter(pk=obj.pk).delete()
+    assert get_object_or_none(MySoftDeletedModel, code='code') is None
+    assert get_object_or_none(
+        MySoftDeletedModel.all_objects, code='code') == obj
+
+    other.delete()
+    assert get_object_or_none(MySoftDeletedModel, code='other') is None
+
+
+def test_identity_map_subquery_cascade(current_request, settings,
+                                      django_assert_num_queries):
+    settings.SOFT_DELETE_SUBQUERY_CASCADE = True
+    obj = MySoftDeletedModel.objects.create(code='code')
+    enable_identity_map()
+    assert get_object_or_none(MySoftDeletedModel, code='code') == obj
+
+    # the receiver doesn't turn off set-based deletes
+    assert can_subquery_cascade(MySoftDeletedModel)
+    assert not has_soft_delete_batch_receivers(MySoftDeletedModel)
+    # select pks, update, history select and insert, no row is saved
+    with django_assert_num_queries(4):
+        MySoftDeletedModel.objects.filter(pk=obj.pk).delete()
+
+    assert get_object_or_none(MySoftDeletedModel, code='code') is None
+
+
+def test_identity_map_bulk_write(current_request):
+    obj = MySimpleModelFactory.create()
+    enable_identity_map()
+    assert get_object_or_none(MySimpleModel, uid=obj.uid).data == obj.data
+
+    bulk_update_or_create_objects(
+        MySimpleModel, [(dict(uid=obj.uid), {'data': 'updated'})])
+
+    assert get_object_or_none(MySimpleModel, uid=obj.uid).data == 'updated'
+
+
+def test_identity_map_not_cached(current_request, django_assert_num_queries):
+    obj = MySimpleModelFactory.create()
+    identity_map = enable_identity_map()
+
+    with django_assert_num_queries(2):
+        get_object_or_none(MySimpleModel.objects.all(), uid=obj.uid)
+        get_object_or_none(MySimpleModel.objects.all(), uid=obj.uid)
+    assert (identity_map.hits, identity_map.misses) == (0, 0)
+
+
+def test_identity_map_setting(current_request, settings):
+    settings.SHORTCUTS_IDENTITY_MAP = True
+
+    assert get_identity_map() is not None
+    assert get_identity_map() is get_identity_map(current_request)
+
+
+def test_identity_map_without_request():
+    assert enable_identity_map() is None
+    assert get_identity_map() is None
@@ -0,0 +1,129 @@
+import io
+import json
+import threading
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+
+from pik.core.shortcuts import import_objects, importing, read_rows
+from .factories import MyRelatedModelFactory, TestNameModelFactory
+from ..models import MyRelatedModel
+
+
+CSV = '''name_id,code,data,unknown
+{name},a,first,x
+{name},b,second,x
+{name},b,second,x
+{name},c,{long},x
+'''
+
+
+@pytest.fixture
+def csv_file():
+    name = TestNameModelFactory.create()
+    MyRelatedModelFactory.create(name=name, code='a', data='old')
+    return io.StringIO(CSV.format(name=name.pk, long='x' * 256))
+
+
+def test_import_objects(csv_file):
+    rejected = io.StringIO()
+
+    stats = import_objects(
+        MyRelatedModel, read_rows(csv_file, 'csv'),
+        key_fields=('name_id', 'code'), chunk_size=2, reject_file=rejected)
+
+    assert (stats.rows, stats.created, stats.updated, stats.unchanged,
+            stats.rejected) == (4, 1, 1, 1, 1)
+    assert stats.rows_per_second > 0
+    assert MyRelatedModel.objects.get(code='a').data == 'first'
+    assert MyRelatedModel.objects.get(code='b').data == 'second'
+    reject = json.loads(rejected.getvalue())
+    assert reject['line'] == 4
+    assert reject['row']['code'] == 'c'
+    assert 'data' in reject['error']
+
+
+def test_import_objects_relation_name():
+    name = TestNameModelFactory.create()
+    MyRelatedModelFactory.create(name=name, code='a', data='old')
+    rows = [{'name': str(name.pk), 'code': code, 'data': 'new'}
+            for code in ('a', 'b')]
+
+    stats = import_objects(
+        MyRelatedModel, rows, key_fields=('name', 'code'))
+
+    assert (stats.created, stats.updated, stats.rejected) == (1, 1, 0)
+    assert set(MyRelatedModel.objects.values_list('code', 'data')) == {
+        ('a', 'new'), ('b', 'new')}
+
+
+def test_import_objects_missing_key():
+    stats = import_objects(
+        MyRelatedModel, [{'data': 'data'}], key_fields=('code', ))
+
+    assert (stats.rows, stats.rejected) == (1, 1)
+
+
+def test_read_rows_jsonl():
+    file = io.StringIO('{"code": "a"}\n\n{"code": "b"}\n')
+    file.name = 'export.jsonl'
+
+    assert list(read_rows(file)) == [{'code': 'a'}, {'code': 'b'}]
+
+
+def test_import_objects_command(csv_file, tmp_path):
+    path = tmp_path / 'export.csv'
+    path.write_text(csv_file.getvalue(), encoding='utf-8')
+    reject_path = tmp_path / 'rejected.jsonl'
+    stdout = io.StringIO()
+
+    call_command(
+        'import_objects', MyRelatedModel._meta.label, str(path),
+        '--key', 'name_id', '--key', 'code',
+        '--reject-file', str(reject_path), stdout=stdout)
+
+    assert '1 created, 1 updated, 1 unchanged, 1 rejected' in \
+        stdout.getvalue()
+    assert len(reject_path.read_text().splitlines()) == 1
+
+
+def test_import_objects_workers_pool(mocker):
+    lock = threading.Lock()
+    written = []
+
+    def write(source, records, batch_size, m2m_replace):
+        with lock:
+            written.extend(records)
+        return [(None, [], True) for _ in records]
+
+    mocker.patch.object(
+        importing, 'bulk_update_or_create_objects', side_effect=write)
+    close_all = mocker.patch.object(importing.connections, 'close_all')
+    rows = [{'code': str(code), 'data': 'data'} for code in range(50)]
+
+    stats = import_objects(
+        MyRelatedModel, rows, key_fields=('code', ), chunk_size=5,
+        workers=2)
+
+    assert (stats.rows, stats.created) == (50, 50)
+    assert sorted(int(values['code']) for _, values in written) == \
+        list(range(50))
+    # every worker chunk closes the connections of its thread
+    assert close_all.call_count == 10
+
+
+@pytest.mark.skipif(
+    connection.vendor == 'sqlite', reason='SQLite locks tables on writes')
+@pytest.mark.django_db(transaction=True)
+def test_import_objects_workers():
+    name = TestNameModelFactory.create()
+    rows = [{'name_id': name.pk, 'code': str(code), 'data': 'data'}
+            for code in range(50)]
+
+    stats = import_objects(
+        MyRelatedModel, rows, key_fields=('name_id', 'code'),
+        chunk_size=10, workers=2)
+
+    assert (stats.rows, stats.created) == (50, 50)
+    assert MyRelatedModel.objects.count() == 50
@@ -0,0 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from pik.core.meta import clear_model_meta, get_model_meta
+from ..models import MyRelatedModel, MySimpleModel
+
+
+def test_model_meta():
+    meta = get_model_meta(MyRelatedModel)
+
+    assert meta.fields['name_id'] is meta.fields['name']
+    assert meta.fields['pk'] is meta.concrete_fields['pk'] is \
+        MyRelatedModel._meta.pk
+    assert meta.concrete_fields['name_id'].name == 'name'
+    assert 'data' in meta.editable_names
+    assert 'version' not in meta.editable_names
+    assert meta.fk_attnames == {'name': 'name_id'}
+    assert ('name', 'code') in meta.unique_groups
+    assert ('uid', ) in meta.unique_groups
+    assert meta.auto_update_names == ('updated', 'version')
+    assert get_model_meta(MySimpleModel).m2m_names == {'names'}
+
+
+def test_model_meta_cached():
+    clear_model_meta()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        metas = list(executor.map(
+            lambda _: get_model_meta(MySimpleModel), range(8)))
+
+    assert all(meta is metas[0] for meta in metas)
+    clear_model_meta()
+    assert get_model_meta(MySimpleModel) is not metas[0]
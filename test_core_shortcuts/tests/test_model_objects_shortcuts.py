@@ -1,17 +1,19 @@
 from unittest.mock import patch
 
 import pytest
+from django.db import connection
 from django.db.models import Q
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils.crypto import get_random_string
 
 from pik.core.shortcuts import (
-    get_object_or_none, validate_and_create_object, validate_and_update_object,
-    update_or_create_object)
+    get_object_or_none, get_objects_or_none, validate_and_create_object, validate_and_update_object,
+    update_or_create_object, upsert_object, bulk_update_or_create_objects)
 from .factories import (
     MySimpleModelFactory, TestNameModelFactory,
-    OverriddenQuerysetModelFactory)
-from ..models import MySimpleModel, OverriddenQuerysetModel
+    OverriddenQuerysetModelFactory, MyRelatedModelFactory)
+from ..models import MySimpleModel, OverriddenQuerysetModel, MyRelatedModel
 
 
 @pytest.fixture(params=[
@@ -65,6 +67,74 @@ def test_get_object_or_none_args(test_model):
     assert obj is not None
 
 
+def test_get_objects_or_none(django_assert_num_queries):
+    objs = MySimpleModelFactory.create_batch(5)
+    missing = get_random_string()
+    keys = [str(obj.uid) for obj in objs] + [missing]
+
+    with django_assert_num_queries(3):
+        result = get_objects_or_none(MySimpleModel, keys, batch_size=2)
+
+    assert result == {
+        **{str(obj.uid): obj for obj in objs}, missing: None}
+
+
+def test_get_objects_or_none_pk():
+    obj = MySimpleModelFactory.create()
+
+    assert get_objects_or_none(MySimpleModel, [obj.pk], field='pk') == {
+        obj.pk: obj}
+
+
+def test_get_objects_or_none_equivalent_keys():
+    obj = MySimpleModelFactory.create()
+    keys = [obj.uid, str(obj.uid), obj.uid.hex]
+
+    assert get_objects_or_none(MySimpleModel, keys) == {
+        key: obj for key in keys}
+
+
+def test_get_objects_or_none_composite():
+    obj1, obj2 = MyRelatedModelFactory.create_batch(2)
+    keys = [(obj1.name, obj1.code), (obj2.name_id, obj2.code),
+            (obj1.name_id, obj2.code)]
+
+    result = get_objects_or_none(
+        MyRelatedModel.objects, keys, field=('name', 'code'))
+
+    assert result == {keys[0]: obj1, keys[1]: obj2, keys[2]: None}
+
+
+def test_get_objects_or_none_composite_default_batch_size():
+    obj = MyRelatedModelFactory.create()
+    keys = [(obj.name_id, str(index)) for index in range(999)]
+    keys.append((obj.name_id, obj.code))
+
+    result = get_objects_or_none(
+        MyRelatedModel.objects, keys, field=('name', 'code'))
+
+    assert result[keys[-1]] == obj
+    assert sum(found is not None for found in result.values()) == 1
+
+
+def test_get_objects_or_none_queryset():
+    obj1, obj2 = MySimpleModelFactory.create_batch(2)
+
+    result = get_objects_or_none(
+        MySimpleModel.objects.exclude(pk=obj2.pk), [obj1.data, obj2.data],
+        field='data')
+
+    assert result == {obj1.data: obj1, obj2.data: None}
+
+
+def test_get_objects_or_none_multiple():
+    obj = MySimpleModelFactory.create()
+    MySimpleModelFactory.create(data=obj.data)
+
+    with pytest.raises(MySimpleModel.MultipleObjectsReturned):
+        get_objects_or_none(MySimpleModel, [obj.data], field='data')
+
+
 def test_validate_and_create_object(test_model):
     name1 = TestNameModelFactory.create()
     name2 = TestNameModelFactory.create()
@@ -110,6 +180,86 @@ def test_validate_and_update_object__no_update(test_model):
     assert name2 in res_obj.names.all()
 
 
+def test_validate_and_update_object__m2m_only(test_model):
+    model, factory = test_model
+    name1 = TestNameModelFactory.create()
+    name2 = TestNameModelFactory.create()
+
+    obj = factory.create(names=(name1, ))
+    kwargs = {'data': obj.data, 'names': [name1, name2]}
+
+    res_obj, updated_keys = validate_and_update_object(obj, **kwargs)
+    assert updated_keys == ['names']
+    assert set(res_obj.names.all()) == {name1, name2}
+
+
+def test_validate_and_update_object__m2m_queries(
+        test_model, django_assert_max_num_queries):
+    model, factory = test_model
+    names = TestNameModelFactory.create_batch(20)
+    obj = factory.create(names=names[:10])
+
+    # current ids and one bulk add (which may select existing ids first)
+    with django_assert_max_num_queries(3):
+        _, updated_keys = validate_and_update_object(obj, names=names)
+    assert updated_keys == ['names']
+    assert obj.names.count() == 20
+
+
+def test_validate_and_update_object__m2m_replace(test_model):
+    model, factory = test_model
+    name1 = TestNameModelFactory.create()
+    name2 = TestNameModelFactory.create()
+    obj = factory.create(names=(name1, ))
+
+    _, updated_keys = validate_and_update_object(
+        obj, m2m_replace=True, names=[name2.pk])
+    assert updated_keys == ['names']
+    assert list(obj.names.all()) == [name2]
+
+    _, updated_keys = validate_and_update_object(
+        obj, m2m_replace=True, names=[name2])
+    assert updated_keys == []
+
+
+def test_validate_and_update_object__fk_by_id(django_assert_num_queries):
+    obj = MyRelatedModel.objects.get(pk=MyRelatedModelFactory.create().pk)
+    name_model = MyRelatedModel._meta.get_field('name').related_model
+
+    with django_assert_num_queries(0):
+        _, updated_keys = validate_and_update_object(
+            obj, name=name_model(pk=obj.name_id), code=obj.code)
+    assert updated_keys == []
+
+
+def test_validate_and_update_object__update_fields():
+    obj = MyRelatedModelFactory.create()
+    MyRelatedModel.objects.filter(pk=obj.pk).update(code='changed')
+    version = obj.version
+
+    with CaptureQueriesContext(connection) as context:
+        _, updated_keys = validate_and_update_object(obj, data='new')
+    assert updated_keys == ['data']
+    table = MyRelatedModel._meta.db_table
+    assert not [
+        query for query in context.captured_queries
+        if query['sql'].startswith('SELECT') and table in query['sql']]
+    obj.refresh_from_db()
+    assert obj.code == 'changed'
+    assert obj.data == 'new'
+    assert obj.version == version + 1
+
+
+def test_validate_and_update_object__unique_together():
+    obj1 = MyRelatedModelFactory.create()
+    obj2 = MyRelatedModelFactory.create(name=obj1.name)
+
+    with pytest.raises(ValueError):
+        validate_and_update_object(obj2, code=obj1.code, data='new')
+    assert obj2.code != obj1.code
+    assert obj2.data != 'new'
+
+
 def test_update_or_create_object__create_without_search(test_model):
     model, _ = test_model
     new_data = get_random_string()
@@ -188,3 +338,213 @@ class TestNotCallM2MUpdate(TestCase):
         assert not is_updated
         assert is_created
         _update_m2m_fields.assert_not_called()
+
+
+def test_bulk_update_or_create_objects():
+    name1 = TestNameModelFactory.create()
+    obj1, obj2 = MySimpleModelFactory.create_batch(2)
+    new_data = get_random_string()
+    records = [
+        (dict(data=obj1.data), {'data': obj1.data}),
+        (dict(data=obj2.data), {'data': new_data}),
+        (dict(data=get_random_string()), {'data': 'created'}),
+        (None, {'data': 'created without search', 'names': [name1]}),
+    ]
+    version, history_count = obj2.version, obj2.history.count()
+
+    results = bulk_update_or_create_objects(MySimpleModel, records)
+
+    assert [result[1:] for result in results] == [
+        ([], False), (['data'], False), ([], True), ([], True)]
+    assert results[0][0].pk == obj1.pk
+    assert results[1][0].pk == obj2.pk
+    obj2.refresh_from_db()
+    assert obj2.data == new_data
+    assert obj2.version == version + 1
+    assert obj2.history.count() == history_count + 1
+    assert obj2.history.first().history_type == '~'
+    created = MySimpleModel.objects.get(data='created')
+    assert created.version == 1
+    assert created.history.get().history_type == '+'
+    assert list(results[3][0].names.all()) == [name1]
+
+
+def test_bulk_update_or_create_objects_without_history(settings):
+    settings.SOFT_DELETE_BATCH_HISTORY = False
+
+    results = bulk_update_or_create_objects(
+        MySimpleModel, [(None, {'data': 'created'})])
+
+    assert not results[0][0].history.exists()
+
+
+def test_bulk_update_or_create_objects_queries(django_assert_num_queries):
+    objs = MySimpleModelFactory.create_batch(10)
+    records = [
+        (dict(data=obj.data), {'data': get_random_string()}) for obj in objs
+    ] + [(None, {'data': get_random_string()}) for _ in range(10)]
+
+    # updates: select, update, history; creates: insert, history;
+    # savepoint and release per chunk
+    with django_assert_num_queries(3 + 2 + 2 * 2):
+        results = bulk_update_or_create_objects(
+            MySimpleModel, records, batch_size=10)
+    assert all(not isinstance(result, ValueError) for result in results)
+    assert MySimpleModel.objects.count() == 20
+
+
+def test_bulk_update_or_create_objects_errors():
+    obj = MySimpleModelFactory.create()
+    records = [
+        (dict(data=obj.data), {'data': 'x' * 256}),
+        (None, {'data': ''}),
+        (dict(data=obj.data), {'data': 'updated'}),
+    ]
+
+    results = bulk_update_or_create_objects(MySimpleModel, records)
+
+    assert isinstance(results[0], ValueError)
+    assert isinstance(results[1], ValueError)
+    assert results[2][1:] == (['data'], False)
+    obj.refresh_from_db()
+    assert obj.data == 'updated'
+
+
+def test_bulk_update_or_create_objects_invalid_keys():
+    obj = MySimpleModelFactory.create()
+    name = TestNameModelFactory.create()
+    records = [
+        (None, {'data': 'created', 'unknown': 1}),
+        (dict(data=obj.data), {'data': 'changed', 'unknown': 1}),
+        (dict(data=obj.data), {'data': obj.data}),
+        (None, {'data': 'created'}),
+    ]
+
+    results = bulk_update_or_create_objects(MySimpleModel, records)
+
+    assert isinstance(results[0], ValueError)
+    assert isinstance(results[1], ValueError)
+    # values of the failed record are not applied to the object
+    assert results[2][1:] == ([], False)
+    assert results[3][1:] == ([], True)
+
+    results = bulk_update_or_create_objects(MyRelatedModel, [
+        (None, {'name': name.pk, 'code': 'code', 'data': 'data'}),
+        (None, {'name': name, 'code': 'code', 'data': 'data'})])
+
+    assert isinstance(results[0], ValueError)
+    assert results[1][1:] == ([], True)
+
+
+def test_bulk_update_or_create_objects_composite_keys():
+    obj = MyRelatedModelFactory.create()
+    records = [
+        (dict(name=obj.name, code=str(index)),
+         {'name': obj.name, 'code': str(index), 'data': 'created'})
+        for index in range(999)]
+    records.append((dict(name=obj.name, code=obj.code), {'data': 'updated'}))
+
+    results = bulk_update_or_create_objects(MyRelatedModel, records)
+
+    assert [result[2] for result in results].count(True) == 999
+    assert results[-1][0].pk == obj.pk
+    assert results[-1][1:] == (['data'], False)
+
+
+def test_bulk_update_or_create_objects_pk_search_keys():
+    obj = MySimpleModelFactory.create()
+
+    results = bulk_update_or_create_objects(MySimpleModel, [
+        (dict(pk=obj.pk), {'data': 'updated'}),
+        (dict(pk=str(obj.pk)), {'data': 'updated'})])
+
+    assert [result[:2] for result in results] == [
+        (obj, ['data']), (obj, [])]
+    obj.refresh_from_db()
+    assert obj.data == 'updated'
+
+
+def test_bulk_update_or_create_objects_same_row():
+    results = bulk_update_or_create_objects(
+        OverriddenQuerysetModel.test_objects, [
+            (dict(name='new'), {'name': 'new'}),
+            (dict(name='new'), {'name': 'new'})])
+
+    assert results[0][0] is results[1][0]
+    assert [result[2] for result in results] == [True, False]
+    assert OverriddenQuerysetModel.test_objects.filter(name='new').count() == 1
+
+
+def test_bulk_update_or_create_objects_integrity_error():
+    obj = MySimpleModelFactory.create()
+    duplicate = MySimpleModel(uid=obj.uid, data=get_random_string())
+    records = [
+        (None, {'data': 'ok'}),
+        (None, {'uid': duplicate.uid, 'data': duplicate.data}),
+    ]
+
+    results = bulk_update_or_create_objects(MySimpleModel, records)
+
+    assert results[0][0].data == 'ok'
+    assert isinstance(results[1], ValueError)
+    assert MySimpleModel.objects.filter(data='ok').count() == 1
+
+
+def test_upsert_object():
+    name = TestNameModelFactory.create()
+    search_keys = dict(name=name, code='code')
+
+    res_obj, updated_keys, is_created = upsert_object(
+        MyRelatedModel, search_keys, data='created')
+    assert is_created
+    assert updated_keys == []
+    assert res_obj.version == 1
+    assert res_obj.history.get().history_type == '+'
+
+    obj, updated_keys, is_created = upsert_object(
+        MyRelatedModel, search_keys, data='updated')
+    assert not is_created
+    assert updated_keys == ['data']
+    assert obj.pk == res_obj.pk
+    assert obj.version == 2
+    assert obj.updated > res_obj.updated
+    assert obj.history.first().history_type == '~'
+
+    obj, updated_keys, is_created = upsert_object(
+        MyRelatedModel, search_keys, data='updated')
+    assert (updated_keys, is_created) == ([], False)
+    obj.refresh_from_db()
+    assert (obj.data, obj.version) == ('updated', 2)
+    assert MyRelatedModel.objects.count() == 1
+
+
+def test_upsert_object_repeated_keys():
+    name = TestNameModelFactory.create()
+    search_keys = dict(name=name, code='code')
+
+    obj, updated_keys, is_created = upsert_object(
+        MyRelatedModel, search_keys, data='created',
+        **search_keys)
+    assert (updated_keys, is_created) == ([], True)
+
+    res_obj, updated_keys, is_created = upsert_object(
+        MyRelatedModel, search_keys, data='updated',
+        **search_keys)
+    assert (updated_keys, is_created) == (['data'], False)
+    assert res_obj.pk == obj.pk
+
+
+def test_upsert_object_errors():
+    name = TestNameModelFactory.create()
+
+    with pytest.raises(ValueError):
+        upsert_object(
+            MyRelatedModel, dict(name=name, code='code'), data='x' * 256)
+    with pytest.raises(ValueError):
+        upsert_object(
+            MyRelatedModel, dict(code='code'), name=name,
+            data='data')
+    with pytest.raises(ValueError):
+        upsert_object(
+            MyRelatedModel, {}, name=name, code='code', data='data')
+    assert not MyRelatedModel.objects.exists()
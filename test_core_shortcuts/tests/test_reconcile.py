@@ -0,0 +1,82 @@
+import io
+
+import pytest
+
+from pik.core.shortcuts import get_objects_or_none, reconcile
+from ..models import MySoftDeletedModel, MySimpleModel
+
+
+@pytest.fixture
+def existing():
+    objs = {
+        code: MySoftDeletedModel.objects.create(code=code, data='old')
+        for code in ('kept', 'changed', 'missing', 'deleted')}
+    objs['deleted'].delete()
+    return objs
+
+
+def test_reconcile(existing):
+    records = [
+        {'code': 'kept', 'data': 'old'},
+        {'code': 'changed', 'data': 'new'},
+        {'code': 'deleted', 'data': 'old'},
+        {'code': 'created', 'data': 'new'},
+        {'data': 'without key'},
+    ]
+    rejected = io.StringIO()
+
+    stats = reconcile(
+        MySoftDeletedModel.objects, records, ('code', ), chunk_size=2,
+        reject_file=rejected)
+
+    assert (stats.rows, stats.created, stats.updated, stats.unchanged,
+            stats.restored, stats.deleted, stats.rejected) == \
+        (5, 1, 1, 1, 1, 1, 1)
+    assert set(MySoftDeletedModel.objects.values_list('code', flat=True)) \
+        == {'kept', 'changed', 'deleted', 'created'}
+    assert MySoftDeletedModel.deleted_objects.get().code == 'missing'
+    assert MySoftDeletedModel.objects.get(code='changed').data == 'new'
+    assert len(rejected.getvalue().splitlines()) == 1
+
+
+def test_reconcile_scope(existing):
+    stats = reconcile(
+        MySoftDeletedModel.objects.filter(code__in=('kept', 'changed')),
+        [{'code': 'kept', 'data': 'old'}], ('code', ))
+
+    assert stats.deleted == 1
+    assert set(MySoftDeletedModel.objects.values_list('code', flat=True)) \
+        == {'kept', 'missing'}
+
+
+def test_reconcile_rows_out_of_scope(existing):
+    other = MySoftDeletedModel.objects.create(code='other', data='other')
+    records = [
+        {'code': 'kept'},
+        {'code': 'deleted'},
+        {'code': 'other'},
+        {'code': 'created'},
+        {'code': 'conflict', 'data': 'other'},
+    ]
+
+    stats = reconcile(
+        MySoftDeletedModel.objects.filter(data='old'), records, ('code', ))
+
+    assert (stats.created, stats.unchanged, stats.restored, stats.deleted,
+            stats.rejected) == (1, 1, 1, 2, 2)
+    other.refresh_from_db()
+    assert (other.data, other.deleted) == ('other', None)
+    assert MySoftDeletedModel.objects.get(code='created').data == 'old'
+    assert not MySoftDeletedModel.all_objects.filter(code='conflict').exists()
+
+
+def test_get_objects_or_none_soft_deleted(existing):
+    result = get_objects_or_none(
+        MySoftDeletedModel, ['kept', 'deleted'], field='code')
+
+    assert result == {'kept': existing['kept'], 'deleted': None}
+
+
+def test_reconcile_not_soft_deleted():
+    with pytest.raises(ValueError):
+        reconcile(MySimpleModel.objects, [], ('data', ))
@@ -40,6 +40,9 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
 
+    'pik.core.shortcuts',
+    'pik.core.soft_deleted',
+
     'test_core_models',
     'test_core_models_fields',
     'test_core_shortcuts',